@@ -0,0 +1,340 @@
+# achievement_backfill.py
+"""
+Recálculo masivo de logros para todos los usuarios.
+
+Al añadir o cambiar un logro, los usuarios existentes solo lo obtendrían en
+su siguiente check-in. Este trabajo recorre los usuarios por bloques de
+user_id (paginación por clave), lee las visitas y los logros ya ganados del
+bloque y reparte la evaluación (achievement_rules.AchievementRules) entre
+un pool de procesos. El proceso principal inserta los UserAchievement nuevos
+con un insert masivo por bloque, en orden, y guarda tras cada uno un
+checkpoint con el último user_id procesado, de modo que una ejecución
+interrumpida continúa donde se quedó.
+
+Los logros ganados se leen de la réplica, que puede ir retrasada, y un
+check-in puede otorgar el mismo logro mientras tanto. Por eso el insert
+vuelve a consultar la primaria dentro de su transacción e ignora los
+conflictos con la restricción única (user_id, achievement_id).
+
+El checkpoint recuerda los logros evaluados: si se relanza con otros, se
+empieza desde el principio; al terminar se borra. Los logros ya ganados
+nunca se duplican, así que repetir el trabajo es seguro.
+
+Uso:
+    python achievement_backfill.py [--achievement-id ID ...] [--workers N]
+        [--chunk-size N] [--checkpoint RUTA] [--reset] [--dry-run]
+"""
+
+import datetime
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sqlalchemy import func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from achievement_rules import AchievementRules
+from models import User, UserAchievement, UserLocationVisit
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_SIZE = int(os.getenv('BACKFILL_CHUNK_SIZE', 5000))
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', os.cpu_count() or 1))
+BACKFILL_CHECKPOINT_PATH = os.getenv(
+    'BACKFILL_CHECKPOINT_PATH', 'achievement_backfill.checkpoint.json'
+)
+
+# Reglas del proceso de evaluación (las fija el inicializador del pool)
+_worker_rules = None
+
+
+def _init_worker(rules):
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _evaluate_chunk(user_ids, visit_user_ids, visit_location_ids, earned):
+    """Pares (user_id, achievement_id) nuevos de un bloque (en el worker)."""
+    return [
+        pair for pair in _worker_rules.evaluate(user_ids, visit_user_ids, visit_location_ids)
+        if pair not in earned
+    ]
+
+
+def load_checkpoint(path, achievement_ids):
+    """Último user_id procesado, o 0 si no hay checkpoint de estas reglas."""
+    try:
+        with open(path, encoding="utf-8") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except FileNotFoundError:
+        return 0
+    except ValueError as e:
+        logger.warning(f"Checkpoint {path} ilegible, se empieza de cero: {e}")
+        return 0
+    if checkpoint.get("achievement_ids") != sorted(achievement_ids):
+        logger.warning(
+            f"El checkpoint {path} es de otros logros "
+            f"({checkpoint.get('achievement_ids')}), se empieza de cero"
+        )
+        return 0
+    return int(checkpoint.get("last_user_id", 0))
+
+
+def save_checkpoint(path, achievement_ids, last_user_id, stats):
+    """Escribe el checkpoint de forma atómica (fichero temporal + rename)."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as checkpoint_file:
+        json.dump({
+            "achievement_ids": sorted(achievement_ids),
+            "last_user_id": last_user_id,
+            "updated_at": datetime.datetime.utcnow().isoformat(),
+            **stats,
+        }, checkpoint_file)
+    os.replace(temp_path, path)
+
+
+def _insert_ignoring_earned(db_session):
+    """INSERT de UserAchievement que omite los pares que ya existen."""
+    dialect = db_session.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement = sqlite.insert(UserAchievement)
+    elif dialect == "postgresql":
+        statement = postgresql.insert(UserAchievement)
+    else:
+        # Sin ON CONFLICT: basta la comprobación previa en la transacción
+        return insert(UserAchievement)
+    return statement.on_conflict_do_nothing(index_elements=["user_id", "achievement_id"])
+
+
+def _unearned_pairs(db_session, awarded):
+    """Pares de awarded que la primaria aún no tiene (dentro de la transacción)."""
+    user_ids = sorted({user_id for user_id, _ in awarded})
+    achievement_ids = sorted({achievement_id for _, achievement_id in awarded})
+    earned = set()
+    for start in range(0, len(user_ids), 500):
+        batch = user_ids[start:start + 500]
+        earned.update(db_session.query(
+            UserAchievement.user_id, UserAchievement.achievement_id
+        ).filter(
+            UserAchievement.user_id.in_(batch),
+            UserAchievement.achievement_id.in_(achievement_ids)
+        ).all())
+    return [pair for pair in awarded if pair not in earned]
+
+
+def _iter_chunks(db_session, achievement_ids, after_user_id, chunk_size):
+    """
+    Bloques de usuarios posteriores a after_user_id.
+
+    Yields:
+        tuple: (user_ids, visit_user_ids, visit_location_ids, ganados), con
+        ganados como conjunto de pares (user_id, achievement_id)
+    """
+    last_user_id = after_user_id
+    while True:
+        user_ids = [row[0] for row in db_session.query(User.user_id)
+                    .filter(User.user_id > last_user_id)
+                    .order_by(User.user_id).limit(chunk_size)]
+        if not user_ids:
+            return
+        first, last = user_ids[0], user_ids[-1]
+        visits = db_session.query(
+            UserLocationVisit.user_id, UserLocationVisit.location_id
+        ).filter(
+            UserLocationVisit.user_id.between(first, last),
+            UserLocationVisit.location_id.isnot(None)
+        ).all()
+        earned = {
+            (user_id, achievement_id)
+            for user_id, achievement_id in db_session.query(
+                UserAchievement.user_id, UserAchievement.achievement_id
+            ).filter(
+                UserAchievement.user_id.between(first, last),
+                UserAchievement.achievement_id.in_(achievement_ids)
+            )
+        }
+        # Cierra la transacción de lectura para no bloquear al escritor (SQLite)
+        db_session.rollback()
+        visit_array = np.array(visits, dtype=np.int64).reshape(-1, 2)
+        # El rango puede incluir visitas de user_id sin fila en users (borrados
+        # o huérfanos): evaluate las asignaría al usuario vecino del bloque
+        user_array = np.array(user_ids, dtype=np.int64)
+        visit_array = visit_array[np.isin(visit_array[:, 0], user_array)]
+        yield (user_array, visit_array[:, 0],
+               visit_array[:, 1], earned)
+        last_user_id = last
+
+
+def run_backfill(rules, read_session_factory, write_session_factory,
+                 workers=BACKFILL_WORKERS, chunk_size=BACKFILL_CHUNK_SIZE,
+                 checkpoint_path=BACKFILL_CHECKPOINT_PATH, dry_run=False,
+                 on_awarded=None):
+    """
+    Evalúa las reglas para todos los usuarios e inserta los logros nuevos.
+
+    Args:
+        rules: AchievementRules con los logros a recalcular
+        read_session_factory, write_session_factory: Fábricas de sesiones
+        workers: Procesos de evaluación (0 o 1: en el propio proceso)
+        checkpoint_path: Fichero de checkpoint (None para no usarlo)
+        dry_run: Cuenta los logros sin insertarlos ni guardar checkpoint
+        on_awarded: Función opcional llamada con los user_id premiados de
+            cada bloque (p. ej. para invalidar cachés)
+
+    Returns:
+        dict: users, awarded, seconds
+    """
+    achievement_ids = rules.achievement_ids
+    if not achievement_ids:
+        logger.warning("No hay logros evaluables; nada que hacer")
+        return {"users": 0, "awarded": 0, "seconds": 0.0}
+
+    after_user_id = 0
+    if checkpoint_path and not dry_run:
+        after_user_id = load_checkpoint(checkpoint_path, achievement_ids)
+        if after_user_id:
+            logger.info(f"Reanudando desde el usuario {after_user_id}")
+
+    read_session = read_session_factory()
+    total_users = read_session.query(func.count(User.user_id)).filter(
+        User.user_id > after_user_id
+    ).scalar() or 0
+    logger.info(
+        f"Recalculando logros {achievement_ids} para {total_users} usuarios "
+        f"(bloques de {chunk_size}, {workers} procesos)"
+    )
+
+    executor = None
+    if workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(rules,)
+        )
+    else:
+        _init_worker(rules)
+
+    stats = {"users": 0, "awarded": 0}
+    start = time.perf_counter()
+    pending = deque()  # (último user_id, nº usuarios, futuro o resultado)
+
+    def _commit_oldest():
+        last_user_id, user_count, result = pending.popleft()
+        awarded = result.result() if executor is not None else result
+        if awarded and not dry_run:
+            now = datetime.datetime.utcnow()
+            write_session = write_session_factory()
+            try:
+                awarded = _unearned_pairs(write_session, awarded)
+                if awarded:
+                    write_session.execute(_insert_ignoring_earned(write_session), [
+                        {"user_id": user_id, "achievement_id": achievement_id,
+                         "unlocked_timestamp": now}
+                        for user_id, achievement_id in awarded
+                    ])
+                write_session.commit()
+            except Exception:
+                write_session.rollback()
+                raise
+            finally:
+                write_session.close()
+            if awarded and on_awarded is not None:
+                on_awarded(sorted({user_id for user_id, _ in awarded}))
+
+        stats["users"] += user_count
+        stats["awarded"] += len(awarded)
+        if checkpoint_path and not dry_run:
+            save_checkpoint(checkpoint_path, achievement_ids, last_user_id, stats)
+
+        elapsed = time.perf_counter() - start
+        rate = stats["users"] / elapsed if elapsed > 0 else 0.0
+        remaining = (total_users - stats["users"]) / rate if rate else 0.0
+        logger.info(
+            f"{stats['users']}/{total_users} usuarios, {stats['awarded']} logros "
+            f"({rate:.0f} usuarios/s, quedan ~{remaining:.0f}s)"
+        )
+
+    try:
+        for user_ids, visit_user_ids, visit_location_ids, earned in _iter_chunks(
+            read_session, achievement_ids, after_user_id, chunk_size
+        ):
+            if executor is not None:
+                result = executor.submit(
+                    _evaluate_chunk, user_ids, visit_user_ids, visit_location_ids, earned
+                )
+            else:
+                result = _evaluate_chunk(user_ids, visit_user_ids, visit_location_ids, earned)
+            pending.append((int(user_ids[-1]), len(user_ids), result))
+            # Limita los bloques en vuelo para no cargar toda la tabla en memoria
+            while len(pending) > max(workers, 1) * 2:
+                _commit_oldest()
+        while pending:
+            _commit_oldest()
+        # Terminado: la próxima ejecución vuelve a recorrer a todos
+        if checkpoint_path and not dry_run and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    finally:
+        read_session.close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    logger.info(
+        f"Recálculo completado: {stats['users']} usuarios, "
+        f"{stats['awarded']} logros nuevos en {stats['seconds']}s"
+        + (" (simulación)" if dry_run else "")
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    from cache import get_cache
+    from catalog import load_catalog_snapshot
+    from geography import load_geography_tree
+    from poblacion_db.session_setup import ReadSessionLocal
+    from sharding import get_shard_router
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Recálculo masivo de logros")
+    parser.add_argument("--achievement-id", type=int, action="append",
+                        help="Logro a recalcular (repetible; por defecto, todos)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_PATH)
+    parser.add_argument("--reset", action="store_true",
+                        help="Ignora el checkpoint y empieza desde el principio")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Solo cuenta los logros que se otorgarían")
+    args = parser.parse_args()
+
+    session = ReadSessionLocal()
+    try:
+        backfill_rules = AchievementRules(
+            load_catalog_snapshot(session), load_geography_tree(session),
+            set(args.achievement_id) if args.achievement_id else None
+        )
+    finally:
+        session.close()
+
+    def _invalidate_users(user_ids):
+        get_cache().invalidate(*(f"user:{user_id}" for user_id in user_ids))
+
+    # Un recorrido por shard, cada uno con su checkpoint
+    router = get_shard_router()
+    for shard in router.shards:
+        checkpoint_path = (f"{args.checkpoint}.shard{shard.index}"
+                           if router.sharded else args.checkpoint)
+        if args.reset and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        run_backfill(
+            backfill_rules, shard.ReadSessionLocal, shard.SessionLocal,
+            workers=args.workers, chunk_size=args.chunk_size,
+            checkpoint_path=checkpoint_path, dry_run=args.dry_run,
+            on_awarded=_invalidate_users,
+        )
@@ -0,0 +1,184 @@
+# achievement_rules.py
+"""
+Reglas de logros evaluadas sobre el conjunto de ubicaciones visitadas.
+
+Cada fila de achievements se evalúa por su tipo en base de datos:
+
+- total_count: al menos target_value ubicaciones visitadas.
+- municipality_count: ubicaciones visitadas en al menos target_value
+  municipios distintos.
+- <nivel>_complete (municipality_complete, island_complete, ...): todas las
+  ubicaciones bajo la entidad target_entity_id del árbol de geografía.
+
+AchievementRules compila las reglas una vez en arrays de numpy (posición
+densa de cada ubicación, municipio de cada posición y una máscara por regla
+de completar) y evalúa bloques enteros de usuarios con bincount, sin bucles
+por usuario. La usan tanto el check-in (un bloque de un usuario, con las
+reglas de get_achievement_rules) como el trabajo de recálculo
+(achievement_backfill.py), así que ambos otorgan exactamente lo mismo.
+"""
+
+import logging
+import threading
+
+import numpy as np
+
+from geography import LEVELS
+
+logger = logging.getLogger(__name__)
+
+# Tipos de regla compilada
+RULE_TOTAL = "total"
+RULE_MUNICIPALITIES = "municipalities"
+RULE_COMPLETE = "complete"
+
+
+def _rule_for_achievement(achievement):
+    """(tipo, umbral, nivel, entidad) de un logro, o None si no es evaluable."""
+    if achievement.type == 'total_count' and achievement.target_value is not None:
+        return RULE_TOTAL, achievement.target_value, None, None
+    if achievement.type == 'municipality_count' and achievement.target_value is not None:
+        return RULE_MUNICIPALITIES, achievement.target_value, None, None
+    if achievement.type and achievement.type.endswith('_complete'):
+        level = achievement.type[:-len('_complete')]
+        if level in LEVELS and achievement.target_entity_id is not None:
+            return RULE_COMPLETE, None, level, achievement.target_entity_id
+    return None
+
+
+class AchievementRules:
+    """Reglas compiladas para evaluar bloques de usuarios con numpy."""
+
+    def __init__(self, catalog, geography, achievement_ids=None):
+        """
+        Args:
+            catalog: CatalogSnapshot (ubicaciones y logros)
+            geography: GeographyTree para las reglas de completar
+            achievement_ids: Limita las reglas a estos logros (por defecto, todos)
+        """
+        self.version = catalog.version
+        self.location_ids = np.array(
+            sorted(loc.location_id for loc in catalog.locations), dtype=np.int64
+        )
+        municipality_by_location = {
+            loc.location_id: loc.municipality_id for loc in catalog.locations
+        }
+        municipality_ids = sorted({
+            m for m in municipality_by_location.values() if m is not None
+        })
+        municipality_position = {m: i for i, m in enumerate(municipality_ids)}
+        # -1 para ubicaciones sin municipio
+        self.location_municipality = np.array([
+            municipality_position.get(municipality_by_location[location_id], -1)
+            for location_id in self.location_ids.tolist()
+        ], dtype=np.int64)
+        self.municipality_count = len(municipality_ids)
+
+        self.rules = []  # (achievement_id, tipo, umbral, máscara)
+        for achievement in catalog.achievements:
+            if achievement_ids is not None and achievement.achievement_id not in achievement_ids:
+                continue
+            rule = _rule_for_achievement(achievement)
+            if rule is None:
+                logger.warning(
+                    f"Logro ID {achievement.achievement_id} ({achievement.type}) "
+                    f"sin regla evaluable. Saltando."
+                )
+                continue
+            kind, threshold, level, entity_id = rule
+            mask = None
+            if kind == RULE_COMPLETE:
+                target = np.array(geography.location_ids(level, entity_id), dtype=np.int64)
+                mask = np.isin(self.location_ids, target)
+                threshold = int(mask.sum())
+                if threshold == 0:
+                    logger.warning(
+                        f"Logro ID {achievement.achievement_id}: {level} "
+                        f"{entity_id} no tiene ubicaciones. Saltando."
+                    )
+                    continue
+            self.rules.append((achievement.achievement_id, kind, int(threshold), mask))
+
+    @property
+    def achievement_ids(self):
+        return [rule[0] for rule in self.rules]
+
+    def evaluate(self, user_ids, visit_user_ids, visit_location_ids):
+        """
+        Logros que cumple cada usuario de un bloque.
+
+        Args:
+            user_ids: Array ordenado con los usuarios del bloque
+            visit_user_ids, visit_location_ids: Visitas del bloque (pares)
+
+        Returns:
+            list: Pares (user_id, achievement_id) cumplidos, ganados o no
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        visit_user_ids = np.asarray(visit_user_ids, dtype=np.int64)
+        visit_location_ids = np.asarray(visit_location_ids, dtype=np.int64)
+        user_count = len(user_ids)
+        if user_count == 0 or not self.rules:
+            return []
+
+        # Pares únicos (usuario, ubicación), como las cuentas con distinct
+        pairs = np.unique(np.stack([
+            np.searchsorted(user_ids, visit_user_ids), visit_location_ids
+        ], axis=1).reshape(-1, 2), axis=0)
+        user_pos, location_ids = pairs[:, 0], pairs[:, 1]
+
+        # Ubicaciones que ya no están en el catálogo solo cuentan en el total
+        if len(self.location_ids):
+            location_pos = np.minimum(
+                np.searchsorted(self.location_ids, location_ids), len(self.location_ids) - 1
+            )
+            known = self.location_ids[location_pos] == location_ids
+        else:
+            location_pos = np.zeros(len(location_ids), dtype=np.int64)
+            known = np.zeros(len(location_ids), dtype=bool)
+
+        totals = np.bincount(user_pos, minlength=user_count)
+        municipalities = None
+        unlocked = []
+        for achievement_id, kind, threshold, mask in self.rules:
+            if kind == RULE_TOTAL:
+                counts = totals
+            elif kind == RULE_MUNICIPALITIES:
+                if municipalities is None:
+                    municipality = self.location_municipality[location_pos[known]]
+                    with_municipality = municipality >= 0
+                    codes = np.unique(
+                        user_pos[known][with_municipality] * (self.municipality_count + 1)
+                        + municipality[with_municipality]
+                    )
+                    municipalities = np.bincount(
+                        codes // (self.municipality_count + 1), minlength=user_count
+                    )
+                counts = municipalities
+            else:
+                in_target = known.copy()
+                in_target[known] = mask[location_pos[known]]
+                counts = np.bincount(user_pos[in_target], minlength=user_count)
+            for position in np.flatnonzero(counts >= threshold).tolist():
+                unlocked.append((int(user_ids[position]), achievement_id))
+        return unlocked
+
+
+_rules = None
+_rules_geography = None
+_rules_lock = threading.Lock()
+
+
+def get_achievement_rules(catalog, geography):
+    """Reglas de todos los logros de la versión actual del catálogo y del árbol."""
+    global _rules, _rules_geography
+    cached = _rules
+    if (cached is not None and cached.version == catalog.version
+            and _rules_geography is geography):
+        return cached
+    with _rules_lock:
+        if (_rules is None or _rules.version != catalog.version
+                or _rules_geography is not geography):
+            _rules = AchievementRules(catalog, geography)
+            _rules_geography = geography
+        return _rules
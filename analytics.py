@@ -0,0 +1,419 @@
+# analytics.py
+"""
+Analítica para socios (patronato de turismo) calculada sobre instantáneas.
+
+Periódicamente se copia el log de check-ins (visit_history) unido a
+locations/municipalities a un frame columnar en memoria (arrays de numpy)
+leyendo de la réplica, y se preagregan las series que sirven las rutas
+/analytics. Así las agregaciones nunca bloquean la base de datos que atiende
+/checkin.
+
+Las cifras cuentan check-ins aceptados, incluidas las visitas repetidas, en
+UTC. Los meses ya archivados se leen de sus ficheros (VISIT_ARCHIVE_DIR).
+De los meses anteriores al primero del log solo hay primeras visitas
+(user_location_visits), y son las que se cuentan para ese periodo.
+
+El log y las visitas se copian en páginas cortas por clave, cada una en su
+transacción, para no retener el bloqueo de lectura de SQLite.
+
+Cada worker que sirve /analytics rehace su instantánea en segundo plano cada
+ANALYTICS_REFRESH_SECONDS, haya peticiones o no; mientras tanto se sigue
+sirviendo la anterior.
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select
+
+from models import Location, Municipality, UserLocationVisit
+from visit_history import (
+    archive_dir_for_shard, iter_archived_events, list_partitions, partition_table
+)
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_REFRESH_SECONDS = int(os.getenv('ANALYTICS_REFRESH_SECONDS', 900))
+# Filas por transacción de lectura al copiar el log (ver _paged_rows)
+ANALYTICS_PAGE_SIZE = int(os.getenv('ANALYTICS_PAGE_SIZE', 20000))
+SECONDS_PER_DAY = 86400
+EPOCH = datetime.date(1970, 1, 1)
+GRANULARITIES = ("day", "week")
+
+
+def day_number(date):
+    """Días desde 1970-01-01 de una fecha."""
+    return (date - EPOCH).days
+
+
+def _group_counts(groups, periods):
+    """
+    Cuenta ocurrencias por (grupo, periodo).
+
+    Returns:
+        dict: grupo -> (periodos ordenados, cuentas)
+    """
+    if not len(groups):
+        return {}
+    codes = (groups.astype(np.int64) << 32) | periods.astype(np.int64)
+    unique_codes, counts = np.unique(codes, return_counts=True)
+    unique_groups = unique_codes >> 32
+    unique_periods = unique_codes & 0xFFFFFFFF
+    boundaries = np.flatnonzero(np.diff(unique_groups)) + 1
+    result = {}
+    starts = np.concatenate(([0], boundaries))
+    for start, group_periods, group_counts in zip(
+        starts, np.split(unique_periods, boundaries), np.split(counts, boundaries)
+    ):
+        result[int(unique_groups[start])] = (group_periods, group_counts)
+    return result
+
+
+class AnalyticsSnapshot:
+    """Frame columnar de visitas con agregados precalculados."""
+
+    def __init__(self, location_ids, timestamps, locations, municipalities):
+        """
+        Args:
+            location_ids: Array de location_id por visita
+            timestamps: Array de instantes (segundos epoch UTC) por visita
+            locations: dict location_id -> (nombre, municipality_id, lat, lng)
+            municipalities: dict municipality_id -> nombre
+        """
+        self.generated_at = time.time()
+        self.locations = locations
+        self.municipalities = municipalities
+        self.total_visits = int(len(location_ids))
+
+        days = timestamps // SECONDS_PER_DAY
+        # El 1970-01-01 fue jueves: se alinea cada semana a su lunes
+        weeks = days - (days + 3) % 7
+        hours = (timestamps // 3600) % 24
+
+        self.series = {
+            "day": _group_counts(location_ids, days),
+            "week": _group_counts(location_ids, weeks),
+        }
+        self.total_series = {
+            granularity: np.unique(periods, return_counts=True)
+            for granularity, periods in (("day", days), ("week", weeks))
+        }
+
+        # Fila de cada visita en la matriz de horas (ubicaciones ordenadas por id)
+        self.location_order = tuple(sorted(locations))
+        self._row_by_location = {
+            location_id: row for row, location_id in enumerate(self.location_order)
+        }
+        sorted_ids = np.array(self.location_order, dtype=np.int64)
+        rows = np.searchsorted(sorted_ids, location_ids)
+        known = rows < len(sorted_ids)
+        known[known] = sorted_ids[rows[known]] == location_ids[known]
+        self.hours_by_location = np.zeros((len(sorted_ids), 24), dtype=np.int64)
+        np.add.at(self.hours_by_location, (rows[known], hours[known]), 1)
+        self.visits_by_location = self.hours_by_location.sum(axis=1)
+        self.total_hours = np.bincount(hours, minlength=24)[:24]
+
+    def visits_series(self, granularity="day", location_id=None,
+                      date_from=None, date_to=None):
+        """
+        Serie temporal de visitas.
+
+        Returns:
+            list: [{"period": "AAAA-MM-DD", "visits": n}, ...]
+        """
+        if location_id is None:
+            periods, counts = self.total_series[granularity]
+        else:
+            periods, counts = self.series[granularity].get(
+                location_id, (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+            )
+        mask = np.ones(len(periods), dtype=bool)
+        if date_from is not None:
+            mask &= periods >= day_number(date_from)
+        if date_to is not None:
+            mask &= periods <= day_number(date_to)
+        return [
+            {"period": (EPOCH + datetime.timedelta(days=int(period))).isoformat(),
+             "visits": int(count)}
+            for period, count in zip(periods[mask], counts[mask])
+        ]
+
+    def popular_hours(self, location_id=None):
+        """Visitas por hora del día (UTC), de 0 a 23."""
+        if location_id is None:
+            counts = self.total_hours
+        else:
+            row = self._row_by_location.get(location_id)
+            if row is None:
+                counts = np.zeros(24, dtype=np.int64)
+            else:
+                counts = self.hours_by_location[row]
+        return [{"hour": hour, "visits": int(count)} for hour, count in enumerate(counts)]
+
+    def heatmap(self):
+        """
+        Visitas por municipio (con centroide de sus ubicaciones) y por ubicación.
+
+        Returns:
+            dict: municipalities y locations con coordenadas y visitas
+        """
+        municipality_totals = {}
+        location_points = []
+        for location_id, visits in zip(self.location_order, self.visits_by_location):
+            name, municipality_id, latitude, longitude = self.locations[location_id]
+            entry = municipality_totals.setdefault(
+                municipality_id, {"visits": 0, "latitudes": [], "longitudes": []}
+            )
+            entry["visits"] += int(visits)
+            entry["latitudes"].append(latitude)
+            entry["longitudes"].append(longitude)
+            location_points.append({
+                "location_id": location_id,
+                "name": name,
+                "latitude": latitude,
+                "longitude": longitude,
+                "visits": int(visits),
+            })
+
+        municipalities_list = [
+            {
+                "municipality_id": municipality_id,
+                "municipality_name": self.municipalities.get(municipality_id),
+                "visits": entry["visits"],
+                "latitude": float(np.mean(entry["latitudes"])),
+                "longitude": float(np.mean(entry["longitudes"])),
+            }
+            for municipality_id, entry in sorted(municipality_totals.items())
+        ]
+        return {"municipalities": municipalities_list, "locations": location_points}
+
+    def daily_rows(self):
+        """Filas (location_id, ubicación, municipio, fecha, visitas) para exportar."""
+        for location_id in self.location_order:
+            name, municipality_id, _, _ = self.locations[location_id]
+            periods, counts = self.series["day"].get(location_id, ((), ()))
+            for period, count in zip(periods, counts):
+                yield (
+                    location_id, name, self.municipalities.get(municipality_id),
+                    (EPOCH + datetime.timedelta(days=int(period))).isoformat(),
+                    int(count),
+                )
+
+
+def _append_columns(rows, location_ids, timestamps):
+    """Añade filas (location_id, instante UTC sin zona) a las columnas."""
+    for location_id, timestamp in rows:
+        location_ids.append(location_id)
+        timestamps.append(int(timestamp.replace(
+            tzinfo=datetime.timezone.utc
+        ).timestamp()))
+
+
+def _paged_rows(db_session, key, columns, *criteria):
+    """
+    Filas (columns) en páginas de ANALYTICS_PAGE_SIZE por clave creciente.
+
+    Cada página es su propia transacción de lectura: con SQLite (sin WAL) una
+    lectura larga retiene el bloqueo compartido y los commits de /checkin
+    esperarían a que terminara la copia entera.
+    """
+    last_key = None
+    while True:
+        statement = select(key, *columns).where(*criteria)
+        if last_key is not None:
+            statement = statement.where(key > last_key)
+        rows = db_session.execute(
+            statement.order_by(key).limit(ANALYTICS_PAGE_SIZE)
+        ).all()
+        db_session.rollback()
+        yield from (row[1:] for row in rows)
+        if len(rows) < ANALYTICS_PAGE_SIZE:
+            return
+        last_key = rows[-1][0]
+
+
+def _month_start(month):
+    """Primer instante de un mes AAAAMM."""
+    return datetime.datetime(int(month[:4]), int(month[4:]), 1)
+
+
+def load_visit_columns(db_session, archive_dir=None):
+    """
+    Columnas (location_ids, timestamps epoch) de los check-ins de una base de datos.
+
+    Args:
+        archive_dir: Directorio con los meses archivados de esta base de
+            datos (visit_history.archive_dir_for_shard), o None
+
+    Lee los meses archivados, las particiones del log de eventos y, de los
+    meses anteriores al primero del log, las primeras visitas.
+    """
+    location_ids = []
+    timestamps = []
+    first_month = None
+    if archive_dir is not None:
+        for month, chunk in iter_archived_events(
+            archive_dir, ("location_id", "event_timestamp")
+        ):
+            first_month = min(first_month or month, month)
+            _append_columns(
+                zip(chunk["location_id"], chunk["event_timestamp"]),
+                location_ids, timestamps
+            )
+
+    partitions = list_partitions(db_session.get_bind())
+    db_session.rollback()
+    for month, name in partitions:
+        first_month = min(first_month or month, month)
+        table = partition_table(name)
+        _append_columns(
+            _paged_rows(db_session, table.c.event_id,
+                        (table.c.location_id, table.c.event_timestamp)),
+            location_ids, timestamps
+        )
+
+    # Meses enteros: la primera visita y su evento son del mismo check-in
+    criteria = [UserLocationVisit.visit_timestamp.isnot(None),
+                UserLocationVisit.location_id.isnot(None)]
+    if first_month is not None:
+        criteria.append(UserLocationVisit.visit_timestamp < _month_start(first_month))
+    _append_columns(
+        _paged_rows(db_session, UserLocationVisit.visit_id,
+                    (UserLocationVisit.location_id, UserLocationVisit.visit_timestamp),
+                    *criteria),
+        location_ids, timestamps
+    )
+    return location_ids, timestamps
+
+
+def build_analytics_snapshot(db_session, visit_columns=None):
+    """
+    Copia las visitas y el catálogo necesario a un AnalyticsSnapshot.
+
+    Args:
+        db_session: Sesión de SQLAlchemy de lectura
+        visit_columns: Lista de resultados de load_visit_columns (uno por
+            shard); por defecto, las visitas de db_session
+    """
+    locations = {
+        location_id: (name, municipality_id, latitude, longitude)
+        for location_id, name, municipality_id, latitude, longitude in db_session.query(
+            Location.location_id, Location.name, Location.municipality_id,
+            Location.latitude, Location.longitude
+        ).order_by(Location.location_id)
+    }
+    municipalities = dict(db_session.query(
+        Municipality.municipality_id, Municipality.name
+    ))
+
+    if visit_columns is None:
+        visit_columns = [load_visit_columns(db_session)]
+
+    return AnalyticsSnapshot(
+        np.concatenate([np.array(ids, dtype=np.int64) for ids, _ in visit_columns]),
+        np.concatenate([np.array(times, dtype=np.int64) for _, times in visit_columns]),
+        locations, municipalities
+    )
+
+
+_snapshot = None
+_refreshing = False
+_timer = None
+_lock = threading.Lock()
+# La primera instantánea la genera una sola petición; las demás la esperan
+_first_build_lock = threading.Lock()
+
+
+def refresh_analytics_snapshot():
+    """Reconstruye la instantánea leyendo de la réplica."""
+    global _snapshot, _refreshing
+    from poblacion_db.session_setup import ReadSessionLocal
+    from sharding import get_shard_router
+
+    start = time.perf_counter()
+    router = get_shard_router()
+    db = ReadSessionLocal()
+    try:
+        # Las visitas de cada shard se leen en paralelo
+        snapshot = build_analytics_snapshot(
+            db, router.scatter_gather(
+                lambda session, shard: load_visit_columns(
+                    session, archive_dir_for_shard(shard.index, router.sharded)
+                ),
+                with_shard=True,
+            )
+        )
+        _snapshot = snapshot
+        logger.info(
+            f"Instantánea de analítica generada: {snapshot.total_visits} visitas "
+            f"en {(time.perf_counter() - start) * 1000:.0f}ms"
+        )
+        return snapshot
+    except Exception as e:
+        logger.error(f"Error al generar la instantánea de analítica: {e}")
+        raise
+    finally:
+        db.close()
+        with _lock:
+            _refreshing = False
+
+
+def _refresh_periodically():
+    """Hilo del worker que rehace la instantánea cada ANALYTICS_REFRESH_SECONDS."""
+    global _refreshing
+    while True:
+        time.sleep(ANALYTICS_REFRESH_SECONDS)
+        with _lock:
+            if _refreshing:
+                continue
+            _refreshing = True
+        try:
+            refresh_analytics_snapshot()
+        except Exception:
+            pass  # Ya registrado; se reintenta en el siguiente ciclo
+
+
+def _start_refresh_timer():
+    """Arranca el refresco periódico (una vez por proceso, tras el fork)."""
+    global _timer
+    with _lock:
+        if _timer is not None:
+            return
+        _timer = threading.Thread(
+            target=_refresh_periodically, name="analytics-timer", daemon=True
+        )
+        _timer.start()
+
+
+def get_analytics_snapshot():
+    """
+    Devuelve la instantánea vigente. La primera se genera en el momento y
+    arranca el refresco periódico; si la vigente está caducada (el refresco
+    falla o se retrasa), se lanza uno en segundo plano y se sirve la actual.
+    """
+    global _refreshing
+    snapshot = _snapshot
+    if snapshot is None:
+        with _first_build_lock:
+            if _snapshot is not None:
+                return _snapshot
+            _start_refresh_timer()
+            with _lock:
+                _refreshing = True
+            return refresh_analytics_snapshot()
+
+    # Caducada: el temporizador no la ha rehecho en dos intervalos
+    if time.time() - snapshot.generated_at > 2 * ANALYTICS_REFRESH_SECONDS:
+        with _lock:
+            start_refresh = not _refreshing
+            _refreshing = True
+        if start_refresh:
+            threading.Thread(
+                target=refresh_analytics_snapshot, name="analytics-refresh",
+                daemon=True
+            ).start()
+    return snapshot
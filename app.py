@@ -4,15 +4,25 @@ API Flask para la aplicación TenerifeApp.
 Maneja usuarios, ubicaciones, check-ins y logros.
 """
 
+import csv
+import datetime
+import io
+import json
 import logging
+import math
 import os
 import sys
+import threading
+import time
 from contextlib import contextmanager
-from flask import Flask, jsonify, request
-from sqlalchemy import distinct, func, or_
-from sqlalchemy.orm import joinedload
+from flask import (
+    Flask, Response, after_this_request, g, has_request_context, jsonify, request
+)
+from werkzeug.middleware.proxy_fix import ProxyFix
+import numpy as np
+from sqlalchemy import distinct, func, insert
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
-from geopy.distance import geodesic
 
 # Configuración de logging
 logging.basicConfig(
@@ -34,7 +44,42 @@ try:
         Location, Municipality, User, UserLocationVisit,
         Achievement, UserAchievement, engine as models_engine
     )
-    from poblacion_db.session_setup import SessionLocal
+    from sharding import get_shard_router
+    from serializers import (
+        VISITED_LOCATION_ENCODER, dumps, json_response, json_array_response,
+        json_bytes_response
+    )
+    from catalog import get_catalog, location_list_payload, reload_catalog_data
+    from geography import LEVELS, get_geography
+    from auth_tokens import (
+        ADMIN_TOKEN, event_stream_user_ids, is_admin_token, issue_token
+    )
+    from checkin_service import (
+        CHECKIN_CONFLICT_RESPONSE, CHECKIN_RADIUS_METERS,
+        check_and_award_achievements, checkin_ip_limiter, checkin_rate_key,
+        checkin_user_limiter,
+        get_user_stats, parse_checkin_request, process_checkin,
+        publish_checkin_events, validate_coordinates
+    )
+    from cache import get_cache
+    from read_your_writes import (
+        READ_YOUR_WRITES_SECONDS, RECENT_WRITE_COOKIE, has_recent_write,
+        mark_recent_write
+    )
+    from covisitation import get_covisitation_index, get_covisitation_index_if_ready
+    from visit_history import record_checkin_events
+    from trace_checkin import detect_visits, get_geofence_index
+    from geofence import get_geofences
+    from analytics import GRANULARITIES, get_analytics_snapshot
+    from event_bus import format_sse, get_event_bus
+    from profiler import get_profiler
+    from sync import (
+        build_sync_payload, current_sync_version, encode_body, negotiate_encoding
+    )
+    from rate_limit import retry_after_header
+    from route_planner import (
+        DEFAULT_RADIUS_METERS, plan_route, select_candidates
+    )
     engine = models_engine
     logger.info("Módulos importados correctamente desde models.py y poblacion_db.session_setup")
 except ImportError as e:
@@ -45,43 +90,120 @@ except ImportError as e:
     )
 
 # Constantes y Configuraciones Globales
-CHECKIN_RADIUS_METERS = 4000
-
-ACHIEVEMENTS_DEFINITIONS = [
-    {
-        "id": 1,
-        "name": "Novato Explorador",
-        "description": "Visita tu primera ubicación única.",
-        "criteria": {"type": "total_unique_visits", "count": 1}
-    },
-    {
-        "id": 2,
-        "name": "Explorador Entusiasta",
-        "description": "Visita 5 ubicaciones únicas.",
-        "criteria": {"type": "total_unique_visits", "count": 5}
-    },
-    {
-        "id": 3,
-        "name": "Conquistador de Municipios (1)",
-        "description": "Visita ubicaciones en 1 municipio diferente.",
-        "criteria": {"type": "unique_municipalities", "count": 1}
-    },
-    {
-        "id": 4,
-        "name": "Conquistador de Municipios (3)",
-        "description": "Visita ubicaciones en 3 municipios diferentes.",
-        "criteria": {"type": "unique_municipalities", "count": 3}
-    },
-]
+# Trazas GPS (POST /checkin/trace): permanencia continua mínima dentro del
+# radio para contar la visita y tamaño máximo de la traza
+TRACE_MIN_DWELL_SECONDS = float(os.getenv('TRACE_MIN_DWELL_SECONDS', 120))
+TRACE_MAX_POINTS = int(os.getenv('TRACE_MAX_POINTS', 20000))
+# Ventana admitida para los instantes de la traza respecto a ahora: trazas
+# grabadas sin conexión de hasta unos días y un pequeño desfase de reloj
+TRACE_MAX_AGE_SECONDS = float(os.getenv('TRACE_MAX_AGE_SECONDS', 7 * 86400))
+TRACE_MAX_FUTURE_SECONDS = float(os.getenv('TRACE_MAX_FUTURE_SECONDS', 300))
+
+# TTL de las respuestas por usuario en caché (las escrituras las invalidan antes)
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 300))
+
+# Intervalo de los comentarios keep-alive en las conexiones SSE de /events
+EVENT_HEARTBEAT_SECONDS = float(os.getenv('EVENT_HEARTBEAT_SECONDS', 15))
+
+# Conexiones SSE de /events por worker. Cada una ocupa un hilo de gunicorn
+# (GUNICORN_THREADS, ver gunicorn.conf.py) mientras el cliente siga
+# conectado, así que por defecto solo la mitad de los hilos puede servir
+# eventos y el resto queda para las demás rutas. Para muchos clientes,
+# asgi_app.py sirve /events sin ocupar hilos.
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 4))
+EVENT_MAX_SUBSCRIBERS = int(os.getenv(
+    'EVENT_MAX_SUBSCRIBERS', max(1, GUNICORN_THREADS // 2)
+))
+
+# Proxies inversos de confianza delante de la API (nginx, balanceador). Con
+# N > 0 se toman la IP y el esquema del cliente de los N últimos valores de
+# X-Forwarded-For/-Proto; sin proxy debe ser 0 o cualquiera podría falsear
+# la IP que usan los límites de check-in
+PROXY_FIX_HOPS = int(os.getenv('PROXY_FIX_HOPS', 0))
 
 app = Flask(__name__)
+if PROXY_FIX_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS, x_proto=PROXY_FIX_HOPS)
+
+get_cache().on_invalidate("catalog", reload_catalog_data)
+
+
+def _replicate_catalog_to_shards():
+    """Copia el catálogo modificado a los shards sin bloquear la petición."""
+    threading.Thread(
+        target=get_shard_router().replicate_catalog_on_change,
+        name="catalog-replication", daemon=True
+    ).start()
+
+
+if get_shard_router().sharded:
+    get_cache().on_invalidate("catalog", _replicate_catalog_to_shards)
+
+profiler = get_profiler()
+
+
+@app.before_request
+def _profiler_begin_request():
+    """Apunta la petición en el perfilador (solo con una sesión activa)."""
+    profiler.sync()
+    if profiler.active and not request.path.startswith('/admin/'):
+        profiler.begin_request(
+            request.url_rule.rule if request.url_rule else None, request.endpoint
+        )
+
+
+@app.teardown_request
+def _profiler_end_request(exc):
+    if profiler.active:
+        profiler.end_request()
+
+
+def _mark_recent_write(user_id):
+    """Abre la ventana read-your-writes del usuario y envía su cookie."""
+    cookie = mark_recent_write(user_id)
+
+    @after_this_request
+    def _set_recent_write_cookie(response):
+        response.set_cookie(
+            RECENT_WRITE_COOKIE, cookie, max_age=math.ceil(READ_YOUR_WRITES_SECONDS),
+            httponly=True, samesite='Lax'
+        )
+        return response
+
+
+def _has_recent_write(user_id):
+    """Indica si el usuario de la petición está en su ventana read-your-writes."""
+    if user_id is None or not has_request_context():
+        return has_recent_write(user_id)
+    # Una consulta al backend compartido por petición y usuario
+    checked = g.setdefault('recent_writes', {})
+    if user_id not in checked:
+        checked[user_id] = has_recent_write(
+            user_id, request.cookies.get(RECENT_WRITE_COOKIE)
+        )
+    return checked[user_id]
 
 
 # Context Manager para Sesiones de Base de Datos
 @contextmanager
-def get_db():
-    """Context manager para sesiones de base de datos."""
-    db = SessionLocal()
+def get_db(readonly=False, user_id=None, shard=None):
+    """
+    Context manager para sesiones de base de datos.
+
+    Args:
+        readonly: Si es True, usa la réplica de lectura
+        user_id: Usuario de la petición; elige su shard y, si escribió
+            recientemente, la lectura se sirve desde la primaria del shard
+        shard: Shard explícito (p. ej. el del nombre de usuario al registrarse)
+
+    Sin user_id ni shard la sesión es de la base de datos del catálogo.
+    """
+    router = get_shard_router()
+    if shard is None and user_id is not None:
+        shard = router.shard_for(user_id)
+    db = router.session_factory(
+        shard, readonly and not _has_recent_write(user_id)
+    )()
     try:
         yield db
     except Exception:
@@ -92,90 +214,86 @@ def get_db():
 
 
 # Funciones de Ayuda
-def _validate_coordinates(latitude, longitude):
-    """Valida que las coordenadas estén en rangos válidos."""
-    if not (-90 <= latitude <= 90):
-        raise ValueError("Latitud debe estar entre -90 y 90")
-    if not (-180 <= longitude <= 180):
-        raise ValueError("Longitud debe estar entre -180 y 180")
-    return True
+def _user_cache_tags(user_id):
+    """Etiquetas de las entradas de caché derivadas de un usuario."""
+    return (f"user:{user_id}", "catalog")
 
 
-def _get_user_stats(db_session, user_id):
+def _cached_user_entry(key, compute, user_id, tags):
     """
-    Obtiene estadísticas del usuario.
-    
-    Returns:
-        dict: Diccionario con unique_visits_count y unique_municipalities_count
+    Entrada de caché de un usuario. En su ventana read-your-writes se
+    calcula desde la primaria y no se lee ni se guarda en la caché.
     """
-    unique_visits_count = db_session.query(
-        func.count(distinct(UserLocationVisit.location_id))
-    ).filter(UserLocationVisit.user_id == user_id).scalar() or 0
+    if _has_recent_write(user_id):
+        return compute()
+    return get_cache().get_or_set(key, compute, ttl=USER_CACHE_TTL, tags=tags)
 
-    unique_municipalities_count = db_session.query(
-        func.count(distinct(Location.municipality_id))
-    ).join(
-        UserLocationVisit, Location.location_id == UserLocationVisit.location_id
-    ).filter(UserLocationVisit.user_id == user_id).scalar() or 0
 
-    return {
-        "unique_visits_count": unique_visits_count,
-        "unique_municipalities_count": unique_municipalities_count
-    }
+def _visited_location_ids(user_id):
+    """
+    Ubicaciones visitadas por el usuario, desde la caché.
 
+    Returns:
+        frozenset, o None si el usuario no existe
+    """
+    def compute():
+        with get_db(readonly=True, user_id=user_id) as db:
+            if not db.query(User.user_id).filter(User.user_id == user_id).first():
+                return dumps(None)
+            return dumps(sorted(
+                location_id for (location_id,) in db.query(
+                    UserLocationVisit.location_id
+                ).filter(UserLocationVisit.user_id == user_id)
+            ))
+
+    visited = json.loads(_cached_user_entry(
+        f"visited:{user_id}", compute, user_id, (f"user:{user_id}",)
+    ))
+    return frozenset(visited) if visited is not None else None
+
+
+def _parse_trace_timestamp(value):
+    """Segundos epoch de un instante dado como número o ISO 8601 (UTC por defecto)."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        moment = datetime.datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=datetime.timezone.utc)
+        try:
+            return moment.timestamp()
+        except OverflowError:
+            raise ValueError(f"timestamp fuera de rango: {value!r}")
+    raise ValueError(f"timestamp no válido: {value!r}")
 
-def _check_and_award_achievements(db_session, user_id, user_stats):
+
+def _validate_trace_timestamps(timestamps, now):
     """
-    Verifica y otorga logros al usuario basándose en sus estadísticas.
-    
-    Returns:
-        list: Lista de logros recién desbloqueados
+    Comprueba que los instantes sean finitos y estén cerca de ahora.
+
+    Evita errores al convertirlos a fecha y particiones del historial de
+    meses absurdos (el mes de cada evento decide su tabla).
     """
-    earned_achievement_ids = {
-        ua.achievement_id
-        for ua in db_session.query(UserAchievement.achievement_id)
-        .filter_by(user_id=user_id).all()
-    }
-    newly_unlocked_achievements = []
-
-    for achievement_def in ACHIEVEMENTS_DEFINITIONS:
-        achievement_id = achievement_def['id']
-        achievement_in_db = db_session.query(Achievement).filter_by(
-            achievement_id=achievement_id
-        ).first()
-
-        if not achievement_in_db:
-            logger.warning(f"Logro ID {achievement_id} no encontrado en DB. Saltando.")
-            continue
-
-        if achievement_in_db.achievement_id in earned_achievement_ids:
-            continue
-
-        criteria = achievement_def.get('criteria', {})
-        criteria_type = criteria.get('type')
-        required_count = criteria.get('count')
-        is_unlocked = False
-
-        if criteria_type == 'total_unique_visits' and required_count is not None:
-            if user_stats['unique_visits_count'] >= required_count:
-                is_unlocked = True
-        elif criteria_type == 'unique_municipalities' and required_count is not None:
-            if user_stats['unique_municipalities_count'] >= required_count:
-                is_unlocked = True
-
-        if is_unlocked:
-            new_user_achievement = UserAchievement(
-                user_id=user_id,
-                achievement_id=achievement_in_db.achievement_id
-            )
-            db_session.add(new_user_achievement)
-            newly_unlocked_achievements.append({
-                "id": achievement_in_db.achievement_id,
-                "name": achievement_in_db.name,
-                "description": achievement_in_db.description
-            })
+    if not np.all(np.isfinite(timestamps)):
+        raise ValueError("timestamp no finito")
+    if timestamps.min() < now - TRACE_MAX_AGE_SECONDS:
+        raise ValueError(
+            f"timestamp anterior a {TRACE_MAX_AGE_SECONDS / 86400:g} días"
+        )
+    if timestamps.max() > now + TRACE_MAX_FUTURE_SECONDS:
+        raise ValueError("timestamp en el futuro")
 
-    return newly_unlocked_achievements
+
+def _limit_arg(default=10, maximum=50):
+    """Parámetro ?limit= acotado entre 1 y maximum."""
+    return max(1, min(request.args.get('limit', default=default, type=int), maximum))
+
+
+def _rate_limited_response(retry_after):
+    """Respuesta 429 con cabecera Retry-After."""
+    return jsonify({
+        "message": "Demasiados check-ins. Inténtalo de nuevo más tarde."
+    }), 429, {"Retry-After": retry_after_header(retry_after)}
 
 
 # Endpoints de la API
@@ -184,42 +302,60 @@ def _check_and_award_achievements(db_session, user_id, user_stats):
 def get_locations_list_route():
     """Obtiene lista de ubicaciones con filtros opcionales."""
     municipality_id = request.args.get('municipality_id', type=int)
+    island_id = request.args.get('island_id', type=int)
+    province_id = request.args.get('province_id', type=int)
     search_query = request.args.get('q', type=str)
 
-    with get_db() as db:
-        query = db.query(Location, Municipality).join(
-            Municipality, Location.municipality_id == Municipality.municipality_id
-        )
+    # Se sirve desde la instantánea del catálogo (ya ordenada por nombre)
+    catalog = get_catalog()
+    if municipality_id is not None:
+        locations = catalog.locations_by_municipality.get(municipality_id, ())
+    else:
+        locations = catalog.locations
 
-        if municipality_id is not None:
-            query = query.filter(Location.municipality_id == municipality_id)
+    # Filtros por isla/provincia resueltos en el árbol de geografía
+    for level, entity_id in (("island", island_id), ("province", province_id)):
+        if entity_id is not None:
+            municipality_ids = get_geography().municipality_ids(level, entity_id)
+            locations = [loc for loc in locations
+                         if loc.municipality_id in municipality_ids]
 
-        if search_query and search_query.strip():
-            search_term = f"%{search_query.strip()}%"
-            query = query.filter(
-                or_(
-                    Location.name.ilike(search_term),
-                    Location.description.ilike(search_term)
-                )
-            )
+    if search_query and search_query.strip():
+        search_term = search_query.strip().casefold()
+        locations = [loc for loc in locations if search_term in loc.search_text]
+
+    return json_array_response([loc.list_json for loc in locations])
+
+
+@app.route('/geography', methods=['GET'])
+def get_geography_route():
+    """Árbol de geografía completo con el número de ubicaciones de cada nodo."""
+    return json_response(get_geography().as_nested())
 
-        results = query.order_by(Location.name).all()
-        locations_list = [{
-            "location_id": loc.location_id,
-            "name": loc.name,
-            "description": loc.description,
-            "latitude": loc.latitude,
-            "longitude": loc.longitude,
-            "municipality_id": loc.municipality_id,
-            "municipality_name": muni.name,
-            "difficulty": loc.difficulty,
-            "is_natural": loc.is_natural,
-            "best_season": loc.best_season,
-            "best_time_of_day": loc.best_time_of_day,
-            "main_image_url": loc.main_image_url
-        } for loc, muni in results]
 
-        return jsonify(locations_list), 200
+@app.route('/geography/<level>/<int:entity_id>/locations', methods=['GET'])
+def get_geography_locations_route(level, entity_id):
+    """Ubicaciones bajo una entidad geográfica de cualquier nivel."""
+    if level not in LEVELS:
+        return jsonify({"message": f"Nivel no válido. Use uno de: {', '.join(LEVELS)}."}), 400
+
+    tree = get_geography()
+    node = tree.node(level, entity_id)
+    if node is None:
+        return jsonify({"message": "Entidad geográfica no encontrada"}), 404
+
+    locations_by_id = get_catalog().locations_by_id
+    entries = [
+        locations_by_id[location_id]
+        for location_id in tree.location_ids(level, entity_id)
+        if location_id in locations_by_id
+    ]
+    entries.sort(key=lambda entry: entry.name)
+    return json_response({
+        **tree.describe(node),
+        "ancestors": [tree.describe(ancestor) for ancestor in tree.ancestors(node)],
+        "locations": [location_list_payload(entry) for entry in entries],
+    })
 
 
 @app.route('/locations/<int:location_id>', methods=['GET'])
@@ -227,58 +363,91 @@ def get_location_details_route(location_id):
     """Obtiene detalles de una ubicación específica."""
     user_id = request.args.get('user_id', type=int)
 
-    with get_db() as db:
-        location_result = db.query(Location, Municipality).join(
-            Municipality, Location.municipality_id == Municipality.municipality_id
-        ).filter(Location.location_id == location_id).first()
-
-        if not location_result:
-            return jsonify({"message": "Ubicación no encontrada"}), 404
+    location_entry = get_catalog().locations_by_id.get(location_id)
+    if location_entry is None:
+        return jsonify({"message": "Ubicación no encontrada"}), 404
 
-        location_obj, muni_obj = location_result
-        has_visited = False
+    has_visited = False
 
-        if user_id is not None:
-            visit = db.query(UserLocationVisit).filter_by(
-                user_id=user_id,
-                location_id=location_id
-            ).first()
-            has_visited = visit is not None
+    if user_id is not None:
+        has_visited = location_id in (_visited_location_ids(user_id) or ())
 
-        return jsonify({
-            "location_id": location_obj.location_id,
-            "name": location_obj.name,
-            "description": location_obj.description,
-            "latitude": location_obj.latitude,
-            "longitude": location_obj.longitude,
-            "municipality_id": location_obj.municipality_id,
-            "municipality_name": muni_obj.name,
-            "difficulty": location_obj.difficulty,
-            "is_natural": location_obj.is_natural,
-            "best_season": location_obj.best_season,
-            "best_time_of_day": location_obj.best_time_of_day,
-            "main_image_url": location_obj.main_image_url,
-            "unlocked_content_url": (
-                location_obj.unlocked_content_url if has_visited else None
-            )
-        }), 200
+    return json_bytes_response(
+        location_entry.detail_json if has_visited
+        else location_entry.detail_locked_json
+    )
 
 
 @app.route('/checkin', methods=['POST'])
 def checkin_location_route():
     """Procesa un check-in de un usuario en una ubicación."""
+    # Los límites se comprueban antes de cualquier trabajo en base de datos
+    retry_after = checkin_ip_limiter.hit(request.remote_addr)
+    if retry_after:
+        return _rate_limited_response(retry_after)
+
     data = request.get_json()
     if not data:
         return jsonify({"message": "Petición sin datos JSON."}), 400
 
     try:
-        user_lat = float(data['latitude'])
-        user_lng = float(data['longitude'])
-        user_id = int(data['user_id'])
-        location_id = int(data['location_id'])
+        user_id, location_id, user_lat, user_lng = parse_checkin_request(data)
+    except KeyError as e:
+        return jsonify({"message": f"Campo faltante: {e}"}), 400
+    except ValueError as e:
+        return jsonify({"message": f"Datos inválidos: {e}"}), 400
+    except TypeError:
+        return jsonify({"message": "Tipos de datos inválidos."}), 400
+
+    rate_key, error = checkin_rate_key(
+        user_id, request.remote_addr, request.headers.get('Authorization')
+    )
+    if error:
+        return jsonify(error[0]), error[1]
+    retry_after = checkin_user_limiter.hit(rate_key)
+    if retry_after:
+        logger.warning(f"Check-in limitado para usuario {user_id}")
+        return _rate_limited_response(retry_after)
+
+    with get_db(user_id=user_id) as db:
+        payload, status = process_checkin(db, user_id, location_id, user_lat, user_lng)
+    if payload.get("visit_recorded"):
+        _mark_recent_write(user_id)
+    return jsonify(payload), status
+
+
+@app.route('/checkin/trace', methods=['POST'])
+def checkin_trace_route():
+    """
+    Check-ins automáticos a partir de una traza GPS.
+
+    Cuerpo: {"user_id": 1, "points": [{"latitude": .., "longitude": ..,
+    "timestamp": ..}, ...]}, con timestamp en segundos epoch o ISO 8601,
+    de los últimos TRACE_MAX_AGE_SECONDS.
+    Cuenta cada ubicación en cuyo radio la traza permaneció al menos
+    TRACE_MIN_DWELL_SECONDS.
+    """
+    retry_after = checkin_ip_limiter.hit(request.remote_addr)
+    if retry_after:
+        return _rate_limited_response(retry_after)
 
-        # Validar coordenadas
-        _validate_coordinates(user_lat, user_lng)
+    data = request.get_json()
+    if not data:
+        return jsonify({"message": "Petición sin datos JSON."}), 400
+
+    try:
+        user_id = int(data['user_id'])
+        points = data['points']
+        if not isinstance(points, list) or not points:
+            raise ValueError("points debe ser una lista no vacía")
+        if len(points) > TRACE_MAX_POINTS:
+            raise ValueError(f"La traza supera el máximo de {TRACE_MAX_POINTS} puntos")
+        latitudes = np.array([float(p['latitude']) for p in points])
+        longitudes = np.array([float(p['longitude']) for p in points])
+        timestamps = np.array([_parse_trace_timestamp(p['timestamp']) for p in points])
+        _validate_trace_timestamps(timestamps, time.time())
+        if not (np.all(np.abs(latitudes) <= 90) and np.all(np.abs(longitudes) <= 180)):
+            raise ValueError("Coordenadas fuera de rango")
     except KeyError as e:
         return jsonify({"message": f"Campo faltante: {e}"}), 400
     except ValueError as e:
@@ -286,76 +455,119 @@ def checkin_location_route():
     except TypeError:
         return jsonify({"message": "Tipos de datos inválidos."}), 400
 
-    with get_db() as db:
-        location = db.query(Location).filter(
-            Location.location_id == location_id
-        ).first()
-        if not location:
-            return jsonify({
-                "message": f"Ubicación ID {location_id} no encontrada."
-            }), 404
+    rate_key, error = checkin_rate_key(
+        user_id, request.remote_addr, request.headers.get('Authorization')
+    )
+    if error:
+        return jsonify(error[0]), error[1]
+    retry_after = checkin_user_limiter.hit(rate_key)
+    if retry_after:
+        logger.warning(f"Traza limitada para usuario {user_id}")
+        return _rate_limited_response(retry_after)
+
+    order = np.argsort(timestamps, kind="stable")
+    latitudes, longitudes, timestamps = latitudes[order], longitudes[order], timestamps[order]
+
+    catalog = get_catalog()
+    geofences = get_geofences(catalog, CHECKIN_RADIUS_METERS)
+    detected = detect_visits(
+        get_geofence_index(catalog, CHECKIN_RADIUS_METERS, geofences),
+        latitudes, longitudes, timestamps, TRACE_MIN_DWELL_SECONDS
+    )
 
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
+    with get_db(user_id=user_id) as db:
+        if not db.query(User.user_id).filter(User.user_id == user_id).first():
             return jsonify({
                 "message": f"Usuario ID {user_id} no encontrado."
             }), 404
 
-        user_coords = (user_lat, user_lng)
-        location_coords = (location.latitude, location.longitude)
-        distance_in_meters = geodesic(user_coords, location_coords).meters
-
-        if distance_in_meters > CHECKIN_RADIUS_METERS:
-            return jsonify({
-                "message": (
-                    f"Estás demasiado lejos de {location.name} "
-                    f"({distance_in_meters:.0f}m). "
-                    f"Debes estar a menos de {CHECKIN_RADIUS_METERS}m."
-                ),
-                "visit_recorded": False,
-                "distancia_metros": round(distance_in_meters, 0)
-            }), 200
-
-        # Verificar si ya existe la visita
-        existing_visit = db.query(UserLocationVisit).filter_by(
-            user_id=user_id,
-            location_id=location_id
-        ).first()
-
-        new_visit_created = False
-        if not existing_visit:
-            new_visit = UserLocationVisit(
-                user_id=user_id,
-                location_id=location_id
-            )
-            db.add(new_visit)
-            db.flush()  # Flush para que la visita esté disponible para queries
-            new_visit_created = True
-            logger.info(
-                f"Usuario {user_id} realizó check-in en ubicación {location_id}"
-            )
-
-        # Recalcular estadísticas después del flush
-        user_stats = _get_user_stats(db, user_id)
-        newly_unlocked = _check_and_award_achievements(db, user_id, user_stats)
+        previous_location_ids = [
+            visited_id for (visited_id,) in db.query(
+                UserLocationVisit.location_id
+            ).filter(UserLocationVisit.user_id == user_id)
+        ]
+        already_visited = set(previous_location_ids)
+
+        event_rows, visit_rows = [], []
+        for visit in detected:
+            entered_at = datetime.datetime.fromtimestamp(
+                visit["entered_at"], datetime.timezone.utc
+            ).replace(tzinfo=None)
+            visit["entered_at_utc"] = entered_at
+            visit["new_visit_created"] = visit["location_id"] not in already_visited
+            if visit["new_visit_created"]:
+                visit_rows.append({
+                    "user_id": user_id,
+                    "location_id": visit["location_id"],
+                    "visit_timestamp": entered_at,
+                })
+            event_rows.append({
+                "user_id": user_id,
+                "location_id": visit["location_id"],
+                "event_timestamp": entered_at,
+                "latitude": visit["latitude"],
+                "longitude": visit["longitude"],
+                "distance_meters": visit["distance_meters"],
+                "new_visit": visit["new_visit_created"],
+            })
 
         try:
+            if visit_rows:
+                db.execute(insert(UserLocationVisit), visit_rows)
+            if event_rows:
+                record_checkin_events(db, event_rows)
+            user_stats = get_user_stats(db, user_id)
+            newly_unlocked = (
+                check_and_award_achievements(db, user_id, user_stats)
+                if visit_rows else []
+            )
             db.commit()
-            return jsonify({
-                "message": f"¡Check-in en {location.name} procesado!",
-                "visit_recorded": True,
-                "new_visit_created": new_visit_created,
-                "unlocked_content_url": location.unlocked_content_url,
-                "unlocked_achievements": newly_unlocked,
-                "distancia_metros": round(distance_in_meters, 0)
-            }), 200
+        except IntegrityError:
+            db.rollback()
+            return jsonify(CHECKIN_CONFLICT_RESPONSE[0]), CHECKIN_CONFLICT_RESPONSE[1]
         except Exception as e:
             db.rollback()
-            logger.error(f"Error al guardar check-in: {e}")
+            logger.error(f"Error al guardar la traza: {e}")
             return jsonify({
-                "message": "Error interno al guardar el check-in."
+                "message": "Error interno al guardar la traza."
             }), 500
 
+    if visit_rows or newly_unlocked:
+        _mark_recent_write(user_id)
+        get_cache().invalidate(f"user:{user_id}")
+    logger.info(
+        f"Traza de usuario {user_id}: {len(points)} puntos, "
+        f"{len(detected)} ubicaciones, {len(visit_rows)} visitas nuevas"
+    )
+
+    covisitation_index = get_covisitation_index_if_ready()
+    visits_list = []
+    for position, visit in enumerate(detected):
+        entry = catalog.locations_by_id[visit["location_id"]]
+        if visit["new_visit_created"] and covisitation_index is not None:
+            covisitation_index.record_visit(entry.location_id, previous_location_ids)
+            previous_location_ids.append(entry.location_id)
+        publish_checkin_events(
+            user_id, entry, visit["new_visit_created"], user_stats,
+            newly_unlocked if position == len(detected) - 1 else []
+        )
+        visits_list.append({
+            "location_id": entry.location_id,
+            "name": entry.name,
+            "entered_at": visit["entered_at_utc"].isoformat() + "Z",
+            "dwell_seconds": round(visit["dwell_seconds"], 0),
+            "distancia_metros": round(visit["distance_meters"], 0),
+            "new_visit_created": visit["new_visit_created"],
+            "unlocked_content_url": entry.unlocked_content_url,
+        })
+
+    return json_response({
+        "points_processed": len(points),
+        "visits": visits_list,
+        "new_visits_count": len(visit_rows),
+        "unlocked_achievements": newly_unlocked,
+    })
+
 
 @app.route('/register', methods=['POST'])
 def register_user_route():
@@ -374,13 +586,20 @@ def register_user_route():
             "message": "Nombre de usuario y contraseña no pueden estar vacíos."
         }), 400
 
-    with get_db() as db:
+    router = get_shard_router()
+    if router.sharded and router.find_username_shard(username) is not None:
+        return jsonify({
+            "message": "El nombre de usuario ya existe."
+        }), 409
+    shard = router.shard_for_username(username)
+    with get_db(shard=shard) as db:
         if db.query(User).filter(User.username == username).first():
             return jsonify({
                 "message": "El nombre de usuario ya existe."
             }), 409
 
         new_user = User(
+            user_id=router.allocate_user_id(db, shard),
             username=username,
             password_hash=generate_password_hash(password)
         )
@@ -389,10 +608,13 @@ def register_user_route():
         try:
             db.commit()
             db.refresh(new_user)
+            _mark_recent_write(new_user.user_id)
+            get_cache().invalidate(f"user:{new_user.user_id}")
             logger.info(f"Usuario registrado: {username}")
             return jsonify({
                 "message": "Usuario registrado exitosamente.",
-                "user_id": new_user.user_id
+                "user_id": new_user.user_id,
+                "token": issue_token(new_user.user_id)
             }), 201
         except Exception as e:
             db.rollback()
@@ -414,14 +636,17 @@ def login_user_route():
     username = data['username']
     password = data['password']
 
-    with get_db() as db:
+    router = get_shard_router()
+    shard = router.find_username_shard(username) if router.sharded else None
+    with get_db(shard=shard or router.shard_for_username(username)) as db:
         user = db.query(User).filter(User.username == username).first()
 
         if user and check_password_hash(user.password_hash, password):
             logger.info(f"Usuario autenticado: {username}")
             return jsonify({
                 "message": "Inicio de sesión exitoso.",
-                "user_id": user.user_id
+                "user_id": user.user_id,
+                "token": issue_token(user.user_id)
             }), 200
         else:
             logger.warning(f"Intento de login fallido para usuario: {username}")
@@ -433,99 +658,457 @@ def login_user_route():
 @app.route('/users/<int:user_id>/visits', methods=['GET'])
 def get_user_visits_and_progress_route(user_id):
     """Obtiene las visitas y progreso de un usuario."""
-    with get_db() as db:
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            return jsonify({
-                "message": f"Usuario con ID {user_id} no encontrado."
-            }), 404
+    def compute():
+        with get_db(readonly=True, user_id=user_id) as db:
+            if not db.query(User.user_id).filter(User.user_id == user_id).first():
+                return None
 
-        distinct_location_ids = [
-            item[0]
-            for item in db.query(distinct(UserLocationVisit.location_id))
-            .filter(UserLocationVisit.user_id == user_id).all()
-        ]
-
-        visited_locations_objects = []
-        if distinct_location_ids:
-            visited_locations_objects = db.query(Location).options(
-                joinedload(Location.municipality)
+            visited_location_ids = db.query(UserLocationVisit.location_id).filter(
+                UserLocationVisit.user_id == user_id
+            )
+            visited_locations_rows = db.query(
+                *VISITED_LOCATION_ENCODER.columns
+            ).outerjoin(
+                Municipality, Location.municipality_id == Municipality.municipality_id
             ).filter(
-                Location.location_id.in_(distinct_location_ids)
+                Location.location_id.in_(visited_location_ids)
             ).order_by(Location.name).all()
-
-        visited_locations_list = []
-        for loc_obj in visited_locations_objects:
-            muni_name = (
-                loc_obj.municipality.name
-                if loc_obj.municipality else "Desconocido"
+            visited_locations_list = VISITED_LOCATION_ENCODER.encode(
+                visited_locations_rows
             )
-            visited_locations_list.append({
-                "location_id": loc_obj.location_id,
-                "name": loc_obj.name,
-                "description": loc_obj.description,
-                "latitude": loc_obj.latitude,
-                "longitude": loc_obj.longitude,
-                "difficulty": loc_obj.difficulty,
-                "is_natural": loc_obj.is_natural,
-                "best_season": loc_obj.best_season,
-                "best_time_of_day": loc_obj.best_time_of_day,
-                "main_image_url": loc_obj.main_image_url,
-                "municipality_name": muni_name,
-            })
 
-        user_stats = _get_user_stats(db, user_id)
-        total_available_locations = db.query(
-            func.count(Location.location_id)
-        ).scalar() or 0
-
-        progress_by_municipality_query = db.query(
-            Municipality.name,
-            func.count(distinct(UserLocationVisit.location_id))
-        ).join(
-            Location, Municipality.municipality_id == Location.municipality_id
-        ).join(
-            UserLocationVisit,
-            Location.location_id == UserLocationVisit.location_id
-        ).filter(
-            UserLocationVisit.user_id == user_id
-        ).group_by(Municipality.name).all()
-
-        progress_by_municipality_list = [
-            {"municipality_name": name, "visited_count": count}
-            for name, count in progress_by_municipality_query
-        ]
+            user_stats = get_user_stats(db, user_id)
+            total_available_locations = db.query(
+                func.count(Location.location_id)
+            ).scalar() or 0
+
+            progress_by_municipality_query = db.query(
+                Municipality.name,
+                func.count(distinct(UserLocationVisit.location_id))
+            ).join(
+                Location, Municipality.municipality_id == Location.municipality_id
+            ).join(
+                UserLocationVisit,
+                Location.location_id == UserLocationVisit.location_id
+            ).filter(
+                UserLocationVisit.user_id == user_id
+            ).group_by(Municipality.name).all()
+
+            progress_by_municipality_list = [
+                {"municipality_name": name, "visited_count": count}
+                for name, count in progress_by_municipality_query
+            ]
+
+            return dumps({
+                "total_visits": user_stats["unique_visits_count"],
+                "visited_locations": visited_locations_list,
+                "total_locations": total_available_locations,
+                "progress_by_municipality": progress_by_municipality_list
+            })
 
+    body = _cached_user_entry(
+        f"user_visits:{user_id}", compute, user_id, _user_cache_tags(user_id)
+    )
+    if body is None:
         return jsonify({
-            "total_visits": user_stats["unique_visits_count"],
-            "visited_locations": visited_locations_list,
-            "total_locations": total_available_locations,
-            "progress_by_municipality": progress_by_municipality_list
-        }), 200
+            "message": f"Usuario con ID {user_id} no encontrado."
+        }), 404
+    return json_bytes_response(body)
 
 
 @app.route('/users/<int:user_id>/achievements', methods=['GET'])
 def get_user_achievements_earned_route(user_id):
     """Obtiene los logros desbloqueados por un usuario."""
-    with get_db() as db:
-        user = db.query(User).filter(User.user_id == user_id).first()
-        if not user:
-            return jsonify({
-                "message": f"Usuario con ID {user_id} no encontrado."
-            }), 404
+    def compute():
+        with get_db(readonly=True, user_id=user_id) as db:
+            if not db.query(User.user_id).filter(User.user_id == user_id).first():
+                return None
+
+            earned_db_achievements = db.query(Achievement).join(
+                UserAchievement,
+                Achievement.achievement_id == UserAchievement.achievement_id
+            ).filter(UserAchievement.user_id == user_id).all()
+
+            return dumps([{
+                "id": ach.achievement_id,
+                "name": ach.name,
+                "description": ach.description
+            } for ach in earned_db_achievements])
+
+    body = _cached_user_entry(
+        f"user_achievements:{user_id}", compute, user_id, _user_cache_tags(user_id)
+    )
+    if body is None:
+        return jsonify({
+            "message": f"Usuario con ID {user_id} no encontrado."
+        }), 404
+    return json_bytes_response(body)
+
+
+@app.route('/users/<int:user_id>/route', methods=['GET'])
+def get_user_route_plan_route(user_id):
+    """
+    Propone el orden de visita de las ubicaciones no visitadas cercanas.
+
+    Query params: latitude y longitude (obligatorios), radius_km, max_stops,
+    difficulty, best_time_of_day y best_season.
+    """
+    try:
+        start_lat = float(request.args['latitude'])
+        start_lng = float(request.args['longitude'])
+        validate_coordinates(start_lat, start_lng)
+        radius_km = request.args.get(
+            'radius_km', default=DEFAULT_RADIUS_METERS / 1000, type=float
+        )
+        max_stops = request.args.get('max_stops', type=int)
+        if max_stops is not None and max_stops < 1:
+            raise ValueError("max_stops debe ser positivo")
+    except KeyError as e:
+        return jsonify({"message": f"Parámetro faltante: {e}"}), 400
+    except ValueError as e:
+        return jsonify({"message": f"Datos inválidos: {e}"}), 400
+
+    visited_ids = _visited_location_ids(user_id)
+    if visited_ids is None:
+        return jsonify({
+            "message": f"Usuario con ID {user_id} no encontrado."
+        }), 404
+
+    catalog = get_catalog()
+    candidates = select_candidates(
+        catalog, visited_ids,
+        difficulty=request.args.get('difficulty'),
+        best_time_of_day=request.args.get('best_time_of_day'),
+        best_season=request.args.get('best_season'),
+    )
+    plan = plan_route(
+        catalog, start_lat, start_lng, candidates,
+        max_stops=max_stops,
+        radius_meters=radius_km * 1000,
+    )
+
+    stops = []
+    accumulated = 0.0
+    for order, (loc, leg_distance) in enumerate(plan["stops"], start=1):
+        accumulated += leg_distance
+        stops.append({
+            "order": order,
+            "location_id": loc.location_id,
+            "name": loc.name,
+            "latitude": loc.latitude,
+            "longitude": loc.longitude,
+            "municipality_name": loc.municipality_name,
+            "difficulty": loc.difficulty,
+            "best_season": loc.best_season,
+            "best_time_of_day": loc.best_time_of_day,
+            "main_image_url": loc.main_image_url,
+            "leg_distance_meters": round(leg_distance, 0),
+            "accumulated_distance_meters": round(accumulated, 0),
+        })
+
+    return json_response({
+        "stops": stops,
+        "total_distance_meters": round(plan["total_distance_meters"], 0),
+        "candidates_considered": plan["candidates_considered"],
+        "solver": {
+            "iterations": plan["iterations"],
+            "converged": plan["converged"],
+            "elapsed_ms": round(plan["elapsed_ms"], 2),
+        },
+    })
+
+
+@app.route('/locations/<int:location_id>/similar', methods=['GET'])
+def get_similar_locations_route(location_id):
+    """Ubicaciones que también visitaron quienes visitaron esta."""
+    limit = _limit_arg()
+    catalog = get_catalog()
+    if location_id not in catalog.locations_by_id:
+        return jsonify({"message": "Ubicación no encontrada"}), 404
+
+    similar_list = []
+    for similar_id, score, co_visitors in get_covisitation_index().similar(
+        location_id, limit
+    ):
+        entry = catalog.locations_by_id.get(similar_id)
+        if entry is not None:
+            similar_list.append({
+                **location_list_payload(entry),
+                "score": round(score, 4),
+                "co_visitors": co_visitors,
+            })
+
+    return json_response(similar_list)
+
+
+@app.route('/users/<int:user_id>/recommendations', methods=['GET'])
+def get_user_recommendations_route(user_id):
+    """Recomendaciones personalizadas a partir de las co-visitas."""
+    limit = _limit_arg()
+
+    visited_ids = _visited_location_ids(user_id)
+    if visited_ids is None:
+        return jsonify({
+            "message": f"Usuario con ID {user_id} no encontrado."
+        }), 404
+
+    catalog = get_catalog()
+    recommendations_list = []
+    for location_id, score in get_covisitation_index().recommend(
+        visited_ids, limit
+    ):
+        entry = catalog.locations_by_id.get(location_id)
+        if entry is not None:
+            recommendations_list.append({
+                **location_list_payload(entry),
+                "score": round(score, 4),
+            })
+
+    return json_response(recommendations_list)
+
+
+# Endpoints de analítica (servidos desde la instantánea, nunca de la base viva)
 
-        earned_db_achievements = db.query(Achievement).join(
-            UserAchievement,
-            Achievement.achievement_id == UserAchievement.achievement_id
-        ).filter(UserAchievement.user_id == user_id).all()
+@app.route('/analytics/visits', methods=['GET'])
+def get_analytics_visits_route():
+    """
+    Serie temporal de visitas por día o semana.
+
+    Query params: granularity (day|week), location_id, from y to (AAAA-MM-DD).
+    """
+    granularity = request.args.get('granularity', default='day')
+    location_id = request.args.get('location_id', type=int)
+    if granularity not in GRANULARITIES:
+        return jsonify({
+            "message": f"granularity debe ser uno de: {', '.join(GRANULARITIES)}"
+        }), 400
+    try:
+        date_from, date_to = (
+            datetime.date.fromisoformat(request.args[key])
+            if request.args.get(key) else None
+            for key in ('from', 'to')
+        )
+    except ValueError as e:
+        return jsonify({"message": f"Fecha inválida: {e}"}), 400
+
+    snapshot = get_analytics_snapshot()
+    return json_response({
+        "granularity": granularity,
+        "location_id": location_id,
+        "series": snapshot.visits_series(
+            granularity, location_id, date_from, date_to
+        ),
+        "snapshot_generated_at": snapshot.generated_at,
+    })
+
+
+@app.route('/analytics/popular-hours', methods=['GET'])
+def get_analytics_popular_hours_route():
+    """Visitas por hora del día (UTC), global o de una ubicación."""
+    location_id = request.args.get('location_id', type=int)
+    snapshot = get_analytics_snapshot()
+    return json_response({
+        "location_id": location_id,
+        "hours": snapshot.popular_hours(location_id),
+        "snapshot_generated_at": snapshot.generated_at,
+    })
+
+
+@app.route('/analytics/heatmap', methods=['GET'])
+def get_analytics_heatmap_route():
+    """Mapa de calor de visitas por municipio y ubicación."""
+    snapshot = get_analytics_snapshot()
+    return json_response({
+        **snapshot.heatmap(),
+        "snapshot_generated_at": snapshot.generated_at,
+    })
+
+
+@app.route('/analytics/export.csv', methods=['GET'])
+def export_analytics_csv_route():
+    """Exporta las visitas diarias por ubicación en CSV."""
+    snapshot = get_analytics_snapshot()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([
+        "location_id", "location_name", "municipality_name", "date", "visits"
+    ])
+    writer.writerows(snapshot.daily_rows())
+    return Response(
+        buffer.getvalue(), mimetype='text/csv',
+        headers={"Content-Disposition": "attachment; filename=visitas_diarias.csv"}
+    )
+
+
+@app.route('/events', methods=['GET'])
+def event_stream_route():
+    """
+    Flujo Server-Sent Events de check-ins y logros desbloqueados.
+    Requiere "Authorization: Bearer <token>" y envía solo los eventos de ese
+    usuario. Con X-Admin-Token, ?user_id=1&user_id=2 elige los usuarios y
+    sin user_id se reciben los de todos.
+    """
+    user_ids, error = event_stream_user_ids(
+        request.args.getlist('user_id', type=int),
+        request.headers.get('Authorization'), request.headers.get('X-Admin-Token')
+    )
+    if error:
+        return jsonify(error[0]), error[1]
+    subscription = get_event_bus().subscribe(
+        user_ids, max_subscribers=EVENT_MAX_SUBSCRIBERS
+    )
+    if subscription is None:
+        return jsonify({"message": "Demasiadas conexiones de eventos abiertas."}), 503
+
+    def generate():
+        try:
+            yield format_sse(event_type="ready", data={"user_ids": user_ids})
+            while True:
+                event, dropped = subscription.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                if dropped:
+                    yield format_sse(event_type="dropped", data={"count": dropped})
+                if event is not None:
+                    yield format_sse(event)
+                else:
+                    # Comentario SSE: mantiene viva la conexión y detecta cierres
+                    yield b": ping\n\n"
+        finally:
+            subscription.close()
+
+    return Response(
+        generate(), mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.route('/sync', methods=['GET'])
+def sync_catalog_route():
+    """
+    Cambios del catálogo desde la versión ?since= (0 o ausente: todo).
+    Comprime con zstd o gzip según Accept-Encoding.
+    """
+    since = request.args.get('since', default='0')
+    try:
+        since = int(since)
+        if since < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"message": "since debe ser un entero no negativo."}), 400
+
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    with get_db(readonly=True) as db:
+        version = current_sync_version(db)
+
+        def compute():
+            body, used_encoding = encode_body(build_sync_payload(db, since), encoding)
+            return (used_encoding or "identity").encode('ascii') + b"\n" + body
+
+        # La clave incluye la versión actual: una entrada nunca queda obsoleta
+        cached = get_cache().get_or_set(
+            f"sync:{version}:{since}:{encoding}", compute, tags=("catalog",)
+        )
+
+    used_encoding, _, body = cached.partition(b"\n")
+    response = json_bytes_response(body)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["X-Sync-Version"] = str(version)
+    if used_encoding != b"identity":
+        response.headers["Content-Encoding"] = used_encoding.decode('ascii')
+    return response
 
-        achievements_list = [{
-            "id": ach.achievement_id,
-            "name": ach.name,
-            "description": ach.description
-        } for ach in earned_db_achievements]
 
-        return jsonify(achievements_list), 200
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats_route():
+    """Métricas de aciertos y fallos de la caché del worker."""
+    return json_response(get_cache().stats())
+
+
+def _admin_error_response():
+    """Respuesta de error si la petición no trae el token de administración."""
+    if not ADMIN_TOKEN:
+        return jsonify({
+            "message": "Administración deshabilitada (ADMIN_TOKEN no configurado)."
+        }), 404
+    if not is_admin_token(request.headers.get('X-Admin-Token')):
+        return jsonify({"message": "Token de administración no válido."}), 403
+    return None
+
+
+@app.route('/admin/profiler', methods=['GET'])
+def profiler_status_route():
+    """Estado del perfilador (de todos los workers si hay backend compartido)."""
+    error = _admin_error_response()
+    if error:
+        return error
+    return json_response(profiler.status())
+
+
+@app.route('/admin/profiler/start', methods=['POST'])
+def profiler_start_route():
+    """
+    Activa el perfilador por muestreo durante N segundos.
+    JSON: seconds, y opcionalmente route (regla o endpoint), sample_rate
+    (fracción de peticiones), interval_ms y reset (por defecto true).
+    """
+    error = _admin_error_response()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = float(data['seconds'])
+        sample_rate = float(data.get('sample_rate', 1.0))
+        interval_ms = data.get('interval_ms')
+        interval_ms = float(interval_ms) if interval_ms is not None else None
+        route = data.get('route')
+        if route is not None and not isinstance(route, str):
+            raise TypeError
+        profiler.start(seconds, route=route, sample_rate=sample_rate,
+                       interval_ms=interval_ms, reset=bool(data.get('reset', True)))
+    except KeyError as e:
+        return jsonify({"message": f"Campo faltante: {e}"}), 400
+    except ValueError as e:
+        return jsonify({"message": f"Datos inválidos: {e}"}), 400
+    except TypeError:
+        return jsonify({"message": "Tipos de datos inválidos."}), 400
+    return json_response(profiler.status())
+
+
+@app.route('/admin/profiler/stop', methods=['POST'])
+def profiler_stop_route():
+    """Detiene el perfilador conservando las pilas acumuladas."""
+    error = _admin_error_response()
+    if error:
+        return error
+    profiler.stop()
+    return json_response(profiler.status())
+
+
+@app.route('/admin/profiler/profile', methods=['GET'])
+def profiler_profile_route():
+    """
+    Pilas acumuladas como flame graph.
+    ?format=collapsed (texto para flamegraph.pl/inferno) o speedscope (JSON);
+    ?route= limita la exportación a una ruta.
+    """
+    error = _admin_error_response()
+    if error:
+        return error
+    export_format = request.args.get('format', 'collapsed')
+    route = request.args.get('route')
+    if export_format == 'collapsed':
+        return Response(
+            profiler.collapsed(route), mimetype='text/plain',
+            headers={"Content-Disposition": "attachment; filename=profile.collapsed.txt"}
+        )
+    if export_format == 'speedscope':
+        response = json_response(profiler.speedscope(route))
+        response.headers["Content-Disposition"] = (
+            "attachment; filename=profile.speedscope.json"
+        )
+        return response
+    return jsonify({
+        "message": "Formato no válido. Usa 'collapsed' o 'speedscope'."
+    }), 400
 
 
 # Ejecutar la Aplicación
@@ -0,0 +1,554 @@
+# asgi_app.py
+"""
+Punto de entrada ASGI para la aplicación TenerifeApp.
+Sirve sobre Quart y el motor asyncio de SQLAlchemy (aiosqlite/asyncpg) las
+rutas de uso más frecuente desde la app móvil, de modo que una conexión a la
+espera de la base de datos no ocupa un hilo:
+
+    /locations, /locations/<id>, /checkin, /register, /login,
+    /users/<id>/visits, /users/<id>/achievements, /events
+
+/events es donde más se nota: cada conexión SSE solo espera en el bucle,
+mientras que en app.py ocupa un hilo del worker. El resto de rutas (trazas,
+rutas, recomendaciones, analítica, /sync, /admin) solo existen en app.py. El check-in no es una copia: ejecuta
+checkin_service.process_checkin, igual que app.py, con los mismos límites,
+historial, invalidación de caché, co-visitas y eventos. Como esa lógica es
+síncrona (backend compartido, recarga del catálogo, geovallas), se ejecuta
+entera en un hilo con una sesión síncrona y no en el bucle de eventos. Este
+módulo no importa app.py, que construiría la aplicación Flask entera.
+
+Uso en producción:
+    hypercorn --config hypercorn.toml asgi_app:app
+"""
+
+import asyncio
+import functools
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from hypercorn.middleware import ProxyFixMiddleware
+from quart import Quart, Response, jsonify, request
+from sqlalchemy import distinct, func, or_, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import models
+from models import (
+    Location, Municipality, User, UserLocationVisit,
+    Achievement, UserAchievement
+)
+from poblacion_db.session_setup import SessionLocal
+from auth_tokens import event_stream_user_ids, issue_token
+from checkin_service import (
+    checkin_ip_limiter, checkin_rate_key, checkin_user_limiter,
+    get_user_stats, parse_checkin_request, process_checkin
+)
+from cache import get_cache
+from catalog import reload_catalog_data
+from event_bus import format_sse, get_event_bus
+from rate_limit import retry_after_header
+from read_your_writes import (
+    READ_YOUR_WRITES_SECONDS, RECENT_WRITE_COOKIE, mark_recent_write
+)
+from sharding import SHARD_DATABASE_URLS
+
+logger = logging.getLogger(__name__)
+
+# Drivers asíncronos equivalentes a los síncronos de models.DATABASE_URL
+ASYNC_DRIVERS = {
+    "sqlite://": "sqlite+aiosqlite://",
+    "postgresql://": "postgresql+asyncpg://",
+}
+
+
+def _build_async_database_url(database_url):
+    """Traduce una URL síncrona de SQLAlchemy a su driver asyncio."""
+    for sync_prefix, async_prefix in ASYNC_DRIVERS.items():
+        if database_url.startswith(sync_prefix):
+            return async_prefix + database_url[len(sync_prefix):]
+    return database_url
+
+
+# El motor asíncrono usa una sola base de datos: con shards, escribiría los
+# usuarios fuera de su shard (ver sharding.py). Con SHARD_DATABASE_URLS hay
+# que servir todo con app.py
+if SHARD_DATABASE_URLS:
+    raise RuntimeError(
+        "asgi_app no enruta por shards; con SHARD_DATABASE_URLS usa app.py (gunicorn)"
+    )
+
+ASYNC_DATABASE_URL = os.getenv(
+    'ASYNC_DATABASE_URL', _build_async_database_url(models.DATABASE_URL)
+)
+# Hilos para trabajo CPU (hash de contraseñas) fuera del bucle de eventos
+CPU_EXECUTOR_WORKERS = int(os.getenv('ASGI_CPU_WORKERS', os.cpu_count() or 1))
+
+# Conexiones SSE de /events por proceso: aquí no ocupan un hilo cada una,
+# solo su buffer de eventos
+ASGI_EVENT_MAX_SUBSCRIBERS = int(os.getenv('ASGI_EVENT_MAX_SUBSCRIBERS', 5000))
+# Proxies inversos de confianza (ver app.py); 0 = sin proxy
+PROXY_FIX_HOPS = int(os.getenv('PROXY_FIX_HOPS', 0))
+EVENT_HEARTBEAT_SECONDS = float(os.getenv('EVENT_HEARTBEAT_SECONDS', 15))
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=int(os.getenv('ASGI_DB_POOL_SIZE', 10)),
+    max_overflow=int(os.getenv('ASGI_DB_MAX_OVERFLOW', 20)),
+    pool_pre_ping=True,
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+_cpu_executor = ThreadPoolExecutor(
+    max_workers=CPU_EXECUTOR_WORKERS, thread_name_prefix="cpu"
+)
+
+app = Quart(__name__)
+if PROXY_FIX_HOPS:
+    app.asgi_app = ProxyFixMiddleware(
+        app.asgi_app, mode="legacy", trusted_hops=PROXY_FIX_HOPS
+    )
+
+# Catálogo y geografía los usa el check-in compartido (checkin_service)
+get_cache().on_invalidate("catalog", reload_catalog_data)
+
+
+# Context Manager para Sesiones Asíncronas de Base de Datos
+@asynccontextmanager
+async def get_async_db():
+    """Context manager para sesiones asíncronas de base de datos."""
+    db = AsyncSessionLocal()
+    try:
+        yield db
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+
+
+async def _run_cpu_bound(func_, *args):
+    """Ejecuta una función CPU-bound en el executor sin bloquear el bucle."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _cpu_executor, functools.partial(func_, *args)
+    )
+
+
+@app.after_serving
+async def _shutdown():
+    """Libera el pool de conexiones y el executor al parar el servidor."""
+    await async_engine.dispose()
+    _cpu_executor.shutdown(wait=False)
+
+
+# Endpoints de la API
+
+@app.route('/locations', methods=['GET'])
+async def get_locations_list_route():
+    """Obtiene lista de ubicaciones con filtros opcionales."""
+    municipality_id = request.args.get('municipality_id', type=int)
+    island_id = request.args.get('island_id', type=int)
+    province_id = request.args.get('province_id', type=int)
+    search_query = request.args.get('q', type=str)
+
+    async with get_async_db() as db:
+        query = select(Location, Municipality).join(
+            Municipality, Location.municipality_id == Municipality.municipality_id
+        )
+
+        if municipality_id is not None:
+            query = query.filter(Location.municipality_id == municipality_id)
+        if island_id is not None:
+            query = query.filter(Municipality.island_id == island_id)
+        if province_id is not None:
+            query = query.filter(Municipality.province_id == province_id)
+
+        if search_query and search_query.strip():
+            search_term = f"%{search_query.strip()}%"
+            query = query.filter(
+                or_(
+                    Location.name.ilike(search_term),
+                    Location.description.ilike(search_term)
+                )
+            )
+
+        results = (await db.execute(query.order_by(Location.name))).all()
+        locations_list = [{
+            "location_id": loc.location_id,
+            "name": loc.name,
+            "description": loc.description,
+            "latitude": loc.latitude,
+            "longitude": loc.longitude,
+            "municipality_id": loc.municipality_id,
+            "municipality_name": muni.name,
+            "difficulty": loc.difficulty,
+            "is_natural": loc.is_natural,
+            "best_season": loc.best_season,
+            "best_time_of_day": loc.best_time_of_day,
+            "main_image_url": loc.main_image_url
+        } for loc, muni in results]
+
+        return jsonify(locations_list), 200
+
+
+@app.route('/locations/<int:location_id>', methods=['GET'])
+async def get_location_details_route(location_id):
+    """Obtiene detalles de una ubicación específica."""
+    user_id = request.args.get('user_id', type=int)
+
+    async with get_async_db() as db:
+        location_result = (await db.execute(
+            select(Location, Municipality).join(
+                Municipality,
+                Location.municipality_id == Municipality.municipality_id
+            ).filter(Location.location_id == location_id)
+        )).first()
+
+        if not location_result:
+            return jsonify({"message": "Ubicación no encontrada"}), 404
+
+        location_obj, muni_obj = location_result
+        has_visited = False
+
+        if user_id is not None:
+            visit = (await db.execute(
+                select(UserLocationVisit.visit_id).filter_by(
+                    user_id=user_id,
+                    location_id=location_id
+                ).limit(1)
+            )).first()
+            has_visited = visit is not None
+
+        return jsonify({
+            "location_id": location_obj.location_id,
+            "name": location_obj.name,
+            "description": location_obj.description,
+            "latitude": location_obj.latitude,
+            "longitude": location_obj.longitude,
+            "municipality_id": location_obj.municipality_id,
+            "municipality_name": muni_obj.name,
+            "difficulty": location_obj.difficulty,
+            "is_natural": location_obj.is_natural,
+            "best_season": location_obj.best_season,
+            "best_time_of_day": location_obj.best_time_of_day,
+            "main_image_url": location_obj.main_image_url,
+            "unlocked_content_url": (
+                location_obj.unlocked_content_url if has_visited else None
+            )
+        }), 200
+
+
+def _rate_limited_response(retry_after):
+    """Respuesta 429 con cabecera Retry-After."""
+    return jsonify({
+        "message": "Demasiados check-ins. Inténtalo de nuevo más tarde."
+    }), 429, {"Retry-After": retry_after_header(retry_after)}
+
+
+async def _set_recent_write(response, user_id):
+    """Abre la ventana read-your-writes (ver read_your_writes.py) para app.py."""
+    cookie = await asyncio.to_thread(mark_recent_write, user_id)
+    response.set_cookie(
+        RECENT_WRITE_COOKIE, cookie, max_age=math.ceil(READ_YOUR_WRITES_SECONDS),
+        httponly=True, samesite='Lax'
+    )
+
+
+def _process_checkin_sync(user_id, location_id, latitude, longitude):
+    """
+    process_checkin con su propia sesión síncrona (se ejecuta en un hilo).
+
+    La sesión es la de models.DATABASE_URL, de la que se deriva por defecto
+    ASYNC_DATABASE_URL.
+    """
+    db = SessionLocal()
+    try:
+        return process_checkin(db, user_id, location_id, latitude, longitude)
+    finally:
+        db.close()
+
+
+@app.route('/checkin', methods=['POST'])
+async def checkin_location_route():
+    """Procesa un check-in de un usuario en una ubicación."""
+    # Los límites se comprueban antes de cualquier trabajo en base de datos.
+    # Con backend compartido cada hit es una llamada de red: fuera del bucle
+    retry_after = await asyncio.to_thread(checkin_ip_limiter.hit, request.remote_addr)
+    if retry_after:
+        return _rate_limited_response(retry_after)
+
+    data = await request.get_json()
+    if not data:
+        return jsonify({"message": "Petición sin datos JSON."}), 400
+
+    try:
+        user_id, location_id, user_lat, user_lng = parse_checkin_request(data)
+    except KeyError as e:
+        return jsonify({"message": f"Campo faltante: {e}"}), 400
+    except ValueError as e:
+        return jsonify({"message": f"Datos inválidos: {e}"}), 400
+    except TypeError:
+        return jsonify({"message": "Tipos de datos inválidos."}), 400
+
+    rate_key, error = checkin_rate_key(
+        user_id, request.remote_addr, request.headers.get('Authorization')
+    )
+    if error:
+        return jsonify(error[0]), error[1]
+    retry_after = await asyncio.to_thread(checkin_user_limiter.hit, rate_key)
+    if retry_after:
+        logger.warning(f"Check-in limitado para usuario {user_id}")
+        return _rate_limited_response(retry_after)
+
+    # La misma lógica que app.py, entera en un hilo
+    payload, status = await asyncio.to_thread(
+        _process_checkin_sync, user_id, location_id, user_lat, user_lng
+    )
+    response = jsonify(payload)
+    if payload.get("visit_recorded"):
+        await _set_recent_write(response, user_id)
+    return response, status
+
+
+@app.route('/register', methods=['POST'])
+async def register_user_route():
+    """Registra un nuevo usuario."""
+    data = await request.get_json()
+    if not data or not data.get('username') or not data.get('password'):
+        return jsonify({
+            "message": "Nombre de usuario y contraseña son requeridos."
+        }), 400
+
+    username = data['username'].strip()
+    password = data['password']
+
+    if not username or not password:
+        return jsonify({
+            "message": "Nombre de usuario y contraseña no pueden estar vacíos."
+        }), 400
+
+    async with get_async_db() as db:
+        existing = (await db.execute(
+            select(User.user_id).filter(User.username == username)
+        )).first()
+        if existing:
+            return jsonify({
+                "message": "El nombre de usuario ya existe."
+            }), 409
+
+        new_user = User(
+            username=username,
+            password_hash=await _run_cpu_bound(generate_password_hash, password)
+        )
+        db.add(new_user)
+
+        try:
+            await db.commit()
+            logger.info(f"Usuario registrado: {username}")
+            response = jsonify({
+                "message": "Usuario registrado exitosamente.",
+                "user_id": new_user.user_id,
+                "token": issue_token(new_user.user_id)
+            })
+            await _set_recent_write(response, new_user.user_id)
+            return response, 201
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Error al registrar usuario: {e}")
+            return jsonify({
+                "message": "Error interno al registrar usuario."
+            }), 500
+
+
+@app.route('/login', methods=['POST'])
+async def login_user_route():
+    """Autentica un usuario."""
+    data = await request.get_json()
+    if not data or not data.get('username') or not data.get('password'):
+        return jsonify({
+            "message": "Nombre de usuario y contraseña son requeridos."
+        }), 400
+
+    username = data['username']
+    password = data['password']
+
+    async with get_async_db() as db:
+        user = (await db.execute(
+            select(User).filter(User.username == username)
+        )).scalars().first()
+
+        if user and await _run_cpu_bound(
+            check_password_hash, user.password_hash, password
+        ):
+            logger.info(f"Usuario autenticado: {username}")
+            return jsonify({
+                "message": "Inicio de sesión exitoso.",
+                "user_id": user.user_id,
+                "token": issue_token(user.user_id)
+            }), 200
+        else:
+            logger.warning(f"Intento de login fallido para usuario: {username}")
+            return jsonify({
+                "message": "Nombre de usuario o contraseña incorrectos."
+            }), 401
+
+
+@app.route('/users/<int:user_id>/visits', methods=['GET'])
+async def get_user_visits_and_progress_route(user_id):
+    """Obtiene las visitas y progreso de un usuario."""
+    async with get_async_db() as db:
+        user = await db.get(User, user_id)
+        if not user:
+            return jsonify({
+                "message": f"Usuario con ID {user_id} no encontrado."
+            }), 404
+
+        distinct_location_ids = (await db.execute(
+            select(UserLocationVisit.location_id).distinct()
+            .filter(UserLocationVisit.user_id == user_id)
+        )).scalars().all()
+
+        visited_locations_objects = []
+        if distinct_location_ids:
+            visited_locations_objects = (await db.execute(
+                select(Location).options(
+                    joinedload(Location.municipality)
+                ).filter(
+                    Location.location_id.in_(distinct_location_ids)
+                ).order_by(Location.name)
+            )).scalars().all()
+
+        visited_locations_list = []
+        for loc_obj in visited_locations_objects:
+            muni_name = (
+                loc_obj.municipality.name
+                if loc_obj.municipality else "Desconocido"
+            )
+            visited_locations_list.append({
+                "location_id": loc_obj.location_id,
+                "name": loc_obj.name,
+                "description": loc_obj.description,
+                "latitude": loc_obj.latitude,
+                "longitude": loc_obj.longitude,
+                "difficulty": loc_obj.difficulty,
+                "is_natural": loc_obj.is_natural,
+                "best_season": loc_obj.best_season,
+                "best_time_of_day": loc_obj.best_time_of_day,
+                "main_image_url": loc_obj.main_image_url,
+                "municipality_name": muni_name,
+            })
+
+        user_stats = await db.run_sync(get_user_stats, user_id)
+        total_available_locations = (await db.execute(
+            select(func.count(Location.location_id))
+        )).scalar() or 0
+
+        progress_by_municipality_query = (await db.execute(
+            select(
+                Municipality.name,
+                func.count(distinct(UserLocationVisit.location_id))
+            ).join(
+                Location,
+                Municipality.municipality_id == Location.municipality_id
+            ).join(
+                UserLocationVisit,
+                Location.location_id == UserLocationVisit.location_id
+            ).filter(
+                UserLocationVisit.user_id == user_id
+            ).group_by(Municipality.name)
+        )).all()
+
+        progress_by_municipality_list = [
+            {"municipality_name": name, "visited_count": count}
+            for name, count in progress_by_municipality_query
+        ]
+
+        return jsonify({
+            "total_visits": user_stats["unique_visits_count"],
+            "visited_locations": visited_locations_list,
+            "total_locations": total_available_locations,
+            "progress_by_municipality": progress_by_municipality_list
+        }), 200
+
+
+@app.route('/users/<int:user_id>/achievements', methods=['GET'])
+async def get_user_achievements_earned_route(user_id):
+    """Obtiene los logros desbloqueados por un usuario."""
+    async with get_async_db() as db:
+        user = await db.get(User, user_id)
+        if not user:
+            return jsonify({
+                "message": f"Usuario con ID {user_id} no encontrado."
+            }), 404
+
+        earned_db_achievements = (await db.execute(
+            select(Achievement).join(
+                UserAchievement,
+                Achievement.achievement_id == UserAchievement.achievement_id
+            ).filter(UserAchievement.user_id == user_id)
+        )).scalars().all()
+
+        achievements_list = [{
+            "id": ach.achievement_id,
+            "name": ach.name,
+            "description": ach.description
+        } for ach in earned_db_achievements]
+
+        return jsonify(achievements_list), 200
+
+
+@app.route('/events', methods=['GET'])
+async def event_stream_route():
+    """
+    Flujo Server-Sent Events de check-ins y logros desbloqueados.
+    Requiere "Authorization: Bearer <token>" y envía solo los eventos de ese
+    usuario. Con X-Admin-Token, ?user_id=1&user_id=2 elige los usuarios y
+    sin user_id se reciben los de todos.
+    """
+    user_ids, error = event_stream_user_ids(
+        request.args.getlist('user_id', type=int),
+        request.headers.get('Authorization'), request.headers.get('X-Admin-Token')
+    )
+    if error:
+        return jsonify(error[0]), error[1]
+    subscription = get_event_bus().subscribe(
+        user_ids, max_subscribers=ASGI_EVENT_MAX_SUBSCRIBERS
+    )
+    if subscription is None:
+        return jsonify({"message": "Demasiadas conexiones de eventos abiertas."}), 503
+
+    async def generate():
+        try:
+            yield format_sse(event_type="ready", data={"user_ids": user_ids})
+            while True:
+                event, dropped = await subscription.get_async(
+                    timeout=EVENT_HEARTBEAT_SECONDS
+                )
+                if dropped:
+                    yield format_sse(event_type="dropped", data={"count": dropped})
+                if event is not None:
+                    yield format_sse(event)
+                else:
+                    # Comentario SSE: mantiene viva la conexión y detecta cierres
+                    yield b": ping\n\n"
+        finally:
+            subscription.close()
+
+    response = Response(
+        generate(), mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.timeout = None  # conexión de larga duración
+    return response
+
+
+# Ejecutar la Aplicación (solo desarrollo; en producción usar hypercorn.toml)
+if __name__ == '__main__':
+    logger.info("Iniciando la aplicación ASGI en modo desarrollo...")
+    logger.info(f"Async Database URL configurada: {ASYNC_DATABASE_URL}")
+    app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,88 @@
+# auth_tokens.py
+"""
+Tokens de sesión firmados que emite POST /login.
+
+El token es el user_id firmado con SECRET_KEY (itsdangerous, que ya instala
+Flask) y caduca a los AUTH_TOKEN_MAX_AGE segundos. Los clientes lo envían en
+la cabecera "Authorization: Bearer <token>". Así las rutas pueden saber qué
+usuario hace la petición sin fiarse del user_id del cuerpo, por ejemplo
+para el límite de check-ins por usuario o el flujo /events.
+
+ADMIN_TOKEN (cabecera X-Admin-Token) habilita las rutas /admin y el flujo
+de eventos de todos los usuarios.
+
+Sin SECRET_KEY se genera una clave aleatoria al importar el módulo: con
+preload_app la comparten los workers de gunicorn, pero los tokens dejan de
+valer al reiniciar. En producción hay que definirla.
+"""
+
+import hmac
+import logging
+import os
+import secrets
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+logger = logging.getLogger(__name__)
+
+SECRET_KEY = os.getenv('SECRET_KEY')
+AUTH_TOKEN_MAX_AGE = int(os.getenv('AUTH_TOKEN_MAX_AGE', 30 * 86400))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+if not SECRET_KEY:
+    logger.warning("SECRET_KEY no está definida: los tokens no sobreviven a un reinicio")
+    SECRET_KEY = secrets.token_hex(32)
+
+_serializer = URLSafeTimedSerializer(SECRET_KEY, salt="tnf-auth")
+
+
+def issue_token(user_id):
+    """Token firmado para el usuario."""
+    return _serializer.dumps(int(user_id))
+
+
+def verify_token(token):
+    """user_id del token, o None si no es válido o ha caducado."""
+    try:
+        return int(_serializer.loads(token, max_age=AUTH_TOKEN_MAX_AGE))
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+
+def bearer_token(authorization_header):
+    """Token de una cabecera Authorization: Bearer, o None."""
+    if not authorization_header:
+        return None
+    scheme, _, token = authorization_header.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    return token.strip()
+
+
+def is_admin_token(token):
+    """True si token es ADMIN_TOKEN (comparación en tiempo constante)."""
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+
+def event_stream_user_ids(requested_user_ids, authorization_header, admin_header):
+    """
+    Usuarios cuyos eventos puede recibir una conexión a /events.
+
+    Un usuario solo recibe sus propios eventos (token Bearer). Con
+    X-Admin-Token se pueden pedir otros usuarios o, sin ?user_id, todos.
+
+    Returns:
+        tuple: (user_ids o None para todos, None), o (None, (respuesta JSON,
+        estado HTTP)) si la petición no está autorizada
+    """
+    if is_admin_token(admin_header):
+        return (requested_user_ids or None), None
+    token = bearer_token(authorization_header)
+    user_id = verify_token(token) if token else None
+    if user_id is None:
+        return None, ({"message": "Se requiere un token válido."}, 401)
+    if any(requested != user_id for requested in requested_user_ids):
+        return None, ({"message": "Solo puedes recibir tus propios eventos."}, 403)
+    return [user_id], None
@@ -0,0 +1,118 @@
+# benchmarks/bench_backfill.py
+"""
+Benchmark del recálculo masivo de logros (achievement_backfill.py).
+
+Crea una base SQLite temporal con N usuarios y sus visitas aleatorias sobre
+un catálogo sintético (ubicaciones repartidas en municipios, un logro de
+total, uno de municipios distintos y uno de completar cada municipio) y
+ejecuta run_backfill con 1 proceso y con W procesos. Muestra usuarios por
+segundo y logros insertados; las dos ejecuciones deben otorgar lo mismo.
+
+Uso:
+    python benchmarks/bench_backfill.py [usuarios] [visitas_por_usuario] [procesos]
+"""
+
+import os
+import sys
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from sqlalchemy import delete, insert
+
+from achievement_backfill import run_backfill
+from achievement_rules import AchievementRules
+from models import User, UserAchievement, UserLocationVisit
+from sharding import ShardRouter
+
+LOCATIONS = 2000
+MUNICIPALITIES = 31
+
+_Location = namedtuple("_Location", ("location_id", "municipality_id"))
+_Achievement = namedtuple(
+    "_Achievement", ("achievement_id", "type", "target_value", "target_entity_id")
+)
+_Catalog = namedtuple("_Catalog", ("version", "locations", "achievements"))
+
+
+class _Geography:
+    """Solo lo que usan las reglas de completar: ubicaciones por municipio."""
+
+    def __init__(self, locations):
+        self._by_municipality = {}
+        for loc in locations:
+            self._by_municipality.setdefault(loc.municipality_id, []).append(loc.location_id)
+
+    def location_ids(self, level, entity_id):
+        return self._by_municipality.get(entity_id, [])
+
+
+def _synthetic_rules():
+    locations = [
+        _Location(location_id, location_id % MUNICIPALITIES + 1)
+        for location_id in range(1, LOCATIONS + 1)
+    ]
+    achievements = [
+        _Achievement(1, "total_count", 25, None),
+        _Achievement(2, "municipality_count", 10, None),
+    ] + [
+        _Achievement(2 + municipality_id, "municipality_complete", None, municipality_id)
+        for municipality_id in range(1, MUNICIPALITIES + 1)
+    ]
+    return AchievementRules(
+        _Catalog("bench", locations, achievements), _Geography(locations)
+    )
+
+
+def _populate(router, users, visits_per_user, seed=7):
+    rng = np.random.default_rng(seed)
+    shard = router.shards[0]
+    session = shard.SessionLocal()
+    session.execute(insert(User), [
+        {"user_id": user_id, "username": f"bench{user_id}", "password_hash": "x"}
+        for user_id in range(1, users + 1)
+    ])
+    visits = []
+    for user_id in range(1, users + 1):
+        count = int(rng.integers(1, visits_per_user * 2))
+        for location_id in np.unique(rng.integers(1, LOCATIONS + 1, count)).tolist():
+            visits.append({"user_id": user_id, "location_id": location_id})
+    session.execute(insert(UserLocationVisit), visits)
+    session.commit()
+    session.close()
+    return len(visits)
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    visits_per_user = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 1)
+
+    rules = _synthetic_rules()
+    with tempfile.TemporaryDirectory() as directory:
+        router = ShardRouter([f"sqlite:///{os.path.join(directory, 'bench_backfill.db')}"])
+        router.create_tables(drop=True)
+        visit_count = _populate(router, users, visits_per_user)
+        print(f"{users} usuarios, {visit_count} visitas, {len(rules.rules)} reglas")
+
+        shard = router.shards[0]
+        for process_count in sorted({1, workers}):
+            session = shard.SessionLocal()
+            session.execute(delete(UserAchievement))
+            session.commit()
+            session.close()
+            stats = run_backfill(
+                rules, shard.SessionLocal, shard.SessionLocal,
+                workers=process_count, checkpoint_path=None,
+            )
+            rate = stats["users"] / stats["seconds"] if stats["seconds"] else 0.0
+            print(f"{process_count} proceso(s): {rate:8.0f} usuarios/s, "
+                  f"{stats['awarded']} logros en {stats['seconds']:.2f}s")
+        router.dispose()
+
+
+if __name__ == "__main__":
+    main()
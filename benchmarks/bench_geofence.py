@@ -0,0 +1,74 @@
+# benchmarks/bench_geofence.py
+"""
+Benchmark de las geovallas poligonales.
+
+Genera un límite sintético del tamaño del Parque Nacional del Teide (radio
+~9 km con ruido en el borde y N vértices), mide la simplificación
+Douglas-Peucker y la evaluación de un check-in (dentro/fuera y distancia al
+borde). Objetivo: validación por debajo de un milisegundo.
+
+Uso:
+    python benchmarks/bench_geofence.py [num_vertices] [repeticiones]
+"""
+
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from geofence import Geofence, METERS_PER_DEGREE
+
+CENTRE = (28.2724, -16.6425)
+RADIUS_METERS = 9000
+
+_Entry = namedtuple(
+    "_Entry", ("location_id", "latitude", "longitude", "checkin_radius_meters",
+               "geofence_polygon", "geofence_bbox")
+)
+
+
+def _synthetic_boundary(size, seed=3):
+    """Anillo irregular de size vértices alrededor de CENTRE."""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * math.pi, size, endpoint=False)
+    radii = RADIUS_METERS * (1 + 0.15 * np.sin(7 * angles)) + rng.normal(0, 30, size)
+    lat = CENTRE[0] + radii * np.sin(angles) / METERS_PER_DEGREE
+    lng = CENTRE[1] + radii * np.cos(angles) / (
+        METERS_PER_DEGREE * math.cos(math.radians(CENTRE[0]))
+    )
+    return np.column_stack([lat, lng]).tolist()
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    entry = _Entry(1, CENTRE[0], CENTRE[1], None,
+                   json.dumps(_synthetic_boundary(size)), None)
+
+    start = time.perf_counter()
+    fence = Geofence(entry, 4000)
+    print(f"Simplificación de {fence.polygon.original_vertex_count} vértices a "
+          f"{fence.polygon.vertex_count}: {(time.perf_counter() - start) * 1000:.2f} ms "
+          f"(una vez por versión del catálogo)")
+
+    for label, point in (("dentro", CENTRE),
+                         ("junto al borde", (CENTRE[0], CENTRE[1] + 0.0925)),
+                         ("fuera", (28.46, -16.25))):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            inside, distances = fence.evaluate(*point)
+            timings.append((time.perf_counter() - start) * 1e6)
+        print(f"Check-in {label}: mediana {statistics.median(timings):.1f} µs, "
+              f"dentro={bool(inside[0])}, distancia {distances[0]:.0f} m")
+
+
+if __name__ == "__main__":
+    main()
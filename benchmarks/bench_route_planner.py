@@ -0,0 +1,66 @@
+# benchmarks/bench_route_planner.py
+"""
+Benchmark del planificador de rutas (vecino más cercano + 2-opt).
+
+Genera un catálogo sintético en Tenerife y mide el tiempo de plan_route con
+N candidatas en un solo núcleo. Objetivo: < 100 ms para 200 puntos.
+
+Uso:
+    python benchmarks/bench_route_planner.py [num_candidatas] [repeticiones]
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from catalog import CatalogSnapshot, LocationEntry
+from route_planner import get_distance_matrix, plan_route
+
+
+def _synthetic_catalog(size, seed=42):
+    """Catálogo con ubicaciones aleatorias dentro del recuadro de Tenerife."""
+    rng = random.Random(seed)
+    entries = []
+    for location_id in range(1, size + 1):
+        values = dict.fromkeys(LocationEntry._fields)
+        values.update(
+            location_id=location_id,
+            name=f"Ubicación {location_id}",
+            latitude=rng.uniform(28.0, 28.6),
+            longitude=rng.uniform(-16.9, -16.1),
+            municipality_id=1,
+        )
+        entries.append(LocationEntry(**values))
+    return CatalogSnapshot(entries, [], [], [])
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    catalog = _synthetic_catalog(size)
+
+    start = time.perf_counter()
+    get_distance_matrix(catalog)
+    print(f"Matriz {size}x{size} (una vez por versión): "
+          f"{(time.perf_counter() - start) * 1000:.2f} ms")
+
+    timings, iterations = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        plan = plan_route(catalog, 28.3, -16.5, list(catalog.locations),
+                          radius_meters=None, time_budget_ms=1000)
+        timings.append((time.perf_counter() - start) * 1000)
+        iterations.append(plan["iterations"])
+
+    print(f"plan_route con {plan['candidates_considered']} candidatas: "
+          f"mediana {statistics.median(timings):.2f} ms, "
+          f"máx {max(timings):.2f} ms, mejoras 2-opt {statistics.median(iterations):.0f}, "
+          f"convergió: {plan['converged']}")
+
+
+if __name__ == "__main__":
+    main()
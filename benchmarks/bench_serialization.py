@@ -0,0 +1,180 @@
+# benchmarks/bench_serialization.py
+"""
+Benchmark del coste por fila de /locations y /users/<id>/visits.
+
+Compara la construcción anterior (objetos ORM hidratados + dicts a mano +
+json) con la capa de serializers.py (tuplas de columnas + RowEncoder +
+orjson si está disponible) sobre una base SQLite en memoria.
+
+Uso:
+    python benchmarks/bench_serialization.py [num_ubicaciones] [repeticiones]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from sqlalchemy import create_engine, distinct
+from sqlalchemy.orm import joinedload, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import (
+    Base, Continent, Country, AutonomousCommunity, Province,
+    Municipality, Location, User, UserLocationVisit
+)
+from serializers import (
+    LOCATION_LIST_ENCODER, VISITED_LOCATION_ENCODER, dumps, orjson
+)
+
+
+def _build_database(num_locations):
+    """Crea una base en memoria con num_locations ubicaciones y un usuario que visitó la mitad."""
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+    session = Session()
+
+    continent = Continent(name="Europa")
+    country = Country(name="España", continent=continent)
+    ac = AutonomousCommunity(name="Canarias", country=country)
+    province = Province(name="Santa Cruz de Tenerife", autonomous_community=ac)
+    municipalities = [
+        Municipality(name=f"Municipio {i}", province=province) for i in range(30)
+    ]
+    session.add_all(municipalities)
+    session.flush()
+
+    session.add_all([
+        Location(
+            name=f"Ubicación {i:05d}",
+            description="Descripción de prueba " * 8,
+            latitude=28.0 + i * 1e-4,
+            longitude=-16.5 - i * 1e-4,
+            main_image_url=f"http://localhost/static/{i}.jpg",
+            unlocked_content_url=f"http://localhost/static/{i}_full.jpg",
+            difficulty="Fácil Acceso",
+            is_natural=bool(i % 2),
+            best_season="Todo el Año",
+            best_time_of_day="Mañana",
+            municipality_id=municipalities[i % len(municipalities)].municipality_id,
+        )
+        for i in range(num_locations)
+    ])
+    user = User(username="bench", password_hash="x")
+    session.add(user)
+    session.flush()
+    user_id = user.user_id
+    session.add_all([
+        UserLocationVisit(user_id=user_id, location_id=location_id)
+        for location_id in range(1, num_locations + 1, 2)
+    ])
+    session.commit()
+    session.close()
+    return Session, user_id
+
+
+def legacy_locations(db):
+    """Implementación anterior de GET /locations."""
+    results = db.query(Location, Municipality).join(
+        Municipality, Location.municipality_id == Municipality.municipality_id
+    ).order_by(Location.name).all()
+    payload = [{
+        "location_id": loc.location_id,
+        "name": loc.name,
+        "description": loc.description,
+        "latitude": loc.latitude,
+        "longitude": loc.longitude,
+        "municipality_id": loc.municipality_id,
+        "municipality_name": muni.name,
+        "difficulty": loc.difficulty,
+        "is_natural": loc.is_natural,
+        "best_season": loc.best_season,
+        "best_time_of_day": loc.best_time_of_day,
+        "main_image_url": loc.main_image_url
+    } for loc, muni in results]
+    return json.dumps(payload, sort_keys=True), len(payload)
+
+
+def lean_locations(db):
+    """Implementación actual de GET /locations."""
+    results = db.query(*LOCATION_LIST_ENCODER.columns).join(
+        Municipality, Location.municipality_id == Municipality.municipality_id
+    ).order_by(Location.name).all()
+    payload = LOCATION_LIST_ENCODER.encode(results)
+    return dumps(payload), len(payload)
+
+
+def legacy_visits(db, user_id):
+    """Implementación anterior del listado de GET /users/<id>/visits."""
+    ids = [
+        item[0] for item in db.query(distinct(UserLocationVisit.location_id))
+        .filter(UserLocationVisit.user_id == user_id).all()
+    ]
+    objects = db.query(Location).options(
+        joinedload(Location.municipality)
+    ).filter(Location.location_id.in_(ids)).order_by(Location.name).all()
+    payload = [{
+        "location_id": loc.location_id,
+        "name": loc.name,
+        "description": loc.description,
+        "latitude": loc.latitude,
+        "longitude": loc.longitude,
+        "difficulty": loc.difficulty,
+        "is_natural": loc.is_natural,
+        "best_season": loc.best_season,
+        "best_time_of_day": loc.best_time_of_day,
+        "main_image_url": loc.main_image_url,
+        "municipality_name": loc.municipality.name if loc.municipality else "Desconocido",
+    } for loc in objects]
+    return json.dumps(payload, sort_keys=True), len(payload)
+
+
+def lean_visits(db, user_id):
+    """Implementación actual del listado de GET /users/<id>/visits."""
+    ids = db.query(UserLocationVisit.location_id).filter(
+        UserLocationVisit.user_id == user_id
+    )
+    rows = db.query(*VISITED_LOCATION_ENCODER.columns).outerjoin(
+        Municipality, Location.municipality_id == Municipality.municipality_id
+    ).filter(Location.location_id.in_(ids)).order_by(Location.name).all()
+    payload = VISITED_LOCATION_ENCODER.encode(rows)
+    return dumps(payload), len(payload)
+
+
+def _measure(Session, func, *args, repeat):
+    """Devuelve el coste medio por fila en microsegundos."""
+    best = float("inf")
+    for _ in range(repeat):
+        db = Session()
+        start = time.perf_counter()
+        _, rows = func(db, *args)
+        elapsed = time.perf_counter() - start
+        db.close()
+        best = min(best, elapsed / max(rows, 1))
+    return best * 1e6
+
+
+def main():
+    num_locations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    Session, user_id = _build_database(num_locations)
+
+    print(f"Ubicaciones: {num_locations}, repeticiones: {repeat}, "
+          f"backend JSON: {'orjson' if orjson else 'json'}")
+    for label, legacy, lean, args in (
+        ("/locations", legacy_locations, lean_locations, ()),
+        ("/users/<id>/visits", legacy_visits, lean_visits, (user_id,)),
+    ):
+        before = _measure(Session, legacy, *args, repeat=repeat)
+        after = _measure(Session, lean, *args, repeat=repeat)
+        print(f"{label:<22} antes: {before:7.2f} µs/fila  "
+              f"después: {after:7.2f} µs/fila  ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# benchmarks/bench_sharding.py
+"""
+Benchmark de escritura de check-ins con 1, 2, 4... shards SQLite.
+
+Crea N ficheros en un directorio temporal, registra usuarios repartidos por
+user_id % N y lanza procesos (como los workers de gunicorn) que escriben
+check-ins (visita + commit, como POST /checkin) en paralelo. Con un único
+fichero todos los commits esperan al mismo bloqueo de escritura; con N
+shards el rendimiento debería crecer de forma aproximadamente lineal hasta
+saturar la CPU o el disco (con un solo núcleo apenas hay diferencia).
+
+Uso:
+    python benchmarks/bench_sharding.py [max_shards] [procesos] [checkins_por_proceso]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from sqlalchemy.exc import OperationalError
+
+from models import User, UserLocationVisit
+from sharding import ShardRouter
+
+
+def _worker(urls, user_id, checkins, retries):
+    """Escribe check-ins del usuario, reintentando si la base está bloqueada."""
+    router = ShardRouter(urls)
+    factory = router.shard_for(user_id).SessionLocal
+    for location_id in range(1, checkins + 1):
+        while True:
+            session = factory()
+            try:
+                session.add(UserLocationVisit(user_id=user_id, location_id=location_id))
+                session.commit()
+                break
+            except OperationalError:  # database is locked
+                session.rollback()
+                with retries.get_lock():
+                    retries.value += 1
+            finally:
+                session.close()
+
+
+def _run(shard_count, processes, checkins_per_process, directory):
+    urls = [f"sqlite:///{os.path.join(directory, f'bench_{shard_count}_{i}.db')}"
+            for i in range(shard_count)]
+    router = ShardRouter(urls)
+    router.create_tables(drop=True)
+
+    user_ids = list(range(1, processes + 1))
+    for user_id in user_ids:
+        session = router.shard_for(user_id).SessionLocal()
+        session.add(User(user_id=user_id, username=f"bench{user_id}", password_hash="x"))
+        session.commit()
+        session.close()
+    router.dispose()
+
+    retries = multiprocessing.Value("i", 0)
+    workers = [
+        multiprocessing.Process(
+            target=_worker, args=(urls, user_id, checkins_per_process, retries)
+        )
+        for user_id in user_ids
+    ]
+    start = time.perf_counter()
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    elapsed = time.perf_counter() - start
+    return processes * checkins_per_process / elapsed, retries.value
+
+
+def main():
+    max_shards = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    checkins_per_process = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = None
+        shard_count = 1
+        while shard_count <= max_shards:
+            rate, retries = _run(shard_count, processes, checkins_per_process, directory)
+            baseline = baseline or rate
+            print(f"{shard_count} shard(s): {rate:8.0f} check-ins/s "
+                  f"(x{rate / baseline:.2f}, {retries} reintentos por bloqueo)")
+            shard_count *= 2
+
+
+if __name__ == "__main__":
+    main()
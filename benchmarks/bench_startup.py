@@ -0,0 +1,64 @@
+# benchmarks/bench_startup.py
+"""
+Benchmark de arranque de un worker.
+
+Mide, en procesos nuevos, el tiempo de importar app.py y la latencia de la
+primera petición a /locations y /locations/<id>, con y sin la instantánea del
+catálogo precargada (como hace gunicorn.conf.py antes del fork).
+Necesita una base de datos poblada en el directorio actual
+(python -m poblacion_db.main_populate).
+
+Uso:
+    python benchmarks/bench_startup.py [repeticiones]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+WORKER_SCRIPT = r"""
+import json, logging, sys, time
+sys.path.insert(0, {root!r})
+logging.disable(logging.CRITICAL)
+start = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - start) * 1000
+if {preload!r}:
+    from catalog import get_catalog
+    get_catalog()
+client = app.app.test_client()
+timings = {{"import_ms": import_ms, "geopy_loaded": "geopy" in sys.modules}}
+for label, url in (("first_list_ms", "/locations"), ("first_detail_ms", "/locations/1")):
+    start = time.perf_counter()
+    client.get(url)
+    timings[label] = (time.perf_counter() - start) * 1000
+print(json.dumps(timings))
+"""
+
+
+def _run_worker(preload):
+    """Lanza un intérprete nuevo y devuelve sus tiempos de arranque."""
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER_SCRIPT.format(root=ROOT_DIR, preload=preload)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for preload in (False, True):
+        runs = [_run_worker(preload) for _ in range(repeat)]
+        label = "con catálogo precargado" if preload else "en frío"
+        print(f"Worker {label} (mediana de {repeat}):")
+        for key in ("import_ms", "first_list_ms", "first_detail_ms"):
+            print(f"  {key:<16} {statistics.median(r[key] for r in runs):8.2f} ms")
+        print(f"  geopy importado: {runs[0]['geopy_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
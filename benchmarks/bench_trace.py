@@ -0,0 +1,68 @@
+# benchmarks/bench_trace.py
+"""
+Benchmark de la detección de geovallas sobre trazas GPS.
+
+Genera un catálogo sintético en Tenerife y una traza de senderismo y mide
+detect_visits con el índice (franja de latitud, longitud) frente a calcular
+la distancia de cada punto a todas las ubicaciones. Objetivo: 10.000 puntos
+muy por debajo de un segundo.
+
+Uso:
+    python benchmarks/bench_trace.py [num_ubicaciones] [num_puntos]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+
+from bench_route_planner import _synthetic_catalog
+from route_planner import haversine_matrix
+from trace_checkin import GeofenceIndex, detect_visits
+
+RADIUS_METERS = 300
+MIN_DWELL_SECONDS = 120
+
+
+def _synthetic_trace(size, seed=7):
+    """Paseo aleatorio de un punto cada 5 segundos por el centro de la isla."""
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 0.0002, size=(size, 2))
+    path = np.cumsum(steps, axis=0) + (28.3, -16.5)
+    timestamps = 1_790_000_000 + np.arange(size) * 5.0
+    return path[:, 0], path[:, 1], timestamps
+
+
+def main():
+    num_locations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    num_points = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    catalog = _synthetic_catalog(num_locations)
+    latitudes, longitudes, timestamps = _synthetic_trace(num_points)
+
+    start = time.perf_counter()
+    index = GeofenceIndex(catalog, RADIUS_METERS)
+    print(f"Índice de {num_locations} ubicaciones (una vez por versión): "
+          f"{(time.perf_counter() - start) * 1000:.2f} ms")
+
+    timings = []
+    for _ in range(10):
+        start = time.perf_counter()
+        visits = detect_visits(index, latitudes, longitudes, timestamps, MIN_DWELL_SECONDS)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"detect_visits con {num_points} puntos: mediana "
+          f"{statistics.median(timings):.2f} ms, {len(visits)} visitas")
+
+    start = time.perf_counter()
+    inside = haversine_matrix(latitudes, longitudes, index.latitudes, index.longitudes) \
+        <= RADIUS_METERS
+    print(f"Fuerza bruta (puntos × ubicaciones): "
+          f"{(time.perf_counter() - start) * 1000:.2f} ms, "
+          f"{int(inside.sum())} pares dentro del radio")
+
+
+if __name__ == "__main__":
+    main()
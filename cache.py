@@ -0,0 +1,357 @@
+# cache.py
+"""
+Caché de dos niveles para las lecturas calientes de la API.
+
+- Nivel 1: LRU en memoria del proceso, con TTL y expulsión por tamaño
+  (CACHE_MAX_BYTES). Los valores son siempre bytes (JSON ya serializado),
+  así el tamaño de cada entrada es exacto.
+- Nivel 2 (opcional): el backend compartido de SHARED_BACKEND_URL, común a
+  todos los workers.
+
+Cada entrada lleva etiquetas (p. ej. "user:5", "catalog"). Las escrituras
+llaman a invalidate(*etiquetas): en el nivel 1 se borran las entradas con esas
+etiquetas; en el nivel 2 se incrementa la versión de cada etiqueta, de modo
+que las entradas grabadas con una versión anterior dejan de ser válidas. Con
+backend compartido la invalidación se difunde por pub/sub al resto de
+procesos (incluidos los scripts de poblamiento, que corren aparte).
+
+get_or_set() agrupa las peticiones concurrentes de una misma clave en el
+proceso (single-flight): solo una calcula el valor y las demás lo esperan.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+from shared_backend import get_shared_backend
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_DEFAULT_TTL = float(os.getenv('CACHE_DEFAULT_TTL', 300))
+CACHE_INVALIDATION_CHANNEL = os.getenv('CACHE_INVALIDATION_CHANNEL', 'tnf:cache:invalidate')
+# Versiones de etiqueta del nivel 2 que se recuerdan en memoria
+TAG_VERSIONS_MAX = 100000
+_L2_PREFIX = "cache:v:"
+_TAG_PREFIX = "cache:tag:"
+
+
+class _Flight:
+    """Cálculo en curso de una clave, compartido por las peticiones que esperan."""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class Cache:
+    """Caché LRU/TTL en proceso con segundo nivel compartido opcional."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, default_ttl=CACHE_DEFAULT_TTL,
+                 shared_backend=None, channel=CACHE_INVALIDATION_CHANNEL):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._shared_backend = shared_backend
+        self._channel = channel
+        self._origin = uuid.uuid4().hex
+
+        self._entries = OrderedDict()   # clave -> (valor, expira, etiquetas)
+        self._keys_by_tag = defaultdict(set)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._tag_versions = OrderedDict()
+        self._callbacks = defaultdict(list)
+        self._listener = None
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    # Nivel 1
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _l1_set(self, key, value, ttl, tags):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl, tags)
+            self._size += len(value)
+            for tag in tags:
+                self._keys_by_tag[tag].add(key)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["_all"]["evictions"] += 1
+
+    def _remove(self, key):
+        """Elimina una entrada del nivel 1 (con el lock tomado)."""
+        value, _, tags = self._entries.pop(key)
+        self._size -= len(value)
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    # Nivel 2
+
+    def _tag_version(self, tag):
+        """Versión vigente de una etiqueta en el backend compartido."""
+        with self._lock:
+            version = self._tag_versions.get(tag)
+            if version is not None:
+                self._tag_versions.move_to_end(tag)
+                return version
+        version = int(self._shared_backend.get(_TAG_PREFIX + tag) or 0)
+        self._remember_tag_version(tag, version)
+        return version
+
+    def _remember_tag_version(self, tag, version):
+        with self._lock:
+            if version >= self._tag_versions.get(tag, 0):
+                self._tag_versions[tag] = version
+            self._tag_versions.move_to_end(tag)
+            while len(self._tag_versions) > TAG_VERSIONS_MAX:
+                self._tag_versions.popitem(last=False)
+
+    def _l2_get(self, key, tags):
+        raw = self._shared_backend.get(_L2_PREFIX + key)
+        if raw is None:
+            return None
+        header, _, value = raw.partition(b"\n")
+        stored_versions = json.loads(header)
+        for tag in tags:
+            if stored_versions.get(tag, 0) != self._tag_version(tag):
+                return None
+        return value
+
+    def _l2_set(self, key, value, ttl, versions):
+        header = json.dumps(versions, separators=(",", ":")).encode('utf-8')
+        self._shared_backend.set(
+            _L2_PREFIX + key, header + b"\n" + value, px=int(ttl * 1000)
+        )
+
+    # API pública
+
+    def get_or_set(self, key, compute, ttl=None, tags=()):
+        """
+        Devuelve el valor de key, calculándolo con compute() si no está.
+
+        Args:
+            key: Clave; el prefijo hasta ':' agrupa las métricas
+            compute: Función sin argumentos que devuelve bytes, o None para
+                no guardar nada (p. ej. un 404)
+            ttl: Segundos de vida (por defecto CACHE_DEFAULT_TTL)
+            tags: Etiquetas para invalidar la entrada
+
+        Returns:
+            bytes o None
+        """
+        namespace = key.split(":", 1)[0]
+        tags = tuple(tags)
+        ttl = self.default_ttl if ttl is None else ttl
+        if self._shared_backend is not None:
+            self._ensure_listener()
+
+        value = self._l1_get(key)
+        if value is not None:
+            self._count(namespace, "hits_l1")
+            return value
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count(namespace, "coalesced")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._load(key, compute, ttl, tags, namespace)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _load(self, key, compute, ttl, tags, namespace):
+        """Busca en el nivel 2 y, si falla, calcula y guarda en ambos niveles."""
+        versions = None
+        if self._shared_backend is not None:
+            try:
+                value = self._l2_get(key, tags)
+                if value is not None:
+                    self._count(namespace, "hits_l2")
+                    self._l1_set(key, value, ttl, tags)
+                    return value
+                # Versiones tomadas antes de calcular: si llega una
+                # invalidación durante el cálculo, la entrada ya nace caducada
+                versions = {tag: self._tag_version(tag) for tag in tags}
+            except Exception as e:
+                logger.warning(f"Caché compartida no disponible: {e}")
+
+        self._count(namespace, "misses")
+        with self._lock:
+            invalidations_before = self._stats["_all"]["invalidations"]
+        value = compute()
+        if value is None:
+            return None
+
+        with self._lock:
+            invalidated = self._stats["_all"]["invalidations"] != invalidations_before
+        if not invalidated:
+            self._l1_set(key, value, ttl, tags)
+        if versions is not None:
+            try:
+                self._l2_set(key, value, ttl, versions)
+            except Exception as e:
+                logger.warning(f"No se pudo guardar en la caché compartida: {e}")
+        return value
+
+    def invalidate(self, *tags):
+        """Invalida las entradas con cualquiera de las etiquetas, en todos los procesos."""
+        if not tags:
+            return
+        versions = {}
+        if self._shared_backend is not None:
+            try:
+                for tag in tags:
+                    versions[tag] = int(self._shared_backend.incr(_TAG_PREFIX + tag))
+                self._shared_backend.publish(self._channel, json.dumps({
+                    "origin": self._origin, "versions": versions,
+                }))
+            except Exception as e:
+                logger.error(f"Error al difundir la invalidación de {tags}: {e}")
+        self._apply_invalidation(tags, versions)
+
+    def invalidate_local(self, *tags):
+        """
+        Invalida las etiquetas solo en este proceso, sin difundirlo (para
+        cambios que cada proceso detecta por su cuenta).
+        """
+        if tags:
+            self._apply_invalidation(tags, {})
+
+    def _apply_invalidation(self, tags, versions):
+        with self._lock:
+            self._stats["_all"]["invalidations"] += 1
+            for tag in tags:
+                for key in tuple(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+        for tag, version in versions.items():
+            self._remember_tag_version(tag, version)
+        for tag in tags:
+            for callback in self._callbacks.get(tag, ()):
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error en la invalidación de '{tag}': {e}")
+
+    def on_invalidate(self, tag, callback):
+        """Registra una función a ejecutar cuando se invalide la etiqueta."""
+        self._callbacks[tag].append(callback)
+
+    def _ensure_listener(self):
+        """
+        Arranca el hilo que recibe invalidaciones ajenas. Se comprueba en cada
+        consulta porque los hilos no sobreviven al fork de los workers.
+        """
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._flights_lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(
+                target=self._listen, name="cache-invalidation", daemon=True
+            )
+            self._listener.start()
+
+    def _listen(self):
+        pubsub = self._shared_backend.pubsub()
+        pubsub.subscribe(self._channel)
+        try:
+            while True:
+                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                try:
+                    payload = json.loads(message["data"])
+                except ValueError:
+                    continue
+                if payload.get("origin") == self._origin:
+                    continue
+                versions = payload.get("versions", {})
+                self._apply_invalidation(tuple(versions), versions)
+        except Exception as e:
+            logger.error(f"Hilo de invalidación de caché detenido: {e}")
+        finally:
+            pubsub.close()
+
+    # Métricas
+
+    def _count(self, namespace, name):
+        with self._lock:
+            self._stats[namespace][name] += 1
+
+    def stats(self):
+        """Aciertos, fallos y tamaño por espacio de claves."""
+        with self._lock:
+            namespaces = {}
+            for namespace, counters in self._stats.items():
+                if namespace == "_all":
+                    continue
+                hits = counters["hits_l1"] + counters["hits_l2"] + counters["coalesced"]
+                lookups = hits + counters["misses"]
+                namespaces[namespace] = {
+                    **counters,
+                    "hit_ratio": round(hits / lookups, 4) if lookups else None,
+                }
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "evictions": self._stats["_all"]["evictions"],
+                "invalidations": self._stats["_all"]["invalidations"],
+                "shared_tier": self._shared_backend is not None,
+                "namespaces": namespaces,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Devuelve la caché del proceso, con nivel 2 si hay backend compartido."""
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = Cache(shared_backend=get_shared_backend())
+        return _cache
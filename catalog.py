@@ -0,0 +1,261 @@
+# catalog.py
+"""
+Instantánea en memoria del catálogo: ubicaciones, municipios, logros y niveles.
+
+El catálogo solo cambia al ejecutar los scripts de poblamiento, así que se
+carga una vez en estructuras inmutables (tuplas y MappingProxyType). Con
+gunicorn y preload_app se carga en el proceso maestro antes del fork, de modo
+que los workers la comparten copy-on-write y no arrancan en frío.
+Cada ubicación guarda además sus respuestas JSON ya serializadas.
+
+Los cambios del catálogo incrementan sync_counter (models.py). Cada
+CATALOG_VERSION_CHECK_SECONDS, get_catalog() compara ese contador con el de
+la instantánea y, si cambió, invalida localmente la etiqueta "catalog"; los
+puntos de entrada registran ahí la recarga de catálogo y geografía. Así los
+workers ven un repoblamiento aunque no haya backend compartido que difunda la
+invalidación (con redis llega antes por pub/sub).
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from sqlalchemy import func
+
+from cache import get_cache
+from models import Location, Municipality, Achievement, Level, SyncCounter
+from poblacion_db.session_setup import ReadSessionLocal
+from serializers import LOCATION_LIST_ENCODER, LOCATION_DETAIL_ENCODER, dumps
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto comprueba un worker si el catálogo cambió (0 desactiva)
+CATALOG_VERSION_CHECK_SECONDS = float(os.getenv('CATALOG_VERSION_CHECK_SECONDS', 5))
+
+LocationEntry = namedtuple(
+    "LocationEntry",
+    LOCATION_DETAIL_ENCODER.fields + (
+        "checkin_radius_meters",  # radio propio de la geovalla o None
+        "geofence_polygon",    # JSON [[lat, lng], ...] o None
+        "geofence_bbox",       # (min_lat, min_lng, max_lat, max_lng) o None
+        "search_text",         # nombre y descripción normalizados para ?q=
+        "list_json",           # elemento de GET /locations
+        "detail_json",         # GET /locations/<id> con contenido desbloqueado
+        "detail_locked_json",  # GET /locations/<id> sin contenido desbloqueado
+    )
+)
+MunicipalityEntry = namedtuple(
+    "MunicipalityEntry", ("municipality_id", "name", "province_id")
+)
+AchievementEntry = namedtuple(
+    "AchievementEntry",
+    ("achievement_id", "name", "description", "type", "target_entity_type",
+     "target_entity_id", "target_value", "unlocked_image_url")
+)
+LevelEntry = namedtuple(
+    "LevelEntry", ("level_id", "name", "visits_required", "image_url")
+)
+
+
+class CatalogSnapshot:
+    """Catálogo inmutable con índices por id precalculados."""
+
+    __slots__ = (
+        "version", "sync_version", "loaded_at", "locations", "locations_by_id",
+        "locations_by_municipality", "municipalities", "municipalities_by_id",
+        "achievements", "achievements_by_id", "levels",
+    )
+
+    def __init__(self, locations, municipalities, achievements, levels,
+                 sync_version=0):
+        self.sync_version = sync_version
+        self.locations = tuple(locations)
+        self.municipalities = tuple(municipalities)
+        self.achievements = tuple(achievements)
+        self.levels = tuple(levels)
+        self.loaded_at = time.time()
+
+        by_municipality = {}
+        for loc in self.locations:
+            by_municipality.setdefault(loc.municipality_id, []).append(loc)
+
+        self.locations_by_id = MappingProxyType(
+            {loc.location_id: loc for loc in self.locations}
+        )
+        self.locations_by_municipality = MappingProxyType(
+            {key: tuple(value) for key, value in by_municipality.items()}
+        )
+        self.municipalities_by_id = MappingProxyType(
+            {muni.municipality_id: muni for muni in self.municipalities}
+        )
+        self.achievements_by_id = MappingProxyType(
+            {ach.achievement_id: ach for ach in self.achievements}
+        )
+
+        # Versión derivada del contenido: igual en todos los workers
+        digest = hashlib.blake2b(digest_size=8)
+        for group in (self.locations, self.municipalities,
+                      self.achievements, self.levels):
+            for entry in group:
+                digest.update(repr(entry).encode('utf-8'))
+        self.version = digest.hexdigest()
+
+
+def location_list_payload(entry):
+    """Dict de una ubicación con los campos de GET /locations."""
+    return {field: getattr(entry, field) for field in LOCATION_LIST_ENCODER.fields}
+
+
+# Columnas de la geovalla leídas junto a las del detalle
+_GEOFENCE_COLUMNS = (
+    Location.checkin_radius_meters, Location.geofence_polygon,
+    Location.bbox_min_lat, Location.bbox_min_lng,
+    Location.bbox_max_lat, Location.bbox_max_lng,
+)
+
+
+def _build_location_entry(row):
+    """Construye la entrada inmutable de una ubicación a partir de su fila."""
+    base_size = len(LOCATION_DETAIL_ENCODER.fields)
+    radius, polygon, *bbox = row[base_size:]
+    row = row[:base_size]
+    detail = LOCATION_DETAIL_ENCODER.encode_one(row)
+    list_payload = {key: detail[key] for key in LOCATION_LIST_ENCODER.fields}
+    search_text = f"{detail['name'] or ''}\n{detail['description'] or ''}".casefold()
+    return LocationEntry(
+        *row,
+        checkin_radius_meters=radius,
+        geofence_polygon=polygon,
+        geofence_bbox=tuple(bbox) if polygon else None,
+        search_text=search_text,
+        list_json=dumps(list_payload),
+        detail_json=dumps(detail),
+        detail_locked_json=dumps({**detail, "unlocked_content_url": None}),
+    )
+
+
+def load_catalog_snapshot(db_session):
+    """
+    Lee el catálogo completo de la base de datos.
+
+    Args:
+        db_session: Sesión de SQLAlchemy activa
+
+    Returns:
+        CatalogSnapshot: Instantánea inmutable del catálogo
+    """
+    location_rows = db_session.query(
+        *LOCATION_DETAIL_ENCODER.columns, *_GEOFENCE_COLUMNS
+    ).join(
+        Municipality, Location.municipality_id == Municipality.municipality_id
+    ).order_by(Location.name).all()
+
+    municipalities = [
+        MunicipalityEntry(*row) for row in db_session.query(
+            Municipality.municipality_id, Municipality.name, Municipality.province_id
+        ).order_by(Municipality.municipality_id)
+    ]
+    achievements = [
+        AchievementEntry(*row) for row in db_session.query(
+            Achievement.achievement_id, Achievement.name, Achievement.description,
+            Achievement.type, Achievement.target_entity_type,
+            Achievement.target_entity_id, Achievement.target_value,
+            Achievement.unlocked_image_url
+        ).order_by(Achievement.achievement_id)
+    ]
+    levels = [
+        LevelEntry(*row) for row in db_session.query(
+            Level.level_id, Level.name, Level.visits_required, Level.image_url
+        ).order_by(Level.visits_required)
+    ]
+
+    return CatalogSnapshot(
+        [_build_location_entry(row) for row in location_rows],
+        municipalities, achievements, levels,
+        sync_version=_current_sync_version(db_session),
+    )
+
+
+def _current_sync_version(db_session):
+    return db_session.query(func.max(SyncCounter.version)).scalar() or 0
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_next_version_check = 0.0
+_version_check_lock = threading.Lock()
+
+
+def reload_catalog():
+    """Vuelve a leer el catálogo y sustituye la instantánea activa."""
+    global _snapshot
+    start = time.perf_counter()
+    db = ReadSessionLocal()
+    try:
+        snapshot = load_catalog_snapshot(db)
+    finally:
+        db.close()
+    _snapshot = snapshot
+    logger.info(
+        f"Catálogo cargado: {len(snapshot.locations)} ubicaciones, "
+        f"{len(snapshot.municipalities)} municipios, "
+        f"{len(snapshot.achievements)} logros, {len(snapshot.levels)} niveles "
+        f"en {(time.perf_counter() - start) * 1000:.1f}ms "
+        f"(versión {snapshot.version})"
+    )
+    return snapshot
+
+
+def reload_catalog_data():
+    """Recarga catálogo y geografía (callback de la invalidación de 'catalog')."""
+    from geography import reload_geography
+
+    reload_catalog()
+    reload_geography()
+
+
+def _check_catalog_version(snapshot):
+    """Invalida 'catalog' en este proceso si sync_counter avanzó."""
+    global _next_version_check
+    # Un solo hilo comprueba; el resto sigue sirviendo la instantánea actual
+    if not _version_check_lock.acquire(blocking=False):
+        return
+    try:
+        if time.monotonic() < _next_version_check:
+            return
+        _next_version_check = time.monotonic() + CATALOG_VERSION_CHECK_SECONDS
+        db = ReadSessionLocal()
+        try:
+            current = _current_sync_version(db)
+        except Exception as e:
+            logger.warning(f"No se pudo comprobar la versión del catálogo: {e}")
+            return
+        finally:
+            db.close()
+        if current != snapshot.sync_version:
+            logger.info(
+                f"Catálogo modificado (versión de sincronización "
+                f"{snapshot.sync_version} -> {current}), recargando"
+            )
+            get_cache().invalidate_local("catalog")
+    finally:
+        _version_check_lock.release()
+
+
+def get_catalog():
+    """Devuelve la instantánea activa, cargándola en el primer uso."""
+    snapshot = _snapshot
+    if snapshot is not None:
+        if (CATALOG_VERSION_CHECK_SECONDS > 0
+                and time.monotonic() >= _next_version_check):
+            _check_catalog_version(snapshot)
+            snapshot = _snapshot
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None:
+            return reload_catalog()
+        return _snapshot
@@ -0,0 +1,344 @@
+# checkin_service.py
+"""
+Lógica de check-in compartida por app.py (Flask) y asgi_app.py (Quart).
+
+No depende del framework web: recibe una sesión síncrona de SQLAlchemy (en
+asgi_app, la de AsyncSession.run_sync) y devuelve la respuesta como
+(diccionario JSON, estado HTTP). Así los dos puntos de entrada aplican los
+mismos límites, geovallas, logros, historial de visitas, invalidación de
+caché, co-visitas y eventos.
+"""
+
+import logging
+import os
+
+from sqlalchemy import distinct, func
+from sqlalchemy.exc import IntegrityError
+
+from achievement_rules import get_achievement_rules
+from auth_tokens import bearer_token, verify_token
+from cache import get_cache
+from catalog import get_catalog
+from covisitation import get_covisitation_index_if_ready
+from event_bus import get_event_bus
+from geofence import get_geofences
+from geography import get_geography
+from models import Location, User, UserAchievement, UserLocationVisit
+from poblacion_db.session_setup import SessionLocal
+from rate_limit import TokenBucketLimiter
+from shared_backend import get_shared_backend
+from visit_history import record_checkin_event
+
+logger = logging.getLogger(__name__)
+
+CHECKIN_RADIUS_METERS = 4000
+
+# Límites de check-in (token bucket): recarga en fichas/segundo y ráfaga máxima.
+# Por IP se permite más porque varios usuarios pueden compartir NAT del operador.
+CHECKIN_USER_RATE = float(os.getenv('CHECKIN_USER_RATE', 0.1))
+CHECKIN_USER_BURST = int(os.getenv('CHECKIN_USER_BURST', 5))
+CHECKIN_IP_RATE = float(os.getenv('CHECKIN_IP_RATE', 1))
+CHECKIN_IP_BURST = int(os.getenv('CHECKIN_IP_BURST', 30))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+# Rechaza los check-ins sin token (ver checkin_rate_key). Desactivado mientras
+# queden clientes anteriores a los tokens
+CHECKIN_REQUIRE_TOKEN = os.getenv('CHECKIN_REQUIRE_TOKEN', '0') == '1'
+
+# Respuesta cuando la transacción choca con otro check-in simultáneo del
+# mismo usuario (restricciones únicas de visitas y logros)
+CHECKIN_CONFLICT_RESPONSE = (
+    {"message": "Check-in simultáneo en curso. Inténtalo de nuevo."}, 409
+)
+
+checkin_user_limiter = TokenBucketLimiter(
+    "checkin:user", CHECKIN_USER_RATE, CHECKIN_USER_BURST,
+    max_keys=RATE_LIMIT_MAX_KEYS, shared_backend=get_shared_backend()
+)
+checkin_ip_limiter = TokenBucketLimiter(
+    "checkin:ip", CHECKIN_IP_RATE, CHECKIN_IP_BURST,
+    max_keys=RATE_LIMIT_MAX_KEYS, shared_backend=get_shared_backend()
+)
+
+
+def validate_coordinates(latitude, longitude):
+    """Valida que las coordenadas estén en rangos válidos."""
+    if not (-90 <= latitude <= 90):
+        raise ValueError("Latitud debe estar entre -90 y 90")
+    if not (-180 <= longitude <= 180):
+        raise ValueError("Longitud debe estar entre -180 y 180")
+    return True
+
+
+def parse_checkin_request(data):
+    """
+    Campos de un POST /checkin.
+
+    Returns:
+        tuple: (user_id, location_id, latitud, longitud)
+
+    Raises:
+        KeyError, ValueError, TypeError: Petición incompleta o inválida
+    """
+    latitude = float(data['latitude'])
+    longitude = float(data['longitude'])
+    user_id = int(data['user_id'])
+    location_id = int(data['location_id'])
+    validate_coordinates(latitude, longitude)
+    return user_id, location_id, latitude, longitude
+
+
+def checkin_rate_key(user_id, remote_addr, authorization_header):
+    """
+    Clave del límite por usuario de un check-in.
+
+    Con token (auth_tokens) la clave es el usuario autenticado, y el user_id
+    del cuerpo debe coincidir. Sin token (clientes anteriores a los tokens)
+    la clave combina IP y user_id: desde otra IP nadie agota el cubo de un
+    usuario enviando su user_id. Pero el user_id del cuerpo no está
+    autenticado, así que quien rote user_id obtiene un cubo nuevo en cada
+    uno: para esos clientes el único límite efectivo es el de la IP
+    (CHECKIN_IP_RATE). Con CHECKIN_REQUIRE_TOKEN=1 se rechazan.
+
+    Returns:
+        tuple: (clave, None), o (None, (respuesta JSON, estado HTTP)) si el
+        token falta (con CHECKIN_REQUIRE_TOKEN) o no es válido
+    """
+    token = bearer_token(authorization_header)
+    if token is None:
+        if CHECKIN_REQUIRE_TOKEN:
+            return None, ({"message": "Se requiere un token (Authorization: Bearer)."}, 401)
+        return f"{remote_addr}:{user_id}", None
+    authenticated_user_id = verify_token(token)
+    if authenticated_user_id is None:
+        return None, ({"message": "Token no válido o caducado."}, 401)
+    if authenticated_user_id != user_id:
+        return None, ({"message": "El token no corresponde a user_id."}, 403)
+    return authenticated_user_id, None
+
+
+def geodesic_meters(coords_a, coords_b):
+    """
+    Distancia geodésica en metros entre dos pares (lat, lng).
+    geopy se importa en el primer uso para no penalizar el arranque.
+    """
+    from geopy.distance import geodesic
+    return geodesic(coords_a, coords_b).meters
+
+
+def evaluate_checkin_geofence(location, latitude, longitude):
+    """
+    Comprueba si un punto está dentro de la geovalla de la ubicación.
+
+    Returns:
+        tuple: (dentro, distancia en metros, texto del requisito)
+    """
+    geofence = get_geofences(get_catalog(), CHECKIN_RADIUS_METERS).get(
+        location.location_id
+    )
+    if geofence is None:
+        # Ubicación aún fuera de la instantánea del catálogo: radio global
+        distance = geodesic_meters(
+            (latitude, longitude), (location.latitude, location.longitude)
+        )
+        return (distance <= CHECKIN_RADIUS_METERS, distance,
+                f"a menos de {CHECKIN_RADIUS_METERS}m")
+    inside, distances = geofence.evaluate(latitude, longitude)
+    return bool(inside[0]), float(distances[0]), geofence.describe()
+
+
+def publish_checkin_events(user_id, location, new_visit_created, user_stats,
+                           newly_unlocked):
+    """Publica en el bus de eventos un check-in ya confirmado y sus logros."""
+    bus = get_event_bus()
+    bus.publish("checkin", user_id, {
+        "location_id": location.location_id,
+        "location_name": location.name,
+        "new_visit_created": new_visit_created,
+        "unique_visits_count": user_stats["unique_visits_count"],
+    })
+    for achievement in newly_unlocked:
+        bus.publish("achievement_unlocked", user_id, achievement)
+
+
+def get_user_stats(db_session, user_id):
+    """
+    Obtiene estadísticas del usuario.
+
+    Returns:
+        dict: Diccionario con unique_visits_count y unique_municipalities_count
+    """
+    unique_visits_count = db_session.query(
+        func.count(distinct(UserLocationVisit.location_id))
+    ).filter(UserLocationVisit.user_id == user_id).scalar() or 0
+
+    unique_municipalities_count = db_session.query(
+        func.count(distinct(Location.municipality_id))
+    ).join(
+        UserLocationVisit, Location.location_id == UserLocationVisit.location_id
+    ).filter(UserLocationVisit.user_id == user_id).scalar() or 0
+
+    return {
+        "unique_visits_count": unique_visits_count,
+        "unique_municipalities_count": unique_municipalities_count
+    }
+
+
+def check_and_award_achievements(db_session, user_id, user_stats):
+    """
+    Verifica y otorga logros al usuario a partir de sus ubicaciones visitadas.
+
+    Evalúa las mismas reglas que el recálculo masivo (AchievementRules).
+
+    Returns:
+        list: Lista de logros recién desbloqueados
+    """
+    earned_achievement_ids = {
+        ua.achievement_id
+        for ua in db_session.query(UserAchievement.achievement_id)
+        .filter_by(user_id=user_id).all()
+    }
+    visited_location_ids = [
+        row[0] for row in db_session.query(UserLocationVisit.location_id)
+        .filter(UserLocationVisit.user_id == user_id).distinct()
+    ]
+    catalog = get_catalog()
+    rules = get_achievement_rules(catalog, get_geography())
+    unlocked = rules.evaluate(
+        [user_id], [user_id] * len(visited_location_ids), visited_location_ids
+    )
+
+    newly_unlocked_achievements = []
+    for _, achievement_id in unlocked:
+        if achievement_id in earned_achievement_ids:
+            continue
+        achievement = catalog.achievements_by_id[achievement_id]
+        db_session.add(UserAchievement(
+            user_id=user_id,
+            achievement_id=achievement_id
+        ))
+        newly_unlocked_achievements.append({
+            "id": achievement.achievement_id,
+            "name": achievement.name,
+            "description": achievement.description
+        })
+
+    return newly_unlocked_achievements
+
+
+def get_checkin_location(location_id):
+    """
+    Ubicación de un check-in, o None si no existe.
+
+    Se toma de la instantánea del catálogo y no de la sesión del check-in:
+    con shards, esa sesión es la del shard del usuario, cuya copia del
+    catálogo puede ir atrasada. Una ubicación recién creada que aún no está
+    en la instantánea se lee de la primaria.
+    """
+    location = get_catalog().locations_by_id.get(location_id)
+    if location is not None:
+        return location
+    db = SessionLocal()
+    try:
+        return db.query(Location).filter(Location.location_id == location_id).first()
+    finally:
+        db.close()
+
+
+def process_checkin(db_session, user_id, location_id, latitude, longitude):
+    """
+    Registra un check-in ya validado y limitado, y confirma la transacción.
+
+    Tras el commit invalida la caché del usuario, actualiza el índice de
+    co-visitas y publica los eventos.
+
+    Returns:
+        tuple: (respuesta JSON, estado HTTP); visit_recorded indica si se
+        escribió en la base de datos
+    """
+    location = get_checkin_location(location_id)
+    if not location:
+        return {"message": f"Ubicación ID {location_id} no encontrada."}, 404
+
+    user = db_session.query(User).filter(User.user_id == user_id).first()
+    if not user:
+        return {"message": f"Usuario ID {user_id} no encontrado."}, 404
+
+    is_inside, distance_in_meters, requirement = evaluate_checkin_geofence(
+        location, latitude, longitude
+    )
+
+    if not is_inside:
+        return {
+            "message": (
+                f"Estás demasiado lejos de {location.name} "
+                f"({distance_in_meters:.0f}m). "
+                f"Debes estar {requirement}."
+            ),
+            "visit_recorded": False,
+            "distancia_metros": round(distance_in_meters, 0)
+        }, 200
+
+    # Verificar si ya existe la visita
+    existing_visit = db_session.query(UserLocationVisit).filter_by(
+        user_id=user_id,
+        location_id=location_id
+    ).first()
+
+    new_visit_created = False
+    previous_location_ids = []
+    if not existing_visit:
+        previous_location_ids = [
+            visited_id for (visited_id,) in db_session.query(
+                UserLocationVisit.location_id
+            ).filter(UserLocationVisit.user_id == user_id)
+        ]
+        new_visit = UserLocationVisit(
+            user_id=user_id,
+            location_id=location_id
+        )
+        db_session.add(new_visit)
+        try:
+            db_session.flush()  # Flush para que la visita esté disponible para queries
+        except IntegrityError:
+            # Otro check-in simultáneo del mismo usuario creó la visita
+            db_session.rollback()
+            return CHECKIN_CONFLICT_RESPONSE
+        new_visit_created = True
+        logger.info(
+            f"Usuario {user_id} realizó check-in en ubicación {location_id}"
+        )
+
+    # Recalcular estadísticas después del flush
+    user_stats = get_user_stats(db_session, user_id)
+    newly_unlocked = check_and_award_achievements(db_session, user_id, user_stats)
+
+    try:
+        record_checkin_event(
+            db_session, user_id, location_id, latitude, longitude,
+            distance_in_meters, new_visit_created
+        )
+        db_session.commit()
+    except IntegrityError:
+        db_session.rollback()
+        return CHECKIN_CONFLICT_RESPONSE
+    except Exception as e:
+        db_session.rollback()
+        logger.error(f"Error al guardar check-in: {e}")
+        return {"message": "Error interno al guardar el check-in."}, 500
+
+    if new_visit_created or newly_unlocked:
+        get_cache().invalidate(f"user:{user_id}")
+    covisitation_index = get_covisitation_index_if_ready()
+    if new_visit_created and covisitation_index is not None:
+        covisitation_index.record_visit(location_id, previous_location_ids)
+    publish_checkin_events(
+        user_id, location, new_visit_created, user_stats, newly_unlocked
+    )
+    return {
+        "message": f"¡Check-in en {location.name} procesado!",
+        "visit_recorded": True,
+        "new_visit_created": new_visit_created,
+        "unlocked_content_url": location.unlocked_content_url,
+        "unlocked_achievements": newly_unlocked,
+        "distancia_metros": round(distance_in_meters, 0)
+    }, 200
@@ -0,0 +1,504 @@
+# covisitation.py
+"""
+Recomendaciones "quien visitó X también visitó Y".
+
+Un trabajo offline recorre user_location_visits y construye la matriz de
+co-visitas como arrays CSR (indptr, indices, data) de numpy, junto con el
+número de visitantes de cada ubicación. De ella se precalculan los K vecinos
+más similares de cada ubicación (similitud coseno sobre visitantes), que las
+rutas consultan en memoria.
+
+Las visitas nuevas se acumulan en un delta incremental y solo se recalculan
+los vecinos de las filas afectadas. El delta es del worker que atendió el
+check-in y no se guarda: cada COVISITATION_REFRESH_SECONDS se reconstruye el
+índice desde la base de datos, que tiene las visitas de todos los workers, y
+se guarda en COVISITATION_INDEX_PATH. Con backend compartido solo un worker
+reconstruye en cada intervalo y los demás cargan su fichero en el ciclo
+siguiente; sin él, cada worker reconstruye el suyo. La reconstrucción manual
+(python covisitation.py) hace lo mismo una vez.
+
+Uso del trabajo offline:
+    python covisitation.py [ruta_salida.npz]
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+COVISITATION_INDEX_PATH = os.getenv('COVISITATION_INDEX_PATH', 'covisitation_index.npz')
+COVISITATION_TOP_K = int(os.getenv('COVISITATION_TOP_K', 20))
+# Cada cuánto se reconstruye el índice desde la base de datos (0 desactiva)
+COVISITATION_REFRESH_SECONDS = int(os.getenv('COVISITATION_REFRESH_SECONDS', 3600))
+COVISITATION_REBUILD_KEY = "covisitation_rebuild"
+# Tope de visitas por usuario en la construcción (los pares crecen con v²)
+MAX_VISITS_PER_USER = 500
+# Pares acumulados antes de compactar durante la construcción
+_COMPACT_EVERY = 1_000_000
+
+
+def _compact(codes, counts):
+    """Agrupa códigos de par repetidos sumando sus cuentas."""
+    if not len(codes):
+        return codes, counts
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    counts = counts[order]
+    unique_codes, starts = np.unique(codes, return_index=True)
+    return unique_codes, np.add.reduceat(counts, starts)
+
+
+def _merge_pending(codes, counts, pending):
+    """Incorpora los pares pendientes (peso 1) a los ya compactados."""
+    if not pending:
+        return codes, counts
+    return _compact(
+        np.concatenate([codes] + pending),
+        np.concatenate([counts] + [np.ones(len(p), dtype=np.int64) for p in pending])
+    )
+
+
+class CovisitationIndex:
+    """Matriz de co-visitas en CSR con vecinos top-K precalculados."""
+
+    def __init__(self, location_ids, indptr, indices, data, visitor_counts,
+                 top_k=COVISITATION_TOP_K):
+        """
+        Args:
+            location_ids: id de ubicación de cada fila
+            indptr, indices, data: Matriz CSR de co-visitas entre filas
+            visitor_counts: Visitantes únicos por fila
+            top_k: Vecinos a conservar por ubicación
+        """
+        self.location_ids = [int(x) for x in location_ids]
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.int32)
+        self.visitor_counts = np.asarray(visitor_counts, dtype=np.int64)
+        self.top_k = top_k
+        self.built_at = time.time()
+
+        self._row_by_id = {
+            location_id: row for row, location_id in enumerate(self.location_ids)
+        }
+        self._base_rows = len(self.location_ids)
+        self._delta = defaultdict(Counter)   # fila -> Counter(fila vecina -> co-visitas)
+        self._visitor_delta = Counter()      # fila -> visitantes nuevos
+        self._lock = threading.Lock()
+        self._neighbours = {}
+        for row in range(self._base_rows):
+            self._neighbours[self.location_ids[row]] = self._compute_neighbours(row)
+
+    # Construcción y persistencia
+
+    @classmethod
+    def from_visits(cls, visits, location_ids=(), top_k=COVISITATION_TOP_K):
+        """
+        Construye el índice desde pares (user_id, location_id) ordenados por usuario.
+
+        Args:
+            visits: Iterable de (user_id, location_id) ordenado por user_id
+            location_ids: Ubicaciones del catálogo (para incluir las no visitadas)
+        """
+        row_by_id = {}
+
+        def row_for(location_id):
+            row = row_by_id.get(location_id)
+            if row is None:
+                row = row_by_id[location_id] = len(row_by_id)
+            return row
+
+        for location_id in sorted(location_ids):
+            row_for(location_id)
+
+        pending = []
+        pending_size = 0
+        codes = np.empty(0, dtype=np.int64)
+        counts = np.empty(0, dtype=np.int64)
+        visitor_counts = Counter()
+
+        def flush_user(rows):
+            nonlocal pending_size
+            if not rows:
+                return
+            rows = np.fromiter(sorted(rows)[:MAX_VISITS_PER_USER], dtype=np.int64)
+            visitor_counts.update(rows.tolist())
+            if len(rows) > 1:
+                a, b = np.meshgrid(rows, rows, indexing="ij")
+                mask = a != b
+                # Código de par: fila * 2^32 + vecina
+                pending.append((a[mask] << 32) | b[mask])
+                pending_size += int(mask.sum())
+
+        current_user = None
+        current_rows = set()
+        for user_id, location_id in visits:
+            if user_id != current_user:
+                flush_user(current_rows)
+                current_user, current_rows = user_id, set()
+            current_rows.add(row_for(location_id))
+            if pending_size >= _COMPACT_EVERY:
+                codes, counts = _merge_pending(codes, counts, pending)
+                pending, pending_size = [], 0
+        flush_user(current_rows)
+        codes, counts = _merge_pending(codes, counts, pending)
+
+        num_rows = len(row_by_id)
+        rows = codes >> 32
+        indices = codes & 0xFFFFFFFF
+        indptr = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+        ids_by_row = sorted(row_by_id, key=row_by_id.get)
+        visitors = np.array(
+            [visitor_counts.get(row, 0) for row in range(num_rows)], dtype=np.int64
+        )
+        return cls(ids_by_row, indptr, indices, counts, visitors, top_k=top_k)
+
+    def save(self, path):
+        """
+        Guarda la CSR (sin el delta incremental) en un .npz comprimido.
+
+        Se escribe en un fichero temporal y se renombra, para que otro
+        proceso nunca cargue un fichero a medio escribir.
+        """
+        temporary_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            temporary_path,
+            location_ids=np.array(self.location_ids, dtype=np.int64),
+            indptr=self.indptr, indices=self.indices, data=self.data,
+            visitor_counts=self.visitor_counts,
+        )
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path, top_k=COVISITATION_TOP_K):
+        """Carga un índice guardado con save()."""
+        with np.load(path) as arrays:
+            return cls(
+                arrays["location_ids"], arrays["indptr"], arrays["indices"],
+                arrays["data"], arrays["visitor_counts"], top_k=top_k
+            )
+
+    # Consultas
+
+    def _visitors(self, row):
+        base = int(self.visitor_counts[row]) if row < self._base_rows else 0
+        return base + self._visitor_delta.get(row, 0)
+
+    def _compute_neighbours(self, row):
+        """Top-K vecinos de una fila combinando CSR base y delta."""
+        counts = Counter()
+        if row < self._base_rows:
+            start, end = self.indptr[row], self.indptr[row + 1]
+            counts.update(dict(zip(
+                self.indices[start:end].tolist(), self.data[start:end].tolist()
+            )))
+        delta = self._delta.get(row)
+        if delta:
+            counts.update(delta)
+        if not counts:
+            return ()
+
+        own = self._visitors(row) or 1
+        neighbour_rows = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        co_counts = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        visitors = np.array([self._visitors(r) or 1 for r in neighbour_rows.tolist()],
+                            dtype=np.float64)
+        scores = co_counts / np.sqrt(own * visitors)
+
+        k = min(self.top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return tuple(
+            (self.location_ids[int(neighbour_rows[i])], float(scores[i]), int(co_counts[i]))
+            for i in best
+        )
+
+    def similar(self, location_id, limit=10):
+        """
+        Ubicaciones más visitadas por quienes visitaron location_id.
+
+        Returns:
+            tuple: (location_id, puntuación, co-visitantes) ordenadas por puntuación
+        """
+        return self._neighbours.get(location_id, ())[:limit]
+
+    def recommend(self, visited_ids, limit=10):
+        """
+        Recomendaciones personalizadas: suma de similitudes con lo ya visitado.
+        Sin historial, devuelve las ubicaciones con más visitantes.
+
+        Returns:
+            list: (location_id, puntuación) ordenadas por puntuación
+        """
+        visited_ids = set(visited_ids)
+        scores = Counter()
+        # record_visit modifica vecinos, filas y visitantes bajo el bloqueo
+        with self._lock:
+            for visited_id in visited_ids:
+                for neighbour_id, score, _ in self._neighbours.get(visited_id, ()):
+                    if neighbour_id not in visited_ids:
+                        scores[neighbour_id] += score
+            if not scores:
+                popular = sorted(
+                    ((self._visitors(row), location_id)
+                     for location_id, row in self._row_by_id.items()
+                     if location_id not in visited_ids),
+                    reverse=True
+                )
+        if scores:
+            return scores.most_common(limit)
+
+        return [(location_id, float(count)) for count, location_id in popular[:limit]
+                if count > 0]
+
+    # Actualización incremental
+
+    def record_visit(self, location_id, previous_location_ids):
+        """
+        Incorpora la primera visita de un usuario a location_id.
+
+        Args:
+            location_id: Ubicación recién visitada
+            previous_location_ids: Ubicaciones que el usuario ya había visitado
+        """
+        with self._lock:
+            row = self._row_by_id.get(location_id)
+            if row is None:
+                row = self._row_by_id[location_id] = len(self.location_ids)
+                self.location_ids.append(location_id)
+            self._visitor_delta[row] += 1
+
+            touched = [location_id]
+            for previous_id in previous_location_ids:
+                previous_row = self._row_by_id.get(previous_id)
+                if previous_row is None or previous_row == row:
+                    continue
+                self._delta[row][previous_row] += 1
+                self._delta[previous_row][row] += 1
+                touched.append(previous_id)
+
+            for touched_id in touched:
+                self._neighbours[touched_id] = self._compute_neighbours(
+                    self._row_by_id[touched_id]
+                )
+
+
+def _iter_user_visits(db_session):
+    """Pares (user_id, location_id) de una base de datos, ordenados por usuario."""
+    from models import UserLocationVisit
+
+    visits = db_session.query(
+        UserLocationVisit.user_id, UserLocationVisit.location_id
+    ).order_by(UserLocationVisit.user_id).yield_per(10000)
+    for user_id, location_id in visits:
+        yield user_id, location_id
+
+
+def _iter_sharded_visits(router):
+    """Visitas de todos los shards, uno tras otro (cada usuario está en uno solo)."""
+    for shard in router.shards:
+        session = shard.ReadSessionLocal()
+        try:
+            yield from _iter_user_visits(session)
+        finally:
+            session.close()
+
+
+def build_covisitation_index(db_session, top_k=COVISITATION_TOP_K):
+    """
+    Construye el índice completo desde la base de datos.
+
+    Args:
+        db_session: Sesión de SQLAlchemy activa (preferiblemente de lectura);
+            con shards, solo se usa para el catálogo
+    """
+    from models import Location
+    from sharding import get_shard_router
+
+    start = time.perf_counter()
+    location_ids = [row[0] for row in db_session.query(Location.location_id)]
+    router = get_shard_router()
+    visits = _iter_sharded_visits(router) if router.sharded else _iter_user_visits(db_session)
+    index = CovisitationIndex.from_visits(visits, location_ids, top_k=top_k)
+    logger.info(
+        f"Índice de co-visitas construido: {len(index.location_ids)} ubicaciones, "
+        f"{len(index.data)} pares en {time.perf_counter() - start:.2f}s"
+    )
+    return index
+
+
+_index = None
+# mtime del fichero del que se cargó o en el que se guardó el índice activo
+_index_file_mtime = None
+_index_lock = threading.Lock()
+_build_thread = None
+_timer = None
+
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _build_from_database():
+    from poblacion_db.session_setup import ReadSessionLocal
+    db = ReadSessionLocal()
+    try:
+        return build_covisitation_index(db)
+    finally:
+        db.close()
+
+
+def _load_or_build_index():
+    global _index_file_mtime
+    mtime = _file_mtime(COVISITATION_INDEX_PATH)
+    if mtime is not None:
+        index = CovisitationIndex.load(COVISITATION_INDEX_PATH)
+        _index_file_mtime = mtime
+        logger.info(f"Índice de co-visitas cargado de {COVISITATION_INDEX_PATH}")
+        return index
+    return _build_from_database()
+
+
+def _acquire_rebuild():
+    """Reserva la reconstrucción de este intervalo (siempre, sin backend compartido)."""
+    from shared_backend import get_shared_backend
+
+    backend = get_shared_backend()
+    if backend is None:
+        return True
+    try:
+        return bool(backend.set(COVISITATION_REBUILD_KEY, b"1", nx=True,
+                                ex=max(1, int(COVISITATION_REFRESH_SECONDS * 0.9))))
+    except Exception as e:
+        logger.warning(f"Backend compartido no disponible para las co-visitas: {e}")
+        return True
+
+
+def refresh_covisitation_index():
+    """
+    Sustituye el índice activo por uno con las visitas de todos los workers.
+
+    Si este proceso reserva la reconstrucción, lee la base de datos y guarda
+    el resultado; si no, carga el fichero cuando otro proceso lo ha renovado.
+    El delta del índice anterior se descarta: sus visitas ya están en la base
+    de datos.
+
+    Returns:
+        bool: True si se sustituyó el índice
+    """
+    global _index, _index_file_mtime
+    if _acquire_rebuild():
+        index = _build_from_database()
+        index.save(COVISITATION_INDEX_PATH)
+        mtime = _file_mtime(COVISITATION_INDEX_PATH)
+    else:
+        mtime = _file_mtime(COVISITATION_INDEX_PATH)
+        if mtime is None or mtime == _index_file_mtime:
+            return False
+        index = CovisitationIndex.load(COVISITATION_INDEX_PATH)
+        logger.info(f"Índice de co-visitas recargado de {COVISITATION_INDEX_PATH}")
+    with _index_lock:
+        _index, _index_file_mtime = index, mtime
+    return True
+
+
+def _refresh_periodically():
+    """Hilo del worker que renueva el índice cada COVISITATION_REFRESH_SECONDS."""
+    while True:
+        time.sleep(COVISITATION_REFRESH_SECONDS)
+        try:
+            refresh_covisitation_index()
+        except Exception as e:
+            logger.error(f"No se pudo renovar el índice de co-visitas: {e}")
+
+
+def _start_refresh_timer():
+    """Arranca la renovación periódica (una vez por proceso, tras el fork)."""
+    global _timer
+    if COVISITATION_REFRESH_SECONDS <= 0 or (_timer is not None and _timer.is_alive()):
+        return
+    with _index_lock:
+        # Tras el fork el hilo del maestro no existe en el worker
+        if _timer is not None and _timer.is_alive():
+            return
+        _timer = threading.Thread(
+            target=_refresh_periodically, name="covisitation-timer", daemon=True
+        )
+        _timer.start()
+
+
+def get_covisitation_index(refresh=True):
+    """
+    Devuelve el índice activo. En el primer uso lo carga de
+    COVISITATION_INDEX_PATH o, si no existe, lo construye desde la base de datos.
+    gunicorn.conf.py lo precarga en el maestro antes del fork.
+
+    Args:
+        refresh: Arranca la renovación periódica del proceso (el maestro de
+            gunicorn no la necesita)
+    """
+    global _index
+    if refresh:
+        _start_refresh_timer()
+    if _index is not None:
+        return _index
+    with _index_lock:
+        if _index is None:
+            _index = _load_or_build_index()
+        return _index
+
+
+def get_covisitation_index_if_ready():
+    """
+    Índice activo o None si aún no está cargado, sin bloquear.
+
+    Para el check-in: la primera petición de un worker no debe pagar la
+    construcción del índice. Si no está listo, lo carga en un hilo aparte;
+    las visitas de mientras no se suman de forma incremental (la
+    construcción lee de la base de datos las que ya estén confirmadas).
+    """
+    global _build_thread
+    _start_refresh_timer()
+    if _index is not None:
+        return _index
+    with _index_lock:
+        # Tras el fork el hilo del maestro no existe en el worker
+        if _index is None and (_build_thread is None or not _build_thread.is_alive()):
+            _build_thread = threading.Thread(
+                target=_build_in_background, name="covisitation-build", daemon=True
+            )
+            _build_thread.start()
+    return _index
+
+
+def _build_in_background():
+    try:
+        get_covisitation_index()
+    except Exception as e:
+        logger.error(f"No se pudo construir el índice de co-visitas: {e}")
+
+
+if __name__ == "__main__":
+    import sys
+    from poblacion_db.session_setup import ReadSessionLocal
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    output_path = sys.argv[1] if len(sys.argv) > 1 else COVISITATION_INDEX_PATH
+    session = ReadSessionLocal()
+    try:
+        build_covisitation_index(session).save(output_path)
+        logger.info(f"Índice guardado en {output_path}")
+    finally:
+        session.close()
@@ -0,0 +1,254 @@
+# event_bus.py
+"""
+Bus de eventos en vivo (check-ins y logros desbloqueados) para clientes SSE.
+
+checkin_location_route publica tras el commit y GET /events reparte los
+eventos a las conexiones suscritas, de modo que los clientes dejan de
+sondear /users/<id>/visits y /users/<id>/achievements.
+
+Por defecto el bus vive en el proceso. Si SHARED_BACKEND_URL está definido
+los eventos se publican en el canal EVENT_BUS_CHANNEL del backend compartido
+y un hilo por worker los reenvía a sus suscriptores locales, así un cliente
+conectado a cualquier worker recibe los eventos de todos.
+
+Cada suscripción tiene un buffer acotado (EVENT_BUFFER_SIZE). Si el cliente
+no consume a tiempo se descartan los eventos más antiguos y se le avisa con
+un evento "dropped" para que recargue su estado con las rutas normales; el
+publicador nunca se bloquea por un cliente lento.
+
+Una suscripción se consume con get() desde un hilo (app.py, que ocupa un
+hilo del worker por conexión) o con get_async() desde un bucle asyncio
+(asgi_app.py, sin hilos). Cada punto de entrada pasa a subscribe() su propio
+límite de conexiones por proceso.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from shared_backend import get_shared_backend
+
+logger = logging.getLogger(__name__)
+
+EVENT_BUS_CHANNEL = os.getenv('EVENT_BUS_CHANNEL', 'tnf:events')
+EVENT_BUFFER_SIZE = int(os.getenv('EVENT_BUFFER_SIZE', 256))
+
+
+class Subscription:
+    """Cola acotada de eventos de una conexión, filtrada por usuario."""
+
+    def __init__(self, bus, user_ids=None, max_buffer=EVENT_BUFFER_SIZE):
+        """
+        Args:
+            bus: EventBus al que pertenece
+            user_ids: Usuarios a seguir, o None para recibir todos los eventos
+            max_buffer: Eventos pendientes antes de descartar los más antiguos
+        """
+        self._bus = bus
+        self.user_ids = frozenset(user_ids) if user_ids is not None else None
+        self._buffer = deque(maxlen=max_buffer)
+        self._condition = threading.Condition()
+        # Bucle y evento asyncio de get_async (se fijan en la primera llamada)
+        self._loop = None
+        self._ready = None
+        self.dropped = 0
+        self.closed = False
+
+    def wants(self, event):
+        return self.user_ids is None or event["user_id"] in self.user_ids
+
+    def _offer(self, event):
+        """Encola sin bloquear; con el buffer lleno se pierde el más antiguo."""
+        with self._condition:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(event)
+            self._condition.notify()
+            loop = self._loop
+        if loop is not None:
+            self._wake_async(loop)
+
+    def _wake_async(self, loop):
+        try:
+            loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:  # bucle ya cerrado
+            pass
+
+    def _pop(self):
+        """Siguiente evento y descartados (con la condición tomada)."""
+        dropped, self.dropped = self.dropped, 0
+        event = self._buffer.popleft() if self._buffer else None
+        return event, dropped
+
+    def get(self, timeout=None):
+        """
+        Espera el siguiente evento.
+
+        Returns:
+            tuple: (evento o None si vence el timeout, eventos descartados desde
+            la última llamada)
+        """
+        with self._condition:
+            if not self._buffer and not self.closed:
+                self._condition.wait(timeout)
+            return self._pop()
+
+    async def get_async(self, timeout=None):
+        """Como get(), pero espera en el bucle asyncio sin ocupar un hilo."""
+        with self._condition:
+            if self._loop is None:
+                self._loop = asyncio.get_running_loop()
+                self._ready = asyncio.Event()
+            if self._buffer or self.closed:
+                return self._pop()
+            # Se limpia con la condición tomada: un _offer posterior lo vuelve a fijar
+            self._ready.clear()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._condition:
+            return self._pop()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+            loop = self._loop
+        if loop is not None:
+            self._wake_async(loop)
+        self._bus._unsubscribe(self)
+
+
+class EventBus:
+    """Bus publicación/suscripción con backend compartido opcional."""
+
+    def __init__(self, shared_backend=None, channel=EVENT_BUS_CHANNEL):
+        self._shared_backend = shared_backend
+        self._channel = channel
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._listener = None
+        self.published = 0
+        self.delivered = 0
+
+    def publish(self, event_type, user_id, data):
+        """
+        Publica un evento. Nunca lanza: un fallo del bus no debe afectar a
+        la petición que lo origina.
+        """
+        event = {
+            "type": event_type,
+            "user_id": user_id,
+            "timestamp": time.time(),
+            "data": data,
+        }
+        try:
+            if self._shared_backend is not None:
+                self._shared_backend.publish(self._channel, json.dumps(event))
+            else:
+                self._dispatch(event)
+            self.published += 1
+        except Exception as e:
+            logger.error(f"Error al publicar evento {event_type}: {e}")
+
+    def _dispatch(self, event):
+        """Entrega un evento a las suscripciones locales interesadas."""
+        event["id"] = next(self._ids)
+        with self._lock:
+            subscriptions = tuple(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.wants(event):
+                subscription._offer(event)
+                self.delivered += 1
+
+    def subscribe(self, user_ids=None, max_buffer=EVENT_BUFFER_SIZE,
+                  max_subscribers=None):
+        """
+        Abre una suscripción.
+
+        Args:
+            max_subscribers: Suscripciones abiertas como máximo en el proceso
+                (None: sin límite)
+
+        Returns:
+            Subscription, o None si se alcanzó el máximo de suscriptores.
+        """
+        with self._lock:
+            if max_subscribers is not None and len(self._subscriptions) >= max_subscribers:
+                return None
+            subscription = Subscription(self, user_ids, max_buffer)
+            self._subscriptions.add(subscription)
+        if self._shared_backend is not None:
+            self._ensure_listener()
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscriptions)
+
+    def _ensure_listener(self):
+        """Arranca (una vez por proceso) el hilo que lee del backend compartido."""
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(
+                target=self._listen, name="event-bus-listener", daemon=True
+            )
+            self._listener.start()
+
+    def _listen(self):
+        pubsub = self._shared_backend.pubsub()
+        pubsub.subscribe(self._channel)
+        logger.info(f"Bus de eventos suscrito al canal {self._channel}")
+        try:
+            while True:
+                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                try:
+                    self._dispatch(json.loads(message["data"]))
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Evento inválido en el bus: {e}")
+        except Exception as e:
+            logger.error(f"Hilo del bus de eventos detenido: {e}")
+        finally:
+            pubsub.close()
+
+
+def format_sse(event=None, event_type=None, data=None, event_id=None):
+    """Formatea un mensaje Server-Sent Events (bytes)."""
+    if event is not None:
+        event_type, data, event_id = event["type"], event, event.get("id")
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event_type is not None:
+        lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return ("\n".join(lines) + "\n\n").encode('utf-8')
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_event_bus():
+    """Devuelve el bus del proceso, usando el backend compartido si existe."""
+    global _bus
+    if _bus is not None:
+        return _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = EventBus(get_shared_backend())
+        return _bus
@@ -0,0 +1,251 @@
+# geofence.py
+"""
+Geovallas de check-in por ubicación: radio propio o polígono.
+
+Cada ubicación usa su checkin_radius_meters (o el radio global si es nulo)
+y, si tiene geofence_polygon, el polígono sustituye al círculo. Los polígonos
+se simplifican con Douglas-Peucker (GEOFENCE_SIMPLIFY_METERS) y se proyectan
+a metros en un plano local una sola vez por versión del catálogo; la prueba
+punto-en-polígono (ray casting) y la distancia al borde se evalúan con numpy
+sobre todas las aristas a la vez, así que un límite de parque nacional con
+miles de vértices se valida en microsegundos.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+
+from route_planner import EARTH_RADIUS_METERS
+
+logger = logging.getLogger(__name__)
+
+GEOFENCE_SIMPLIFY_METERS = float(os.getenv('GEOFENCE_SIMPLIFY_METERS', 10))
+# Tolerancia al error del GPS junto al borde de un polígono
+GEOFENCE_POLYGON_BUFFER_METERS = float(os.getenv('GEOFENCE_POLYGON_BUFFER_METERS', 25))
+
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_METERS / 180
+
+
+def _haversine_meters(lat_a, lng_a, lat_b, lng_b):
+    """Distancia haversine en metros (escalares o arrays de grados)."""
+    lat_a, lng_a, lat_b, lng_b = (
+        np.radians(value) for value in (lat_a, lng_a, lat_b, lng_b)
+    )
+    h = (np.sin((lat_b - lat_a) / 2) ** 2
+         + np.cos(lat_a) * np.cos(lat_b) * np.sin((lng_b - lng_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def douglas_peucker(x, y, tolerance):
+    """
+    Simplifica una polilínea conservando los vértices a más de tolerance.
+
+    Args:
+        x, y: Arrays de coordenadas planas (metros)
+        tolerance: Desviación máxima permitida
+
+    Returns:
+        np.ndarray: Índices de los vértices conservados, ordenados
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            # Extremos coincidentes (anillo cerrado): distancia al punto
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(px * dy - py * dx) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+class PolygonFence:
+    """Polígono simplificado en coordenadas planas locales (metros)."""
+
+    __slots__ = ("origin_lat", "origin_lng", "scale_x", "x", "y",
+                 "bbox", "vertex_count", "original_vertex_count")
+
+    def __init__(self, vertices, bbox=None, simplify_meters=GEOFENCE_SIMPLIFY_METERS):
+        """
+        Args:
+            vertices: Lista [[lat, lng], ...] (cerrada o no)
+            bbox: (min_lat, min_lng, max_lat, max_lng) precalculado, si existe
+        """
+        vertices = np.asarray(vertices, dtype=np.float64)
+        if len(vertices) < 3:
+            raise ValueError("Un polígono necesita al menos 3 vértices")
+        if not np.array_equal(vertices[0], vertices[-1]):
+            vertices = np.vstack([vertices, vertices[:1]])
+
+        self.original_vertex_count = len(vertices) - 1
+        self.origin_lat = float(vertices[:, 0].mean())
+        self.origin_lng = float(vertices[:, 1].mean())
+        self.scale_x = METERS_PER_DEGREE * math.cos(math.radians(self.origin_lat))
+        x, y = self._project(vertices[:, 0], vertices[:, 1])
+
+        kept = douglas_peucker(x, y, simplify_meters)
+        if len(kept) >= 4:  # anillo cerrado de al menos un triángulo
+            x, y = x[kept], y[kept]
+        self.x, self.y = x, y
+        self.vertex_count = len(x) - 1
+        if bbox is None or None in bbox:
+            bbox = (vertices[:, 0].min(), vertices[:, 1].min(),
+                    vertices[:, 0].max(), vertices[:, 1].max())
+        self.bbox = tuple(float(value) for value in bbox)
+
+    def _project(self, latitudes, longitudes):
+        return ((np.asarray(longitudes) - self.origin_lng) * self.scale_x,
+                (np.asarray(latitudes) - self.origin_lat) * METERS_PER_DEGREE)
+
+    def in_bbox(self, latitudes, longitudes, margin_meters=0.0):
+        """Descarte rápido por recuadro (con margen en metros)."""
+        margin_lat = margin_meters / METERS_PER_DEGREE
+        margin_lng = margin_meters / self.scale_x
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        return ((latitudes >= min_lat - margin_lat) & (latitudes <= max_lat + margin_lat)
+                & (longitudes >= min_lng - margin_lng) & (longitudes <= max_lng + margin_lng))
+
+    def contains(self, latitudes, longitudes):
+        """Ray casting vectorizado: array booleano por punto."""
+        px, py = self._project(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        px, py = px[:, None], py[:, None]
+        x0, y0, x1, y1 = self.x[:-1], self.y[:-1], self.x[1:], self.y[1:]
+        crosses = (y0 > py) != (y1 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            intersect_x = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        return np.count_nonzero(crosses & (px < intersect_x), axis=1) % 2 == 1
+
+    def distance_to_edge(self, latitudes, longitudes):
+        """Distancia en metros de cada punto al borde del polígono."""
+        px, py = self._project(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        px, py = px[:, None], py[:, None]
+        x0, y0 = self.x[:-1], self.y[:-1]
+        dx, dy = self.x[1:] - x0, self.y[1:] - y0
+        length_sq = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(length_sq > 0, ((px - x0) * dx + (py - y0) * dy) / length_sq, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        return np.hypot(px - (x0 + t * dx), py - (y0 + t * dy)).min(axis=1)
+
+
+class Geofence:
+    """Geovalla de una ubicación: círculo o polígono."""
+
+    __slots__ = ("location_id", "latitude", "longitude", "radius_meters",
+                 "polygon", "search_radius_meters")
+
+    def __init__(self, entry, default_radius_meters):
+        self.location_id = entry.location_id
+        self.latitude = entry.latitude
+        self.longitude = entry.longitude
+        self.radius_meters = float(entry.checkin_radius_meters or default_radius_meters)
+        self.polygon = None
+        self.search_radius_meters = self.radius_meters
+        if entry.geofence_polygon:
+            try:
+                vertices = json.loads(entry.geofence_polygon)
+                self.polygon = PolygonFence(vertices, entry.geofence_bbox)
+            except (ValueError, TypeError, IndexError) as e:
+                logger.warning(
+                    f"Polígono no válido en ubicación {entry.location_id}, "
+                    f"se usa el radio: {e}"
+                )
+            else:
+                # Círculo que contiene todo el polígono (para el índice de trazas)
+                vertices = np.asarray(vertices, dtype=np.float64)
+                self.search_radius_meters = float(_haversine_meters(
+                    self.latitude, self.longitude, vertices[:, 0], vertices[:, 1]
+                ).max()) + GEOFENCE_POLYGON_BUFFER_METERS
+
+    def evaluate(self, latitudes, longitudes):
+        """
+        Evalúa puntos contra la geovalla.
+
+        Returns:
+            tuple: (array booleano dentro/fuera, distancias en metros: al
+            centro para círculos, al borde para polígonos, 0 si dentro; el
+            recuadro solo evita la prueba de pertenencia)
+        """
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        if self.polygon is None:
+            distances = _haversine_meters(
+                self.latitude, self.longitude, latitudes, longitudes
+            )
+            return distances <= self.radius_meters, distances
+
+        inside = np.zeros(len(latitudes), dtype=bool)
+        distances = np.full(len(latitudes), np.inf)
+        near = self.polygon.in_bbox(latitudes, longitudes, GEOFENCE_POLYGON_BUFFER_METERS)
+        if near.any():
+            near_index = np.flatnonzero(near)
+            contained = self.polygon.contains(latitudes[near], longitudes[near])
+            inside[near_index[contained]] = True
+            distances[near_index[contained]] = 0.0
+            # Distancia al borde solo para los que quedan fuera (margen GPS)
+            outside = near_index[~contained]
+            if len(outside):
+                edge = self.polygon.distance_to_edge(latitudes[outside], longitudes[outside])
+                distances[outside] = edge
+                inside[outside] = edge <= GEOFENCE_POLYGON_BUFFER_METERS
+        far = ~near
+        if far.any():
+            distances[far] = self.polygon.distance_to_edge(latitudes[far], longitudes[far])
+        return inside, distances
+
+    def describe(self):
+        """Texto del requisito para los mensajes de check-in rechazado."""
+        if self.polygon is not None:
+            return "dentro del recinto"
+        return f"a menos de {self.radius_meters:.0f}m"
+
+
+class GeofenceSet:
+    """Geovallas de todas las ubicaciones de una versión del catálogo."""
+
+    def __init__(self, catalog, default_radius_meters):
+        self.version = catalog.version
+        self.default_radius_meters = default_radius_meters
+        self.by_location = {
+            entry.location_id: Geofence(entry, default_radius_meters)
+            for entry in catalog.locations
+        }
+
+    def get(self, location_id):
+        return self.by_location.get(location_id)
+
+    def search_radius(self, entry):
+        """Radio del círculo de búsqueda de una ubicación (índice de trazas)."""
+        return self.by_location[entry.location_id].search_radius_meters
+
+
+_geofences = None
+_geofences_lock = threading.Lock()
+
+
+def get_geofences(catalog, default_radius_meters):
+    """Geovallas de la versión actual del catálogo, recalculadas si cambió."""
+    global _geofences
+    cached = _geofences
+    if cached is not None and cached.version == catalog.version:
+        return cached
+    with _geofences_lock:
+        if _geofences is None or _geofences.version != catalog.version:
+            _geofences = GeofenceSet(catalog, default_radius_meters)
+        return _geofences
@@ -0,0 +1,233 @@
+# geography.py
+"""
+Árbol de geografía en memoria: Continente → País → CCAA → Provincia → Isla → Municipio.
+
+Se carga una vez y se guarda como arrays indexados por nodo (padre, nivel,
+id de entidad, nombre) en preorden. Cada nodo conoce el rango [inicio, fin)
+de su subárbol, de modo que los ancestros se resuelven siguiendo punteros
+al padre y los descendientes son un rango contiguo, sin consultas ni joins.
+
+Los municipios cuelgan de su isla si la tienen (Municipality.island_id) y,
+si no, directamente de su provincia.
+"""
+
+import logging
+import threading
+from array import array
+from types import MappingProxyType
+
+from models import (
+    Continent, Country, AutonomousCommunity, Province, Island, Municipality, Location
+)
+
+logger = logging.getLogger(__name__)
+
+LEVELS = (
+    "continent", "country", "autonomous_community",
+    "province", "island", "municipality",
+)
+
+
+class GeographyTree:
+    """Jerarquía geográfica con punteros al padre y rangos de subárbol."""
+
+    def __init__(self, entities, location_municipalities):
+        """
+        Args:
+            entities: Tuplas (nivel, id, nombre, nivel_padre, id_padre)
+            location_municipalities: dict location_id -> municipality_id
+        """
+        children = {}
+        info = {}
+        for level, entity_id, name, parent_level, parent_id in entities:
+            key = (level, entity_id)
+            info[key] = name
+            parent_key = (parent_level, parent_id) if parent_id is not None else None
+            children.setdefault(parent_key, []).append(key)
+
+        self.level = array('b')
+        self.entity_id = array('l')
+        self.parent = array('l')
+        self.subtree_end = array('l')
+        self.names = []
+        node_by_key = {}
+
+        # Recorrido en preorden iterativo; el marcador de cierre (key None)
+        # fija el final del subárbol cuando ya se han numerado sus descendientes
+        stack = [(key, -1) for key in sorted(children.get(None, ()), reverse=True)]
+        while stack:
+            key, node = stack.pop()
+            if key is None:
+                self.subtree_end[node] = len(self.names)
+                continue
+            parent_node = node
+            node = len(self.names)
+            node_by_key[key] = node
+            self.level.append(LEVELS.index(key[0]))
+            self.entity_id.append(key[1])
+            self.parent.append(parent_node)
+            self.subtree_end.append(0)
+            self.names.append(info[key])
+            stack.append((None, node))
+            for child in sorted(children.get(key, ()), reverse=True):
+                stack.append((child, node))
+        self._node_by_key = MappingProxyType(node_by_key)
+
+        # Ubicaciones por municipio y recuento acumulado por subárbol
+        municipality_level = LEVELS.index("municipality")
+        self._locations_by_node = {}
+        for location_id, municipality_id in sorted(location_municipalities.items()):
+            node = node_by_key.get(("municipality", municipality_id))
+            if node is not None:
+                self._locations_by_node.setdefault(node, []).append(location_id)
+        self.location_count = array('l', [0] * len(self.names))
+        for node in range(len(self.names) - 1, -1, -1):
+            if self.level[node] == municipality_level:
+                self.location_count[node] = len(self._locations_by_node.get(node, ()))
+            if self.parent[node] >= 0:
+                self.location_count[self.parent[node]] += self.location_count[node]
+
+        self.island_by_municipality = MappingProxyType({
+            self.entity_id[node]: self.entity_id[self.parent[node]]
+            for node in range(len(self.names))
+            if self.level[node] == municipality_level
+            and self.parent[node] >= 0
+            and LEVELS[self.level[self.parent[node]]] == "island"
+        })
+
+    def node(self, level, entity_id):
+        """Índice del nodo de una entidad, o None si no existe."""
+        return self._node_by_key.get((level, entity_id))
+
+    def describe(self, node):
+        """Dict con nivel, id, nombre y número de ubicaciones de un nodo."""
+        return {
+            "level": LEVELS[self.level[node]],
+            "id": self.entity_id[node],
+            "name": self.names[node],
+            "location_count": self.location_count[node],
+        }
+
+    def ancestors(self, node):
+        """Nodos ancestros, del padre a la raíz."""
+        result = []
+        parent = self.parent[node]
+        while parent >= 0:
+            result.append(parent)
+            parent = self.parent[parent]
+        return result
+
+    def descendants(self, node):
+        """Rango de nodos del subárbol (excluido el propio nodo)."""
+        return range(node + 1, self.subtree_end[node])
+
+    def children(self, node):
+        """Hijos directos de un nodo."""
+        return [child for child in self.descendants(node) if self.parent[child] == node]
+
+    def municipality_ids(self, level, entity_id):
+        """Municipios bajo una entidad de cualquier nivel (ella incluida)."""
+        node = self.node(level, entity_id)
+        if node is None:
+            return set()
+        municipality_level = LEVELS.index("municipality")
+        return {
+            self.entity_id[n] for n in range(node, self.subtree_end[node])
+            if self.level[n] == municipality_level
+        }
+
+    def location_ids(self, level, entity_id):
+        """Ubicaciones bajo una entidad de cualquier nivel."""
+        node = self.node(level, entity_id)
+        if node is None:
+            return []
+        result = []
+        for n in range(node, self.subtree_end[node]):
+            result.extend(self._locations_by_node.get(n, ()))
+        return result
+
+    def as_nested(self, node=None):
+        """Árbol anidado con recuentos, desde un nodo o desde todas las raíces."""
+        roots = (
+            [n for n in range(len(self.names)) if self.parent[n] < 0]
+            if node is None else [node]
+        )
+        return [self._nested(root) for root in roots]
+
+    def _nested(self, node):
+        return {
+            **self.describe(node),
+            "children": [self._nested(child) for child in self.children(node)],
+        }
+
+
+def load_geography_tree(db_session):
+    """
+    Lee toda la jerarquía geográfica de la base de datos.
+
+    Args:
+        db_session: Sesión de SQLAlchemy activa
+    """
+    entities = []
+    for continent_id, name in db_session.query(Continent.continent_id, Continent.name):
+        entities.append(("continent", continent_id, name, None, None))
+    for country_id, name, continent_id in db_session.query(
+        Country.country_id, Country.name, Country.continent_id
+    ):
+        entities.append(("country", country_id, name, "continent", continent_id))
+    for ac_id, name, country_id in db_session.query(
+        AutonomousCommunity.ac_id, AutonomousCommunity.name,
+        AutonomousCommunity.country_id
+    ):
+        entities.append(("autonomous_community", ac_id, name, "country", country_id))
+    for province_id, name, ac_id in db_session.query(
+        Province.province_id, Province.name, Province.ac_id
+    ):
+        entities.append(("province", province_id, name, "autonomous_community", ac_id))
+    for island_id, name, province_id in db_session.query(
+        Island.island_id, Island.name, Island.province_id
+    ):
+        entities.append(("island", island_id, name, "province", province_id))
+    for municipality_id, name, island_id, province_id in db_session.query(
+        Municipality.municipality_id, Municipality.name,
+        Municipality.island_id, Municipality.province_id
+    ):
+        if island_id is not None:
+            entities.append(("municipality", municipality_id, name, "island", island_id))
+        else:
+            entities.append(("municipality", municipality_id, name, "province", province_id))
+
+    location_municipalities = dict(db_session.query(
+        Location.location_id, Location.municipality_id
+    ))
+    return GeographyTree(entities, location_municipalities)
+
+
+_tree = None
+_tree_lock = threading.Lock()
+
+
+def reload_geography():
+    """Vuelve a leer la jerarquía y sustituye el árbol activo."""
+    global _tree
+    from poblacion_db.session_setup import ReadSessionLocal
+
+    db = ReadSessionLocal()
+    try:
+        tree = load_geography_tree(db)
+    finally:
+        db.close()
+    _tree = tree
+    logger.info(f"Árbol de geografía cargado: {len(tree.names)} nodos")
+    return tree
+
+
+def get_geography():
+    """Devuelve el árbol activo, cargándolo en el primer uso."""
+    tree = _tree
+    if tree is not None:
+        return tree
+    with _tree_lock:
+        if _tree is None:
+            return reload_geography()
+        return _tree
@@ -0,0 +1,53 @@
+# gunicorn.conf.py
+# Configuración de producción para la API Flask (app.py).
+# Uso: gunicorn -c gunicorn.conf.py app:app
+
+import gc
+import multiprocessing
+import os
+
+bind = "0.0.0.0:5000"
+workers = multiprocessing.cpu_count() * 2 + 1
+# Cada conexión SSE de /events ocupa uno de estos hilos; app.py limita las
+# conexiones por worker a la mitad (EVENT_MAX_SUBSCRIBERS)
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Importar app.py y cargar el catálogo en el maestro antes del fork:
+# los workers nuevos (p. ej. al escalar en picos) arrancan ya calientes.
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+
+def when_ready(server):
+    """Carga catálogo, geografía e índice de co-visitas en el maestro."""
+    from catalog import get_catalog
+    from covisitation import get_covisitation_index
+    from geography import get_geography
+    from models import engine
+    from poblacion_db.session_setup import read_engine
+    from sharding import get_shard_router
+
+    try:
+        get_catalog()
+    except Exception as e:
+        server.log.warning(f"No se pudo precargar el catálogo: {e}")
+    try:
+        get_geography()
+    except Exception as e:
+        server.log.warning(f"No se pudo precargar el árbol de geografía: {e}")
+    try:
+        get_covisitation_index(refresh=False)
+    except Exception as e:
+        server.log.warning(f"No se pudo precargar el índice de co-visitas: {e}")
+
+    # Las conexiones abiertas en el maestro no deben heredarse tras el fork
+    read_engine.dispose()
+    engine.dispose()
+    get_shard_router().dispose()
+
+    # Congelar los objetos actuales para que el GC de los workers no toque
+    # sus páginas y se mantengan compartidas copy-on-write
+    gc.freeze()
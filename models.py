@@ -1,10 +1,11 @@
 # models.py
 
 # Importar los tipos de datos de columnas y la base declarativa
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Text, UniqueConstraint
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Text, UniqueConstraint, event, insert, select, update
+from sqlalchemy.orm import relationship, sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
 import datetime
+import json
 
 
 # Define la URL de conexión a tu base de datos.
@@ -18,6 +19,14 @@ engine = create_engine(DATABASE_URL)
 Base = declarative_base()
 
 
+class ChangeTracked:
+    # Versión de sincronización: se asigna desde sync_counter en cada flush que
+    # crea o modifica la fila (ver _assign_sync_versions). GET /sync la usa
+    # para enviar solo lo cambiado desde la versión que tiene el cliente.
+    version = Column(Integer, default=0, nullable=False, index=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+
 class Continent(Base):
     __tablename__ = 'continents'
     continent_id = Column(Integer, primary_key=True, index=True) 
@@ -62,21 +71,23 @@ class Island(Base):
     province_id = Column(Integer, ForeignKey('provinces.province_id'), nullable=False)
 
 
-class Municipality(Base):
+class Municipality(ChangeTracked, Base):
     __tablename__ = 'municipalities'
 
     municipality_id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False) 
-    #island_id = Column(Integer, ForeignKey('islands.island_id'), nullable=False) 
+    # Nulo para municipios peninsulares (p. ej. Valencia)
+    island_id = Column(Integer, ForeignKey('islands.island_id'), nullable=True) 
     province_id = Column(Integer, ForeignKey('provinces.province_id'), nullable=False) 
     province = relationship("Province", backref="municipalities") 
+    island = relationship("Island", backref="municipalities") 
 
     # Relación: Un municipio tiene muchas ubicaciones
     locations = relationship("Location", backref="municipality")
 
 
 
-class Location(Base):
+class Location(ChangeTracked, Base):
     __tablename__ = 'locations' # Nombre de la tabla en la base de datos
 
     # Columnas definidas en el esquema
@@ -91,11 +102,35 @@ class Location(Base):
     is_natural = Column(Boolean, default=False, nullable=False) # Indica si es natural (True/False)
     best_season = Column(String) # Mejor época para visitar (ej: 'Verano', 'Todo el Año')
     best_time_of_day = Column(String) # Mejor momento del día (ej: 'Mañana', 'Atardecer')
+
+    # Geovalla del check-in: radio propio (nulo = CHECKIN_RADIUS_METERS global)
+    # y polígono opcional como JSON [[lat, lng], ...]. El recuadro se calcula
+    # al guardar (ver _update_geofence_bbox) para descartar puntos sin geometría.
+    checkin_radius_meters = Column(Integer, nullable=True)
+    geofence_polygon = Column(Text, nullable=True)
+    bbox_min_lat = Column(Float, nullable=True)
+    bbox_min_lng = Column(Float, nullable=True)
+    bbox_max_lat = Column(Float, nullable=True)
+    bbox_max_lng = Column(Float, nullable=True)
     
     # Clave foránea que enlaza con la tabla 'municipalities'
     municipality_id = Column(Integer, ForeignKey('municipalities.municipality_id'), nullable=False)
     visits = relationship("UserLocationVisit", back_populates="location")
 
+@event.listens_for(Location, "before_insert")
+@event.listens_for(Location, "before_update")
+def _update_geofence_bbox(mapper, connection, target):
+    """Recalcula el recuadro del polígono de la geovalla."""
+    if target.geofence_polygon:
+        vertices = json.loads(target.geofence_polygon)
+        latitudes = [vertex[0] for vertex in vertices]
+        longitudes = [vertex[1] for vertex in vertices]
+        target.bbox_min_lat, target.bbox_max_lat = min(latitudes), max(latitudes)
+        target.bbox_min_lng, target.bbox_max_lng = min(longitudes), max(longitudes)
+    else:
+        target.bbox_min_lat = target.bbox_max_lat = None
+        target.bbox_min_lng = target.bbox_max_lng = None
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -119,7 +154,7 @@ class Review(Base):
     timestamp = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
 
 
-class Level(Base):
+class Level(ChangeTracked, Base):
     __tablename__ = 'levels'
 
     level_id = Column(Integer, primary_key=True, index=True)
@@ -127,7 +162,7 @@ class Level(Base):
     visits_required = Column(Integer, unique=True, nullable=False)
     image_url = Column(String)
 
-class Achievement(Base):
+class Achievement(ChangeTracked, Base):
     __tablename__ = 'achievements'
 
     achievement_id = Column(Integer, primary_key=True, index=True)
@@ -147,21 +182,91 @@ class UserAchievement(Base):
     achievement_id = Column(Integer, ForeignKey('achievements.achievement_id'), nullable=False)
     unlocked_timestamp = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
 
+    # Cada logro se gana una sola vez (el check-in y el recálculo pueden coincidir)
+    __table_args__ = (UniqueConstraint('user_id', 'achievement_id', name='_user_achievement_uc'),)
+
 class UserLocationVisit(Base):
+    # Primera visita de cada usuario a cada ubicación. El log completo de
+    # check-ins (incluidas las repeticiones) está en visit_history.py
     __tablename__ = 'user_location_visits'
 
     visit_id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.user_id')) # Clave foránea a la tabla users
     location_id = Column(Integer, ForeignKey('locations.location_id')) # Clave foránea a la tabla locations
-    visit_timestamp = Column(DateTime, default=datetime.datetime.utcnow) # Fecha y hora de la visita
+    visit_timestamp = Column(DateTime, default=datetime.datetime.utcnow) # Fecha y hora de la primera visita
 
-    # Opcional: Asegurarse de que un usuario no pueda tener múltiples visitas exactas en el mismo instante (no estrictamente necesario si cada llamada crea un nuevo registro válido)
-    __table_args__ = (UniqueConstraint('user_id', 'location_id', 'visit_timestamp', name='_user_location_timestamp_uc'),)
+    # Una sola fila por usuario y ubicación: la tabla no crece con las visitas repetidas
+    __table_args__ = (UniqueConstraint('user_id', 'location_id', name='_user_location_uc'),)
 
     # Definir relaciones (opcional pero útil)
     user = relationship("User", back_populates="visits") # Asumiendo que tienes 'visits' en el modelo User
     location = relationship("Location", back_populates="visits") # Asumiendo que tienes 'visits' en el modelo Location
 
+class SyncCounter(Base):
+    # Fila única con la última versión de sincronización asignada
+    __tablename__ = 'sync_counter'
+
+    counter_id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+    # Versión asignada al último repoblamiento (0 si no lo hubo): los clientes
+    # con una versión anterior no tienen lápidas de lo borrado y deben reiniciar
+    reset_version = Column(Integer, default=0, nullable=False)
+
+class SyncTombstone(Base):
+    # Registro de las filas borradas de tablas sincronizadas
+    __tablename__ = 'sync_tombstones'
+
+    tombstone_id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+class UserIdSequence(Base):
+    # Fila única con el último user_id asignado en este shard (ver sharding.py)
+    __tablename__ = 'user_id_sequence'
+
+    sequence_id = Column(Integer, primary_key=True)
+    last_user_id = Column(Integer, nullable=False)
+
+
+def _next_sync_version(session):
+    """Incrementa sync_counter dentro de la transacción y devuelve el nuevo valor."""
+    connection = session.connection()
+    result = connection.execute(
+        update(SyncCounter.__table__).values(version=SyncCounter.__table__.c.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(SyncCounter.__table__).values(counter_id=1, version=1))
+    return connection.execute(select(SyncCounter.__table__.c.version)).scalar()
+
+
+@event.listens_for(Session, "before_flush")
+def _assign_sync_versions(session, flush_context, instances):
+    """Asigna versión a las filas sincronizadas creadas, modificadas o borradas."""
+    changed = [
+        obj for obj in list(session.new) + list(session.dirty)
+        if isinstance(obj, ChangeTracked) and (
+            obj in session.new or session.is_modified(obj, include_collections=False)
+        )
+    ]
+    deleted = [obj for obj in session.deleted if isinstance(obj, ChangeTracked)]
+    if not changed and not deleted:
+        return
+
+    version = _next_sync_version(session)
+    now = datetime.datetime.utcnow()
+    for obj in changed:
+        obj.version = version
+        obj.updated_at = now
+    for obj in deleted:
+        primary_key, = obj.__mapper__.primary_key_from_instance(obj)
+        session.add(SyncTombstone(
+            table_name=obj.__tablename__, entity_id=primary_key,
+            version=version, deleted_at=now
+        ))
+
+
 def create_database_tables():
     print("Creando tablas de la base de datos...")
     Base.metadata.create_all(bind=engine)
@@ -55,7 +55,7 @@ def populate_provinces_islands_municipalities(session):
     municipios_vlc_nombres = ["Valencia"]
 
     municipio_objects_tnf = [
-        Municipality(name=nombre, province=sta_cruz_tf_province)
+        Municipality(name=nombre, province=sta_cruz_tf_province, island=tenerife_island)
         for nombre in municipios_tnf_nombres
     ]
     municipio_objects_vlc = [
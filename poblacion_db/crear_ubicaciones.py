@@ -45,6 +45,7 @@ def populate_locations(session):
             is_natural=False,
             best_season="Todo el Año",
             best_time_of_day="Todo el Día",
+            checkin_radius_meters=300,  # zona urbana densa
             municipality=sta_cruz
         ),
         Location(
@@ -70,6 +71,7 @@ def populate_locations(session):
             is_natural=False,
             best_season="Todo el Año",
             best_time_of_day="Día Completo",
+            checkin_radius_meters=400,
             municipality=sta_cruz
         ),
         Location(
@@ -2,17 +2,26 @@
 """
 Script principal para poblar la base de datos con datos iniciales.
 Ejecuta los scripts de poblamiento en el orden correcto.
+
+Borra todas las tablas, incluidas las de usuarios: para actualizar el esquema
+de una base de datos con datos usa poblacion_db/migrations.py. Si ya hay
+usuarios, el poblamiento se niega a continuar salvo con --force.
 """
 
 import logging
+import sys
 import traceback
+from sqlalchemy import func, insert, inspect, select
 from poblacion_db.session_setup import SessionLocal
 from poblacion_db.populate_base_hierarchy import populate_base_hierarchy
 from poblacion_db.crear_provincias_islas_municipios import populate_provinces_islands_municipalities
 from poblacion_db.crear_ubicaciones import populate_locations
 from poblacion_db.crear_niveles import populate_levels
 from poblacion_db.crear_logros import populate_achievements
-from models import Base, engine
+from poblacion_db.migrations import mark_all_applied
+from models import Base, SyncCounter, User, engine
+from cache import get_cache
+from sharding import get_shard_router
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,13 +30,55 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def run_population():
+def _existing_user_count(engines):
+    """Usuarios que se perderían al recrear las tablas."""
+    total = 0
+    for target in engines:
+        if inspect(target).has_table(User.__tablename__):
+            with target.connect() as connection:
+                total += connection.execute(
+                    User.__table__.select().with_only_columns(func.count())
+                ).scalar() or 0
+    return total
+
+
+def _current_sync_version():
+    """Último valor de sync_counter antes de borrar las tablas (0 si no existe)."""
+    if not inspect(engine).has_table(SyncCounter.__tablename__):
+        return 0
+    with engine.connect() as connection:
+        return connection.execute(
+            select(func.max(SyncCounter.__table__.c.version))
+        ).scalar() or 0
+
+
+def run_population(force=False):
     """
     Pobla la base de datos con datos iniciales.
     Borra y recrea todas las tablas antes de poblar.
+
+    Args:
+        force: Continúa aunque existan usuarios (se pierden)
     """
     logger.info("Iniciando proceso de poblamiento de la base de datos...")
-    
+    router = get_shard_router()
+    engines = [engine] + ([shard.engine for shard in router.shards] if router.sharded else [])
+
+    user_count = _existing_user_count(engines)
+    if user_count and not force:
+        raise RuntimeError(
+            f"La base de datos tiene {user_count} usuarios y el poblamiento los "
+            "borraría. Usa 'python -m poblacion_db.migrations' para actualizar "
+            "el esquema, o --force para recrearla igualmente."
+        )
+
+    # El contador de sincronización continúa tras el repoblamiento (los
+    # workers detectan el cambio de versión y recargan el catálogo) y el
+    # repoblamiento reserva la siguiente versión como reset_version: las filas
+    # borradas no dejan lápidas, así que GET /sync responde reset=true a los
+    # clientes con una versión anterior
+    previous_sync_version = _current_sync_version()
+
     # Borrar y recrear tablas
     logger.info("Borrando todas las tablas existentes...")
     Base.metadata.drop_all(bind=engine)
@@ -37,6 +88,20 @@ def run_population():
     Base.metadata.create_all(bind=engine)
     logger.info("Tablas creadas.")
 
+    # Con shards, las tablas de usuario se recrean también en cada uno
+    router.create_tables(drop=True)
+
+    # El esquema recién creado ya incluye todas las migraciones
+    for target in engines:
+        mark_all_applied(target)
+
+    if previous_sync_version:
+        with engine.begin() as connection:
+            connection.execute(insert(SyncCounter.__table__).values(
+                counter_id=1, version=previous_sync_version + 1,
+                reset_version=previous_sync_version + 1,
+            ))
+
     session = SessionLocal()
 
     try:
@@ -50,6 +115,13 @@ def run_population():
         session.commit()
         logger.info("Poblamiento completado exitosamente. Cambios confirmados.")
 
+        router.replicate_catalog()
+
+        # Con backend compartido los workers recargan catálogo y geografía en
+        # cuanto llega la invalidación; sin él, al comprobar sync_counter
+        # (CATALOG_VERSION_CHECK_SECONDS, ver catalog.py)
+        get_cache().invalidate("catalog")
+
     except Exception as e:
         session.rollback()
         logger.error(f"Error durante el poblamiento. Revirtiendo cambios: {e}")
@@ -61,4 +133,8 @@ def run_population():
 
 
 if __name__ == "__main__":
-    run_population()
\ No newline at end of file
+    try:
+        run_population(force="--force" in sys.argv[1:])
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,303 @@
+# poblacion_db/migrations.py
+"""
+Migraciones aditivas del esquema para bases de datos con datos.
+
+main_populate.py borra y recrea todas las tablas, así que solo sirve para
+una base de datos nueva. Este script lleva una base existente al esquema
+actual sin perder usuarios ni visitas: crea las tablas nuevas, añade
+columnas con ALTER TABLE y rellena los valores derivados.
+
+Cada migración comprueba el esquema antes de tocarlo, así que es
+idempotente, y queda registrada en schema_migrations. Se aplican a la
+primaria y, con SHARD_DATABASE_URLS, a cada shard (que guardan una copia
+del catálogo).
+
+Uso:
+    python -m poblacion_db.migrations [--list]
+"""
+
+import datetime
+import json
+import logging
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, select, text
+from sqlalchemy.schema import CreateIndex
+
+from models import Base
+
+logger = logging.getLogger(__name__)
+
+# Registro de migraciones aplicadas (fuera de Base.metadata, como las particiones)
+migrations_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", migrations_metadata,
+    Column("name", String, primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _table_exists(connection, table_name):
+    return inspect(connection).has_table(table_name)
+
+
+def _column_names(connection, table_name):
+    return {column["name"] for column in inspect(connection).get_columns(table_name)}
+
+
+def _add_columns(connection, table_name, column_names, defaults=None):
+    """
+    Añade a una tabla existente las columnas del modelo que le falten.
+
+    Args:
+        column_names: Columnas de Base.metadata a añadir
+        defaults: Valor constante por columna; obligatorio para las NOT NULL
+            (SQLite no admite añadir una columna NOT NULL sin DEFAULT)
+
+    Returns:
+        list: Columnas añadidas
+    """
+    defaults = defaults or {}
+    table = Base.metadata.tables[table_name]
+    existing = _column_names(connection, table_name)
+    added = []
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        column_type = column.type.compile(dialect=connection.dialect)
+        ddl = f"ALTER TABLE {table_name} ADD COLUMN {name} {column_type}"
+        if name in defaults:
+            default = defaults[name]
+            literal = f"'{default}'" if isinstance(default, str) else str(default)
+            ddl += f" DEFAULT {literal}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+        connection.execute(text(ddl))
+        added.append(name)
+    for index in table.indexes:
+        if any(indexed.name in added for indexed in index.columns):
+            connection.execute(CreateIndex(index, if_not_exists=True))
+    if added:
+        logger.info(f"{table_name}: columnas añadidas {added}")
+    return added
+
+
+def _create_tables(connection, table_names):
+    """Crea las tablas del modelo que no existan todavía."""
+    tables = [Base.metadata.tables[name] for name in table_names]
+    Base.metadata.create_all(bind=connection, tables=tables)
+
+
+# Migraciones
+
+def migrate_municipality_island(connection):
+    """Municipality.island_id; se rellena si la provincia tiene una sola isla."""
+    if not _table_exists(connection, "municipalities"):
+        return
+    _add_columns(connection, "municipalities", ["island_id"])
+    result = connection.execute(text("""
+        UPDATE municipalities SET island_id = (
+            SELECT MIN(islands.island_id) FROM islands
+            WHERE islands.province_id = municipalities.province_id
+        )
+        WHERE island_id IS NULL AND (
+            SELECT COUNT(*) FROM islands
+            WHERE islands.province_id = municipalities.province_id
+        ) = 1
+    """))
+    logger.info(f"municipalities: island_id asignado a {result.rowcount} municipios")
+
+
+SYNC_VERSIONED_TABLES = ("municipalities", "locations", "levels", "achievements")
+
+
+def migrate_sync_versions(connection):
+    """Columnas version/updated_at del catálogo y tablas de sincronización."""
+    now = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+    migrated = False
+    for table_name in SYNC_VERSIONED_TABLES:
+        if not _table_exists(connection, table_name):
+            continue
+        added = _add_columns(
+            connection, table_name, ["version", "updated_at"],
+            defaults={"version": 0, "updated_at": now},
+        )
+        if "version" in added:
+            # Versión 1 para las filas existentes: GET /sync?since=0 las envía
+            connection.execute(text(f"UPDATE {table_name} SET version = 1"))
+            migrated = True
+    _create_tables(connection, ("sync_counter", "sync_tombstones"))
+    if migrated:
+        connection.execute(text(
+            "INSERT INTO sync_counter (counter_id, version) "
+            "SELECT 1, 1 WHERE NOT EXISTS (SELECT 1 FROM sync_counter)"
+        ))
+
+
+def migrate_location_geofence(connection):
+    """Radio y polígono de check-in por ubicación, con su recuadro."""
+    if not _table_exists(connection, "locations"):
+        return
+    _add_columns(connection, "locations", [
+        "checkin_radius_meters", "geofence_polygon",
+        "bbox_min_lat", "bbox_min_lng", "bbox_max_lat", "bbox_max_lng",
+    ])
+    # Recuadro de los polígonos que se hubieran cargado a mano
+    rows = connection.execute(text(
+        "SELECT location_id, geofence_polygon FROM locations "
+        "WHERE geofence_polygon IS NOT NULL AND bbox_min_lat IS NULL"
+    )).all()
+    for location_id, polygon in rows:
+        vertices = json.loads(polygon)
+        latitudes = [vertex[0] for vertex in vertices]
+        longitudes = [vertex[1] for vertex in vertices]
+        connection.execute(text(
+            "UPDATE locations SET bbox_min_lat = :min_lat, bbox_min_lng = :min_lng, "
+            "bbox_max_lat = :max_lat, bbox_max_lng = :max_lng "
+            "WHERE location_id = :location_id"
+        ), {
+            "min_lat": min(latitudes), "min_lng": min(longitudes),
+            "max_lat": max(latitudes), "max_lng": max(longitudes),
+            "location_id": location_id,
+        })
+
+
+def migrate_user_id_sequence(connection):
+    """Tabla user_id_sequence (la primera asignación parte del mayor user_id)."""
+    _create_tables(connection, ("user_id_sequence",))
+
+
+def migrate_user_achievement_unique(connection):
+    """Restricción única (user_id, achievement_id) en user_achievements."""
+    if not _table_exists(connection, "user_achievements"):
+        return
+    # Conserva el primer desbloqueo de cada logro duplicado
+    result = connection.execute(text("""
+        DELETE FROM user_achievements WHERE user_achievement_id NOT IN (
+            SELECT MIN(user_achievement_id) FROM user_achievements
+            GROUP BY user_id, achievement_id
+        )
+    """))
+    if result.rowcount:
+        logger.info(f"user_achievements: {result.rowcount} logros duplicados eliminados")
+    # Índice único con el nombre de la restricción del modelo (SQLite no
+    # permite añadir restricciones con ALTER TABLE; ON CONFLICT usa ambos)
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS _user_achievement_uc "
+        "ON user_achievements (user_id, achievement_id)"
+    ))
+
+
+def migrate_user_location_unique(connection):
+    """Una sola fila de user_location_visits por usuario y ubicación."""
+    if not _table_exists(connection, "user_location_visits"):
+        return
+    # Solo hay duplicados por check-ins simultáneos: se conserva la primera visita
+    result = connection.execute(text("""
+        DELETE FROM user_location_visits WHERE visit_id NOT IN (
+            SELECT MIN(visit_id) FROM user_location_visits
+            GROUP BY user_id, location_id
+        )
+    """))
+    if result.rowcount:
+        logger.info(f"user_location_visits: {result.rowcount} visitas duplicadas eliminadas")
+    if connection.dialect.name == "postgresql":
+        # La restricción anterior incluía visit_timestamp y ya no se usa
+        connection.execute(text(
+            "ALTER TABLE user_location_visits "
+            "DROP CONSTRAINT IF EXISTS _user_location_timestamp_uc"
+        ))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS _user_location_uc "
+        "ON user_location_visits (user_id, location_id)"
+    ))
+
+
+def migrate_sync_reset_version(connection):
+    """sync_counter.reset_version: versión del último repoblamiento."""
+    if not _table_exists(connection, "sync_counter"):
+        return
+    _add_columns(connection, "sync_counter", ["reset_version"],
+                 defaults={"reset_version": 0})
+
+
+# (nombre, función) en orden de aplicación
+MIGRATIONS = (
+    ("0001_municipality_island", migrate_municipality_island),
+    ("0002_sync_versions", migrate_sync_versions),
+    ("0003_location_geofence", migrate_location_geofence),
+    ("0004_user_id_sequence", migrate_user_id_sequence),
+    ("0005_user_achievement_unique", migrate_user_achievement_unique),
+    ("0006_user_location_unique", migrate_user_location_unique),
+    ("0007_sync_reset_version", migrate_sync_reset_version),
+)
+
+
+def applied_migrations(connection):
+    migrations_metadata.create_all(bind=connection)
+    return {row[0] for row in connection.execute(select(schema_migrations.c.name))}
+
+
+def run_migrations(engine):
+    """
+    Aplica las migraciones pendientes, cada una en su transacción.
+
+    Returns:
+        list: Nombres de las migraciones aplicadas
+    """
+    applied = []
+    with engine.begin() as connection:
+        done = applied_migrations(connection)
+    for name, migration in MIGRATIONS:
+        if name in done:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(schema_migrations.insert().values(
+                name=name, applied_at=datetime.datetime.utcnow()
+            ))
+        logger.info(f"Migración {name} aplicada en {engine.url}")
+        applied.append(name)
+    return applied
+
+
+def mark_all_applied(engine):
+    """Registra todas las migraciones como aplicadas (base recién creada)."""
+    with engine.begin() as connection:
+        done = applied_migrations(connection)
+        for name, _ in MIGRATIONS:
+            if name not in done:
+                connection.execute(schema_migrations.insert().values(
+                    name=name, applied_at=datetime.datetime.utcnow()
+                ))
+
+
+if __name__ == "__main__":
+    import argparse
+    from models import engine as primary_engine
+    from sharding import get_shard_router
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Migraciones del esquema")
+    parser.add_argument("--list", action="store_true",
+                        help="Muestra las migraciones y si están aplicadas")
+    args = parser.parse_args()
+
+    router = get_shard_router()
+    engines = [primary_engine]
+    if router.sharded:
+        engines.extend(shard.engine for shard in router.shards)
+
+    for target in engines:
+        if args.list:
+            with target.begin() as conn:
+                done = applied_migrations(conn)
+            for migration_name, _ in MIGRATIONS:
+                state = "aplicada" if migration_name in done else "pendiente"
+                logger.info(f"{target.url}: {migration_name} {state}")
+        else:
+            names = run_migrations(target)
+            logger.info(f"{target.url}: {len(names)} migraciones aplicadas")
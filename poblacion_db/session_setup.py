@@ -1,9 +1,55 @@
 # poblacion_db/session_setup.py
 """
 Configuración de sesiones de SQLAlchemy para el proyecto.
+
+SessionLocal escribe en la base de datos primaria. ReadSessionLocal se usa en
+las rutas de solo lectura y apunta a READ_DATABASE_URL (una réplica) si está
+definida; con SQLite, a una conexión de solo lectura sobre el mismo fichero.
 """
 
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from models import engine
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+# URL de la réplica de lectura (opcional)
+READ_DATABASE_URL = os.getenv('READ_DATABASE_URL')
+
+
+def build_read_engine(primary_engine, read_url=None):
+    """
+    Crea el engine de lectura de un engine primario.
+
+    Args:
+        primary_engine: Engine de escritura
+        read_url: URL de la réplica, si existe
+
+    Returns:
+        Engine: Réplica configurada, conexión SQLite de solo lectura con caché
+        compartida, o el engine primario si no hay alternativa.
+    """
+    if read_url:
+        return create_engine(read_url, pool_pre_ping=True)
+
+    database = primary_engine.url.database
+    if primary_engine.dialect.name != 'sqlite' or database in (None, '', ':memory:'):
+        return primary_engine
+
+    read_engine = create_engine(
+        f"sqlite:///file:{os.path.abspath(database)}"
+        "?mode=ro&cache=shared&uri=true"
+    )
+
+    @event.listens_for(read_engine, "connect")
+    def _set_query_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+    return read_engine
+
+
+read_engine = build_read_engine(engine, READ_DATABASE_URL)
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
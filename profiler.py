@@ -0,0 +1,583 @@
+# profiler.py
+"""
+Perfilador por muestreo bajo demanda para los workers de la API.
+
+Mientras hay una sesión activa, un hilo toma cada PROFILER_INTERVAL_MS la
+pila de los hilos que están atendiendo una petición perfilada
+(sys._current_frames) y la acumula por ruta. Las peticiones se apuntan y se
+borran con los hooks before/after de Flask. Una sesión dura N segundos y
+puede limitarse a una ruta y a un porcentaje de sus peticiones.
+
+Sin sesión activa no existe el hilo de muestreo y el hook de cada petición
+solo consulta un booleano (y, con backend compartido, un contador de versión
+de la sesión como mucho cada PROFILER_IDLE_SYNC_SECONDS), así que puede
+quedarse en producción.
+
+Exporta las pilas agregadas como collapsed stacks (flamegraph.pl,
+speedscope, inferno) o como JSON de speedscope con un perfil por ruta.
+
+Alcance: un proceso solo puede muestrear sus propios hilos.
+    - Con SHARED_BACKEND_URL la sesión es de todos los workers. start() la
+      guarda en el backend e incrementa su versión (también stop()); cada
+      worker consulta la versión al empezar una petición, lee la sesión solo
+      si ha cambiado y se une, y sube sus pilas al backend cada
+      PROFILER_SYNC_SECONDS y al terminar. Estado y exportaciones suman las pilas de todos los workers,
+      los atienda el worker que los atienda (status: scope "workers").
+    - Sin backend compartido la sesión y las pilas son solo del worker que
+      recibió /admin/profiler/start (status: scope "worker" y su pid). Las
+      siguientes llamadas /admin las reparte gunicorn entre los workers: hay
+      que repetirlas hasta que responda el mismo pid, o perfilar con un
+      único worker (gunicorn --workers 1).
+"""
+
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from shared_backend import get_shared_backend
+
+logger = logging.getLogger(__name__)
+
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', 5))
+PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', 600))
+# Cada cuánto consulta un worker la sesión compartida y sube sus pilas
+PROFILER_SYNC_SECONDS = float(os.getenv('PROFILER_SYNC_SECONDS', 1))
+# Ídem sin sesión activa en el worker: solo se consulta la versión de la sesión
+PROFILER_IDLE_SYNC_SECONDS = float(os.getenv('PROFILER_IDLE_SYNC_SECONDS', 5))
+# Tiempo que se conservan en el backend las pilas de una sesión terminada
+PROFILER_RESULTS_SECONDS = int(os.getenv('PROFILER_RESULTS_SECONDS', 3600))
+# Profundidad máxima de pila que se conserva (los marcos más internos)
+PROFILER_MAX_DEPTH = 128
+
+SESSION_KEY = "profiler:session"
+# Contador que start() y stop() incrementan tras escribir la sesión
+SESSION_VERSION_KEY = "profiler:session_version"
+_NO_VERSION = object()  # el worker aún no ha leído la sesión
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+def _merge_states(states, route=None):
+    """
+    Suma las pilas de varios workers, cuyos índices de marco son distintos.
+
+    Returns:
+        tuple: (marcos, [(ruta, pila, muestras, ms)], peticiones por ruta)
+    """
+    frames = []
+    frame_index = {}
+    samples = Counter()
+    weights = Counter()
+    requests = Counter()
+    for state in states:
+        remap = []
+        for frame in state["frames"]:
+            frame = tuple(frame)
+            index = frame_index.get(frame)
+            if index is None:
+                index = frame_index[frame] = len(frames)
+                frames.append(frame)
+            remap.append(index)
+        for stack_route, stack, count, weight in state["stacks"]:
+            if route is not None and stack_route != route:
+                continue
+            key = (stack_route, tuple(remap[index] for index in stack))
+            samples[key] += count
+            weights[key] += weight
+        requests.update(state["requests"])
+    stacks = [
+        (stack_route, stack, count, weights[(stack_route, stack)])
+        for (stack_route, stack), count in samples.items()
+    ]
+    return frames, stacks, requests
+
+
+class SamplingProfiler:
+    """Muestreo periódico de las pilas de las peticiones perfiladas."""
+
+    def __init__(self, interval_ms=PROFILER_INTERVAL_MS, shared_backend=None):
+        """
+        Args:
+            interval_ms: Intervalo de muestreo por defecto
+            shared_backend: Cliente con API de redis-py para coordinar la
+                sesión entre workers, o None para perfilar solo este proceso
+        """
+        self.interval_ms = interval_ms
+        self.shared_backend = shared_backend
+        self.active = False
+        self.route = None
+        self.sample_rate = 1.0
+        self.started_at = None
+        self.deadline = None
+        self.session_id = None      # sesión compartida de las pilas acumuladas
+        self._session_token = None  # arranque de la sesión compartida ya aplicado
+        self._slot = None           # número de este worker en la sesión compartida
+        self._session_version = _NO_VERSION  # última versión de la sesión aplicada
+        self._next_sync = 0.0
+        self._next_push = 0.0
+        self._threads = {}          # ident del hilo -> ruta de su petición
+        self._threads_lock = threading.Lock()
+        self._frames = []           # (nombre, fichero, línea) por índice
+        self._frame_index = {}      # code object -> índice en _frames
+        self._stacks = Counter()    # (ruta, índices raíz→hoja) -> muestras
+        self._weights = Counter()   # (ruta, índices raíz→hoja) -> ms muestreados
+        self._requests = Counter()  # ruta -> peticiones perfiladas
+        self._samples = 0
+        self._sampling_seconds = 0.0
+        self._lock = threading.Lock()
+        self._session_lock = threading.Lock()
+        self._push_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Control
+
+    def start(self, seconds, route=None, sample_rate=1.0, interval_ms=None,
+              reset=True):
+        """
+        Activa el muestreo durante seconds segundos.
+
+        Args:
+            route: Regla de URL (p. ej. "/checkin") o endpoint a perfilar;
+                None para todas las rutas
+            sample_rate: Fracción de las peticiones que se perfilan (0-1]
+            interval_ms: Intervalo de muestreo (por defecto PROFILER_INTERVAL_MS)
+            reset: Descarta las pilas de la sesión anterior; con False se
+                siguen acumulando
+        """
+        if not 0 < seconds <= PROFILER_MAX_SECONDS:
+            raise ValueError(f"seconds debe estar entre 0 y {PROFILER_MAX_SECONDS:g}")
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate debe estar entre 0 y 1")
+        if interval_ms is not None and interval_ms < 1:
+            raise ValueError("interval_ms debe ser al menos 1")
+        if interval_ms is None:
+            interval_ms = PROFILER_INTERVAL_MS
+
+        with self._session_lock:
+            if self.shared_backend is not None:
+                previous = self._read_session()
+                now = time.time()
+                session = {
+                    "id": (previous["id"] if previous and not reset
+                           else uuid.uuid4().hex),
+                    "token": uuid.uuid4().hex,
+                    "route": route,
+                    "sample_rate": sample_rate,
+                    "interval_ms": interval_ms,
+                    "started_at": now,
+                    "deadline": now + seconds,
+                    "stopped": False,
+                }
+                if self._write_session(session):
+                    self._bump_session_version()
+                    self._apply_session(session)
+                    return
+                logger.warning("Perfilador: sesión solo en este worker")
+            if reset:
+                self.reset()
+            self._start_local(seconds, route, sample_rate, interval_ms)
+
+    def stop(self):
+        """
+        Detiene el muestreo conservando las pilas acumuladas (en todos los
+        workers si la sesión es compartida).
+        """
+        with self._session_lock:
+            if self.shared_backend is not None:
+                session = self._read_session()
+                if session is not None and not session["stopped"]:
+                    session["stopped"] = True
+                    if self._write_session(session):
+                        self._bump_session_version()
+            self._stop_local()
+
+    def reset(self):
+        """Descarta las pilas acumuladas en este worker."""
+        with self._lock:
+            self._frames = []
+            self._frame_index = {}
+            self._stacks = Counter()
+            self._weights = Counter()
+            self._requests = Counter()
+            self._samples = 0
+            self._sampling_seconds = 0.0
+
+    def sync(self):
+        """
+        Se une a la sesión compartida o la abandona si ha cambiado.
+
+        Se llama al empezar cada petición y consulta la versión de la sesión
+        como mucho cada PROFILER_SYNC_SECONDS con el muestreo activo, o cada
+        PROFILER_IDLE_SYNC_SECONDS sin él; la sesión solo se lee si la
+        versión cambió. Sin backend compartido no hace nada.
+        """
+        if self.shared_backend is None or time.monotonic() < self._next_sync:
+            return
+        if not self._session_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = time.monotonic() + (
+                PROFILER_SYNC_SECONDS if self.active else PROFILER_IDLE_SYNC_SECONDS
+            )
+            try:
+                version = self.shared_backend.get(SESSION_VERSION_KEY)
+            except Exception as e:
+                logger.warning(f"Backend compartido no disponible para el perfilador: {e}")
+                return
+            if version == self._session_version:
+                return
+            self._session_version = version
+            self._apply_session(self._read_session())
+        finally:
+            self._session_lock.release()
+
+    def _start_local(self, seconds, route, sample_rate, interval_ms,
+                     started_at=None):
+        self._halt()
+        with self._lock:
+            self.interval_ms = interval_ms
+            self.route = route
+            self.sample_rate = sample_rate
+            self.started_at = started_at or time.time()
+            self.deadline = time.monotonic() + seconds
+            self._next_push = time.monotonic() + PROFILER_SYNC_SECONDS
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="sampling-profiler", daemon=True
+            )
+            self.active = True
+            self._thread.start()
+        logger.info(
+            f"Perfilador activo {seconds:g}s (ruta={route or 'todas'}, "
+            f"muestreo={sample_rate:.0%}, cada {self.interval_ms:g}ms)"
+        )
+
+    def _halt(self):
+        """Para el hilo de muestreo."""
+        thread = self._thread
+        self.active = False
+        self._stop.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+        with self._threads_lock:
+            self._threads.clear()
+
+    def _stop_local(self):
+        self._halt()
+        self._push()
+
+    # Sesión compartida
+
+    def _read_session(self):
+        try:
+            raw = self.shared_backend.get(SESSION_KEY)
+        except Exception as e:
+            logger.warning(f"Backend compartido no disponible para el perfilador: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    def _bump_session_version(self):
+        try:
+            self.shared_backend.incr(SESSION_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"Backend compartido no disponible para el perfilador: {e}")
+
+    def _write_session(self, session):
+        # La sesión dura lo que las pilas, para poder exportarlas al terminar
+        ttl = math.ceil(session["deadline"] - time.time()) + PROFILER_RESULTS_SECONDS
+        try:
+            self.shared_backend.set(SESSION_KEY, json.dumps(session), ex=ttl)
+        except Exception as e:
+            logger.warning(f"Backend compartido no disponible para el perfilador: {e}")
+            return False
+        return True
+
+    def _apply_session(self, session):
+        """Alinea el muestreo de este worker con la sesión (con _session_lock)."""
+        running = (
+            session is not None and not session["stopped"]
+            and time.time() < session["deadline"]
+        )
+        if not running:
+            if self.active and self.session_id is not None:
+                self._stop_local()
+            return
+        if session["token"] == self._session_token:
+            return
+        if session["id"] != self.session_id:
+            self._halt()
+            self.reset()
+            self.session_id = session["id"]
+            self._slot = None
+        self._session_token = session["token"]
+        self._start_local(
+            session["deadline"] - time.time(), session["route"],
+            session["sample_rate"], session["interval_ms"],
+            started_at=session["started_at"],
+        )
+
+    def _push(self):
+        """Sube las pilas de este worker a su sesión compartida."""
+        session_id = self.session_id
+        if self.shared_backend is None or session_id is None:
+            return
+        with self._push_lock:
+            state = self._state()
+            if not state["requests"]:
+                return
+            try:
+                if self._slot is None:
+                    workers_key = f"profiler:{session_id}:workers"
+                    self._slot = self.shared_backend.incr(workers_key)
+                    self.shared_backend.pexpire(
+                        workers_key, PROFILER_RESULTS_SECONDS * 1000
+                    )
+                self.shared_backend.set(
+                    f"profiler:{session_id}:{self._slot}", json.dumps(state),
+                    ex=PROFILER_RESULTS_SECONDS,
+                )
+            except Exception as e:
+                logger.warning(f"Perfilador: no se pudieron subir las pilas: {e}")
+
+    def _worker_states(self, session):
+        """Pilas de este worker o, con sesión compartida, de todos los workers."""
+        if session is None:
+            return [self._state()]
+        session_id = session["id"]
+        if session_id == self.session_id:
+            self._push()
+        try:
+            count = int(self.shared_backend.get(f"profiler:{session_id}:workers") or 0)
+            raw_states = [
+                self.shared_backend.get(f"profiler:{session_id}:{slot}")
+                for slot in range(1, count + 1)
+            ]
+        except Exception as e:
+            logger.warning(f"Backend compartido no disponible para el perfilador: {e}")
+            return [self._state()]
+        return [json.loads(raw) for raw in raw_states if raw]
+
+    def _current_session(self):
+        if self.shared_backend is None:
+            return None
+        return self._read_session()
+
+    # Atribución por petición
+
+    def begin_request(self, rule, endpoint):
+        """Apunta el hilo actual si la petición entra en la sesión."""
+        if self.route is not None and self.route not in (rule, endpoint):
+            return
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        route = rule or endpoint or "<sin ruta>"
+        # _run lee _threads desde su hilo: se modifica y se copia con el lock
+        with self._threads_lock:
+            self._threads[threading.get_ident()] = route
+        with self._lock:
+            self._requests[route] += 1
+
+    def end_request(self):
+        with self._threads_lock:
+            self._threads.pop(threading.get_ident(), None)
+
+    # Muestreo
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                if time.monotonic() >= self.deadline:
+                    logger.info("Perfilador: fin de la ventana de muestreo")
+                    self.active = False
+                    with self._threads_lock:
+                        self._threads.clear()
+                    self._push()
+                    return
+                with self._threads_lock:
+                    threads = dict(self._threads)
+                if threads:
+                    start = time.perf_counter()
+                    self._sample(threads)
+                    with self._lock:
+                        self._sampling_seconds += time.perf_counter() - start
+                if time.monotonic() >= self._next_push:
+                    self._next_push = time.monotonic() + PROFILER_SYNC_SECONDS
+                    self._push()
+                self._stop.wait(self.interval_ms / 1000)
+        except Exception as e:
+            self.active = False
+            logger.error(f"Perfilador detenido por un error: {e}")
+
+    def _sample(self, threads):
+        frames = sys._current_frames()
+        with self._lock:
+            # Peso de la muestra con el intervalo vigente al tomarla
+            weight = self.interval_ms
+            for ident, route in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILER_MAX_DEPTH:
+                    stack.append(self._frame_id(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                key = (route, tuple(stack))
+                self._stacks[key] += 1
+                self._weights[key] += weight
+                self._samples += 1
+
+    def _frame_id(self, code):
+        """Índice del marco de un code object (con el lock tomado)."""
+        index = self._frame_index.get(code)
+        if index is None:
+            index = self._frame_index[code] = len(self._frames)
+            self._frames.append((
+                getattr(code, "co_qualname", code.co_name),
+                code.co_filename, code.co_firstlineno,
+            ))
+        return index
+
+    # Exportación
+
+    def _state(self):
+        """Pilas de este worker en un formato serializable a JSON."""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "frames": list(self._frames),
+                "stacks": [
+                    [route, list(stack), count, self._weights[(route, stack)]]
+                    for (route, stack), count in self._stacks.items()
+                ],
+                "requests": dict(self._requests),
+                "samples": self._samples,
+                "sampling_ms": self._sampling_seconds * 1000,
+            }
+
+    def status(self):
+        """Estado de la sesión y recuentos por ruta."""
+        session = self._current_session()
+        states = self._worker_states(session)
+        _, stacks, requests = _merge_states(states)
+        samples_by_route = Counter()
+        for route, _, count, _ in stacks:
+            samples_by_route[route] += count
+
+        if session is not None:
+            remaining = session["deadline"] - time.time()
+            active = not session["stopped"] and remaining > 0
+            settings = {
+                "scope": "workers",
+                "session_id": session["id"],
+                "active": active,
+                "route": session["route"],
+                "sample_rate": session["sample_rate"],
+                "interval_ms": session["interval_ms"],
+                "started_at": session["started_at"],
+            }
+        else:
+            remaining = (
+                self.deadline - time.monotonic() if self.active else 0.0
+            )
+            active = self.active
+            settings = {
+                "scope": "worker",
+                "session_id": None,
+                "active": active,
+                "route": self.route,
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval_ms,
+                "started_at": self.started_at,
+            }
+        return {
+            "pid": os.getpid(),
+            **settings,
+            "worker_pids": sorted({state["pid"] for state in states}),
+            "remaining_seconds": round(max(0.0, remaining), 1) if active else 0.0,
+            "samples": sum(state["samples"] for state in states),
+            "sampling_overhead_ms": round(
+                sum(state["sampling_ms"] for state in states), 1
+            ),
+            "routes": {
+                route: {
+                    "requests": requests[route],
+                    "samples": samples_by_route[route],
+                }
+                for route in sorted(set(requests) | set(samples_by_route))
+            },
+        }
+
+    @staticmethod
+    def _frame_label(frame):
+        name, filename, line = frame
+        return f"{name} ({os.path.basename(filename)}:{line})"
+
+    def collapsed(self, route=None):
+        """Pilas en formato collapsed: 'ruta;marco;...;marco muestras' por línea."""
+        frames, stacks, _ = _merge_states(
+            self._worker_states(self._current_session()), route
+        )
+        labels = [self._frame_label(frame).replace(";", ",") for frame in frames]
+        lines = [
+            ";".join([stack_route] + [labels[index] for index in stack]) + f" {count}"
+            for stack_route, stack, count, _ in stacks
+        ]
+        return "\n".join(sorted(lines)) + ("\n" if lines else "")
+
+    def speedscope(self, route=None):
+        """Perfil en el formato de fichero de speedscope (un perfil por ruta)."""
+        states = self._worker_states(self._current_session())
+        frames, stacks, _ = _merge_states(states, route)
+        by_route = {}
+        for stack_route, stack, _, weight in stacks:
+            by_route.setdefault(stack_route, []).append((stack, weight))
+
+        profiles = []
+        for stack_route in sorted(by_route):
+            samples = [list(stack) for stack, _ in by_route[stack_route]]
+            weights = [weight for _, weight in by_route[stack_route]]
+            profiles.append({
+                "type": "sampled",
+                "name": stack_route,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            })
+        pids = ", ".join(str(pid) for pid in sorted({state["pid"] for state in states}))
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": f"TenerifeApp pid {pids or os.getpid()}",
+            "exporter": "tnf-sampling-profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": [
+                {"name": name, "file": filename, "line": line}
+                for name, filename, line in frames
+            ]},
+            "profiles": profiles,
+        }
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler():
+    """Perfilador del proceso, coordinado entre workers si hay backend compartido."""
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = SamplingProfiler(shared_backend=get_shared_backend())
+        return _profiler
@@ -0,0 +1,104 @@
+# rate_limit.py
+"""
+Limitador de frecuencia por token bucket para endpoints costosos (check-in).
+
+Cada clave (usuario o IP) tiene un cubo de `capacity` fichas que se recarga a
+`rate` fichas por segundo. Los cubos viven en un OrderedDict acotado a
+`max_keys` entradas: al superarlo se expulsan las claves menos usadas (LRU),
+que son las inactivas, cuyo cubo estaría lleno de todos modos.
+
+Si hay backend compartido (shared_backend), además se aplica un contador por
+ventana fija común a todos los workers, con la misma capacidad por ventana
+que admite el cubo. Si el backend falla, se deja pasar la petición.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketLimiter:
+    """Token bucket por clave con memoria acotada y tier compartido opcional."""
+
+    def __init__(self, name, rate, capacity, max_keys=100_000, shared_backend=None):
+        """
+        Args:
+            name: Prefijo de las claves (p. ej. 'checkin:user')
+            rate: Fichas recargadas por segundo
+            capacity: Fichas máximas (ráfaga permitida)
+            max_keys: Número máximo de cubos en memoria
+            shared_backend: Cliente con API de redis-py o None
+
+        Raises:
+            ValueError: rate no positivo o capacity menor que 1
+        """
+        if not rate > 0:
+            raise ValueError(f"{name}: rate debe ser mayor que 0")
+        if not capacity >= 1:
+            raise ValueError(f"{name}: capacity debe ser al menos 1")
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.max_keys = max_keys
+        self.shared_backend = shared_backend
+        # Ventana del tier compartido: tiempo de recargar el cubo entero
+        self.window_seconds = max(1, math.ceil(self.capacity / self.rate))
+        self._buckets = OrderedDict()  # clave -> [fichas, último instante]
+        self._lock = threading.Lock()
+
+    def _consume_local(self, key, now):
+        """Consume una ficha del cubo local. Devuelve segundos de espera (0 = permitido)."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [self.capacity, now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(
+                    self.capacity, bucket[0] + (now - bucket[1]) * self.rate
+                )
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate
+
+    def _consume_shared(self, key, now):
+        """Cuenta la petición en la ventana compartida. Devuelve segundos de espera."""
+        window = int(now // self.window_seconds)
+        shared_key = f"rl:{self.name}:{key}:{window}"
+        try:
+            count = self.shared_backend.incr(shared_key)
+            if count == 1:
+                self.shared_backend.pexpire(shared_key, self.window_seconds * 1000)
+        except Exception as e:
+            logger.warning(f"Backend compartido no disponible para {self.name}: {e}")
+            return 0.0
+        if count > self.capacity:
+            return (window + 1) * self.window_seconds - now
+        return 0.0
+
+    def hit(self, key):
+        """
+        Registra un intento para la clave.
+
+        Returns:
+            float: 0 si se permite, o segundos a esperar (para Retry-After)
+        """
+        retry_after = self._consume_local(key, time.monotonic())
+        if retry_after or self.shared_backend is None:
+            return retry_after
+        return self._consume_shared(key, time.time())
+
+
+def retry_after_header(retry_after):
+    """Valor entero de la cabecera Retry-After (mínimo 1 segundo)."""
+    return str(max(1, math.ceil(retry_after)))
@@ -0,0 +1,102 @@
+# read_your_writes.py
+"""
+Ventana read-your-writes tras una escritura de un usuario.
+
+Durante READ_YOUR_WRITES_SECONDS después de escribir, las lecturas de ese
+usuario van a la primaria y no pasan por la caché: la réplica puede ir
+atrasada, y una entrada de caché calculada desde ella seguiría sirviéndose
+hasta su TTL.
+
+La marca la tiene que ver el proceso que atienda la siguiente petición, que
+con varios workers de gunicorn (o con asgi_app) rara vez es el que escribió:
+
+- Con backend compartido se guarda en él, con caducidad.
+- Además se devuelve al cliente una cookie firmada (SECRET_KEY) con el
+  user_id, válida durante la ventana, que cualquier worker puede comprobar
+  sin backend compartido.
+- La memoria del proceso queda como respaldo si el backend no responde.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from auth_tokens import SECRET_KEY
+from shared_backend import get_shared_backend
+
+logger = logging.getLogger(__name__)
+
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+RECENT_WRITE_COOKIE = "tnf_recent_write"
+
+_serializer = URLSafeTimedSerializer(SECRET_KEY, salt="tnf-recent-write")
+
+# Usuarios con escrituras recientes: user_id -> instante límite (monotonic).
+# Las ventanas tienen la misma duración, así que el orden de inserción es
+# también el orden de expiración y basta con podar por el principio.
+_recent_writers = OrderedDict()
+_recent_writers_lock = threading.Lock()
+
+
+def _shared_key(user_id):
+    return f"recent_write:{user_id}"
+
+
+def mark_recent_write(user_id):
+    """
+    Abre la ventana read-your-writes del usuario.
+
+    Returns:
+        str: Valor de la cookie RECENT_WRITE_COOKIE para la respuesta
+    """
+    now = time.monotonic()
+    with _recent_writers_lock:
+        _recent_writers.pop(user_id, None)
+        _recent_writers[user_id] = now + READ_YOUR_WRITES_SECONDS
+        while _recent_writers:
+            oldest_user, deadline = next(iter(_recent_writers.items()))
+            if deadline > now:
+                break
+            del _recent_writers[oldest_user]
+
+    backend = get_shared_backend()
+    if backend is not None:
+        try:
+            backend.set(_shared_key(user_id), b"1",
+                        px=int(READ_YOUR_WRITES_SECONDS * 1000))
+        except Exception as e:
+            logger.warning(f"Backend compartido no disponible para read-your-writes: {e}")
+    return _serializer.dumps(int(user_id))
+
+
+def has_recent_write(user_id, cookie=None):
+    """
+    Indica si el usuario escribió dentro de la ventana read-your-writes.
+
+    Args:
+        cookie: Valor de RECENT_WRITE_COOKIE de la petición, si lo trae
+    """
+    if user_id is None:
+        return False
+    if cookie:
+        try:
+            if _serializer.loads(cookie, max_age=READ_YOUR_WRITES_SECONDS) == user_id:
+                return True
+        except BadSignature:
+            pass
+    with _recent_writers_lock:
+        deadline = _recent_writers.get(user_id)
+    if deadline is not None and deadline > time.monotonic():
+        return True
+    backend = get_shared_backend()
+    if backend is None:
+        return False
+    try:
+        return backend.get(_shared_key(user_id)) is not None
+    except Exception as e:
+        logger.warning(f"Backend compartido no disponible para read-your-writes: {e}")
+        return False
@@ -0,0 +1,233 @@
+# route_planner.py
+"""
+Planificador de rutas "planifica mi día".
+
+Ordena las ubicaciones no visitadas cercanas al usuario resolviendo un TSP de
+camino abierto (sale de la posición del usuario y no vuelve) con vecino más
+cercano seguido de 2-opt, limitado por tiempo. Las distancias son haversine
+calculadas con numpy; la matriz entre ubicaciones del catálogo se calcula una
+vez por versión del catálogo y se reutiliza entre peticiones.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371008.8
+
+# Valores de temporada/momento que encajan con cualquier filtro
+ANY_SEASON_VALUES = {"todo el año"}
+ANY_TIME_OF_DAY_VALUES = {"todo el día", "día completo"}
+
+DEFAULT_TIME_BUDGET_MS = 80
+DEFAULT_RADIUS_METERS = 50000
+MAX_CANDIDATES = 200
+
+
+def haversine_matrix(lat_a, lng_a, lat_b, lng_b):
+    """
+    Distancias haversine en metros entre dos conjuntos de puntos.
+
+    Args:
+        lat_a, lng_a: Arrays (n,) en grados
+        lat_b, lng_b: Arrays (m,) en grados
+
+    Returns:
+        np.ndarray: Matriz (n, m) de distancias en metros
+    """
+    lat_a = np.radians(np.asarray(lat_a, dtype=np.float64))[:, None]
+    lng_a = np.radians(np.asarray(lng_a, dtype=np.float64))[:, None]
+    lat_b = np.radians(np.asarray(lat_b, dtype=np.float64))[None, :]
+    lng_b = np.radians(np.asarray(lng_b, dtype=np.float64))[None, :]
+    h = (np.sin((lat_b - lat_a) / 2) ** 2
+         + np.cos(lat_a) * np.cos(lat_b) * np.sin((lng_b - lng_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+class CatalogDistanceMatrix:
+    """Matriz de distancias entre todas las ubicaciones de una versión del catálogo."""
+
+    __slots__ = ("version", "location_ids", "index_by_id", "latitudes",
+                 "longitudes", "matrix")
+
+    def __init__(self, catalog):
+        self.version = catalog.version
+        self.location_ids = np.array(
+            [loc.location_id for loc in catalog.locations], dtype=np.int64
+        )
+        self.index_by_id = {
+            location_id: index
+            for index, location_id in enumerate(self.location_ids.tolist())
+        }
+        self.latitudes = np.array([loc.latitude for loc in catalog.locations])
+        self.longitudes = np.array([loc.longitude for loc in catalog.locations])
+        self.matrix = haversine_matrix(
+            self.latitudes, self.longitudes, self.latitudes, self.longitudes
+        ).astype(np.float32)
+
+
+_matrix_cache = None
+_matrix_lock = threading.Lock()
+
+
+def get_distance_matrix(catalog):
+    """Devuelve la matriz de la versión actual del catálogo, calculándola si cambió."""
+    global _matrix_cache
+    cached = _matrix_cache
+    if cached is not None and cached.version == catalog.version:
+        return cached
+    with _matrix_lock:
+        if _matrix_cache is None or _matrix_cache.version != catalog.version:
+            _matrix_cache = CatalogDistanceMatrix(catalog)
+        return _matrix_cache
+
+
+def _matches(value, wanted, wildcard_values=()):
+    """Compara un atributo de texto con un filtro, sin distinguir mayúsculas."""
+    if not wanted:
+        return True
+    if value is None:
+        return False
+    value = value.casefold()
+    return value == wanted.casefold() or value in wildcard_values
+
+
+def select_candidates(catalog, visited_ids, difficulty=None,
+                      best_time_of_day=None, best_season=None):
+    """
+    Filtra las ubicaciones del catálogo no visitadas que cumplen los filtros.
+
+    Returns:
+        list: Entradas LocationEntry candidatas
+    """
+    return [
+        loc for loc in catalog.locations
+        if loc.location_id not in visited_ids
+        and _matches(loc.difficulty, difficulty)
+        and _matches(loc.best_time_of_day, best_time_of_day, ANY_TIME_OF_DAY_VALUES)
+        and _matches(loc.best_season, best_season, ANY_SEASON_VALUES)
+    ]
+
+
+def _nearest_neighbour_tour(dist):
+    """Recorrido inicial desde el nodo 0 eligiendo siempre el más cercano."""
+    n = dist.shape[0]
+    tour = [0]
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    current = 0
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[current])
+        current = int(np.argmin(row))
+        visited[current] = True
+        tour.append(current)
+    return np.array(tour, dtype=np.int64)
+
+
+def _two_opt(dist, tour, deadline):
+    """
+    Mejora 2-opt de un camino abierto con el primer nodo fijo.
+
+    Se añade un nodo final ficticio a distancia cero de todos, de modo que
+    invertir el tramo final no tiene coste de cierre. Para cada i, la ganancia
+    de todas las j se evalúa de una vez con numpy.
+
+    Returns:
+        tuple: (recorrido mejorado, iteraciones, True si convergió antes del límite)
+    """
+    n = dist.shape[0]
+    extended = np.zeros((n + 1, n + 1), dtype=dist.dtype)
+    extended[:n, :n] = dist
+    tour = np.append(tour, n)
+    iterations = 0
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            if time.perf_counter() > deadline:
+                return tour[:-1], iterations, False
+            a, b = tour[i - 1], tour[i]
+            c = tour[i + 1:n]
+            d = tour[i + 2:n + 1]
+            delta = (extended[a, c] + extended[b, d]
+                     - extended[a, b] - extended[c, d])
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-6:
+                j = i + 1 + best
+                tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+                iterations += 1
+                improved = True
+    return tour[:-1], iterations, True
+
+
+def plan_route(catalog, start_lat, start_lng, candidates, max_stops=None,
+               radius_meters=DEFAULT_RADIUS_METERS, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    """
+    Calcula el orden de visita de las candidatas partiendo de (start_lat, start_lng).
+
+    Args:
+        catalog: CatalogSnapshot activo
+        start_lat, start_lng: Posición del usuario
+        candidates: LocationEntry a ordenar (ver select_candidates)
+        max_stops: Número máximo de paradas (las más cercanas al usuario)
+        radius_meters: Distancia máxima desde el usuario
+        time_budget_ms: Tiempo máximo del solver
+
+    Returns:
+        dict: stops (lista de (LocationEntry, distancia del tramo)),
+        total_distance_meters, candidates_considered y datos del solver
+    """
+    start_time = time.perf_counter()
+    deadline = start_time + time_budget_ms / 1000
+    distances = get_distance_matrix(catalog)
+
+    if not candidates:
+        return {"stops": [], "total_distance_meters": 0.0,
+                "candidates_considered": 0, "iterations": 0,
+                "converged": True, "elapsed_ms": 0.0}
+
+    candidate_by_index = {
+        distances.index_by_id[loc.location_id]: loc for loc in candidates
+    }
+    indices = np.fromiter(candidate_by_index, dtype=np.int64)
+    from_start = haversine_matrix(
+        [start_lat], [start_lng],
+        distances.latitudes[indices], distances.longitudes[indices]
+    )[0]
+
+    keep = np.argsort(from_start, kind="stable")
+    if radius_meters is not None:
+        keep = keep[from_start[keep] <= radius_meters]
+    limit = min(max_stops or MAX_CANDIDATES, MAX_CANDIDATES)
+    keep = keep[:limit]
+    indices = indices[keep]
+    from_start = from_start[keep]
+    n = len(indices)
+
+    # Nodo 0 = posición del usuario; nodos 1..n = candidatas
+    dist = np.empty((n + 1, n + 1), dtype=np.float64)
+    dist[0, 0] = 0.0
+    dist[0, 1:] = from_start
+    dist[1:, 0] = from_start
+    dist[1:, 1:] = distances.matrix[np.ix_(indices, indices)]
+
+    tour = _nearest_neighbour_tour(dist)
+    tour, iterations, converged = _two_opt(dist, tour, deadline)
+
+    stops = []
+    total = 0.0
+    for previous, node in zip(tour[:-1], tour[1:]):
+        leg = float(dist[previous, node])
+        total += leg
+        stops.append((candidate_by_index[int(indices[node - 1])], leg))
+
+    return {
+        "stops": stops,
+        "total_distance_meters": total,
+        "candidates_considered": n,
+        "iterations": iterations,
+        "converged": converged,
+        "elapsed_ms": (time.perf_counter() - start_time) * 1000,
+    }
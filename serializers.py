@@ -0,0 +1,99 @@
+# serializers.py
+"""
+Capa de serialización ligera para las respuestas de la API.
+
+Las consultas seleccionan columnas planas (tuplas de Core) en lugar de
+hidratar objetos ORM, y cada RowEncoder convierte esas tuplas en dicts con un
+orden de campos precalculado. La codificación JSON usa orjson si está
+instalado y json de la librería estándar en caso contrario.
+"""
+
+import json
+from flask import Response
+from sqlalchemy import func
+from models import Location, Municipality
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional
+    orjson = None
+
+
+def dumps(payload):
+    """Serializa a JSON en bytes UTF-8 con claves ordenadas."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Construye una respuesta JSON equivalente a jsonify con el backend rápido."""
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+def json_bytes_response(body, status=200):
+    """Construye una respuesta a partir de JSON ya serializado."""
+    return Response(body, status=status, mimetype='application/json')
+
+
+def json_array_response(fragments, status=200):
+    """Construye una respuesta con un array JSON a partir de elementos ya serializados."""
+    return json_bytes_response(b"[" + b",".join(fragments) + b"]", status)
+
+
+class RowEncoder:
+    """
+    Asocia nombres de campo del JSON con expresiones de columna.
+
+    Las columnas se pasan a db.query(*encoder.columns) y cada fila devuelta
+    se convierte en dict con encoder.encode_one(row).
+    """
+
+    __slots__ = ("fields", "columns")
+
+    def __init__(self, columns):
+        self.fields = tuple(columns)
+        self.columns = tuple(columns.values())
+
+    def encode_one(self, row):
+        """Convierte una fila en dict."""
+        return dict(zip(self.fields, row))
+
+    def encode(self, rows):
+        """Convierte una secuencia de filas en lista de dicts."""
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in rows]
+
+
+_LOCATION_BASE_COLUMNS = {
+    "location_id": Location.location_id,
+    "name": Location.name,
+    "description": Location.description,
+    "latitude": Location.latitude,
+    "longitude": Location.longitude,
+    "municipality_id": Location.municipality_id,
+    "municipality_name": Municipality.name,
+    "difficulty": Location.difficulty,
+    "is_natural": Location.is_natural,
+    "best_season": Location.best_season,
+    "best_time_of_day": Location.best_time_of_day,
+    "main_image_url": Location.main_image_url,
+}
+
+# GET /locations
+LOCATION_LIST_ENCODER = RowEncoder(_LOCATION_BASE_COLUMNS)
+
+# GET /locations/<id>: unlocked_content_url se anula si el usuario no la visitó
+LOCATION_DETAIL_ENCODER = RowEncoder({
+    **_LOCATION_BASE_COLUMNS,
+    "unlocked_content_url": Location.unlocked_content_url,
+})
+
+# GET /users/<id>/visits: sin municipality_id y con LEFT JOIN al municipio
+VISITED_LOCATION_ENCODER = RowEncoder({
+    **{
+        key: column for key, column in _LOCATION_BASE_COLUMNS.items()
+        if key != "municipality_id"
+    },
+    "municipality_name": func.coalesce(Municipality.name, "Desconocido"),
+})
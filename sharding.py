@@ -0,0 +1,363 @@
+# sharding.py
+"""
+Particionado horizontal de las tablas de usuario por user_id.
+
+SHARD_DATABASE_URLS es una lista de URLs separadas por comas, una por shard.
+Si no está definida hay un único shard, que es la base de datos primaria de
+models.py, y todo funciona como antes.
+
+- Las tablas de usuario (USER_TABLES) se reparten por shard: cada usuario
+  vive entero en el shard user_id % N. Un check-in (visita, logros, eventos)
+  es así una transacción local a un shard, y N ficheros SQLite escriben en
+  paralelo en lugar de esperar al mismo bloqueo de escritura.
+- El registro elige el shard con crc32(username) % N y asigna un user_id
+  congruente con ese shard (tabla user_id_sequence). Por eso el login por
+  nombre consulta primero ese shard. La restricción única de users.email es
+  local a cada shard: la API no recoge el email, y si llegara a hacerlo
+  haría falta un directorio en la primaria para que fuera único en total.
+- import_users() reparte los usuarios de una instalación sin shards (que
+  viven en la primaria) conservando su user_id. Su shard no coincide con el
+  del nombre, así que find_username_shard() recurre a los demás shards.
+- El catálogo se escribe en la primaria. replicate_catalog() lo copia a los
+  shards, donde es de solo lectura y sirve únicamente para los joins de las
+  consultas de usuario. app.py lo vuelve a copiar en cada invalidación de
+  'catalog' (replicate_catalog_on_change); el check-in toma la ubicación de
+  la instantánea del catálogo, no de la copia.
+- scatter_gather() ejecuta una función en todos los shards en paralelo, para
+  los agregados entre usuarios (analítica, co-visitas, recálculo de logros).
+
+Las réplicas de lectura de cada shard se toman de SHARD_READ_DATABASE_URLS
+(mismo orden) o, con SQLite, de una conexión de solo lectura al mismo fichero.
+
+Solo app.py (gunicorn) enruta por shards: asgi_app.py usa un único motor
+asíncrono y se niega a arrancar con SHARD_DATABASE_URLS.
+
+Uso al activar el particionado en una instalación existente:
+    python -m poblacion_db.migrations
+    python sharding.py create-tables
+    python sharding.py replicate-catalog
+    python sharding.py import-users
+
+Uso tras modificar el catálogo sin ningún worker en marcha:
+    python sharding.py replicate-catalog
+"""
+
+import logging
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, delete, func, insert, select, update
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, SyncCounter, User, UserIdSequence, engine
+from poblacion_db.session_setup import (
+    ReadSessionLocal, SessionLocal, build_read_engine, read_engine
+)
+from shared_backend import get_shared_backend
+
+logger = logging.getLogger(__name__)
+
+
+def _split_urls(value):
+    return tuple(url.strip() for url in (value or "").split(",") if url.strip())
+
+
+SHARD_DATABASE_URLS = _split_urls(os.getenv('SHARD_DATABASE_URLS'))
+SHARD_READ_DATABASE_URLS = _split_urls(os.getenv('SHARD_READ_DATABASE_URLS'))
+
+# Tablas repartidas por usuario
+USER_TABLES = (
+    "users", "user_location_visits", "user_achievements", "reviews",
+    "user_id_sequence",
+)
+# Tablas que solo existen en la primaria
+PRIMARY_ONLY_TABLES = ("sync_counter", "sync_tombstones")
+# Catálogo replicado, en orden de dependencias (padres primero)
+CATALOG_TABLES = tuple(
+    table.name for table in Base.metadata.sorted_tables
+    if table.name not in USER_TABLES + PRIMARY_ONLY_TABLES
+)
+# Marca de la última versión de sincronización replicada (backend compartido)
+CATALOG_REPLICATION_KEY = "catalog_replicated:{}"
+CATALOG_REPLICATION_KEY_SECONDS = 86400
+
+
+class Shard:
+    """Engines y fábricas de sesiones de un shard."""
+
+    __slots__ = ("index", "engine", "read_engine", "SessionLocal", "ReadSessionLocal")
+
+    def __init__(self, index, shard_engine, shard_read_engine,
+                 session_factory=None, read_session_factory=None):
+        self.index = index
+        self.engine = shard_engine
+        self.read_engine = shard_read_engine
+        self.SessionLocal = session_factory or sessionmaker(
+            autocommit=False, autoflush=False, bind=shard_engine
+        )
+        self.ReadSessionLocal = read_session_factory or sessionmaker(
+            autocommit=False, autoflush=False, bind=shard_read_engine
+        )
+
+    def __repr__(self):
+        return f"<Shard {self.index} {self.engine.url!r}>"
+
+
+class ShardRouter:
+    """Elige el shard de cada usuario y reparte consultas entre todos."""
+
+    def __init__(self, urls=(), read_urls=()):
+        """
+        Args:
+            urls: URL de cada shard; vacío para usar solo la primaria
+            read_urls: URL de la réplica de lectura de cada shard (opcional)
+        """
+        self.sharded = bool(urls)
+        if not urls:
+            self.shards = (Shard(0, engine, read_engine, SessionLocal, ReadSessionLocal),)
+        else:
+            shards = []
+            for index, url in enumerate(urls):
+                shard_engine = create_engine(url, pool_pre_ping=True)
+                read_url = read_urls[index] if index < len(read_urls) else None
+                shards.append(Shard(index, shard_engine, build_read_engine(shard_engine, read_url)))
+            self.shards = tuple(shards)
+        self.count = len(self.shards)
+
+    def shard_for(self, user_id):
+        """Shard que guarda los datos de un usuario."""
+        return self.shards[int(user_id) % self.count]
+
+    def shard_for_username(self, username):
+        """Shard de un nombre de usuario (registro y login)."""
+        return self.shards[zlib.crc32(username.encode('utf-8')) % self.count]
+
+    def find_username_shard(self, username):
+        """
+        Shard donde existe un nombre de usuario, o None.
+
+        Consulta primero el shard del nombre y después los demás, donde
+        están los usuarios importados de la primaria.
+        """
+        first = self.shard_for_username(username)
+        for shard in (first,) + tuple(s for s in self.shards if s is not first):
+            session = shard.SessionLocal()
+            try:
+                if session.query(User.user_id).filter(User.username == username).first():
+                    return shard
+            finally:
+                session.close()
+        return None
+
+    def session_factory(self, shard=None, readonly=False):
+        """Fábrica de sesiones de un shard, o de la primaria (catálogo) si shard es None."""
+        if shard is None:
+            return ReadSessionLocal if readonly else SessionLocal
+        return shard.ReadSessionLocal if readonly else shard.SessionLocal
+
+    def allocate_user_id(self, db_session, shard):
+        """
+        Reserva el siguiente user_id del shard dentro de la transacción.
+
+        El UPDATE toma el bloqueo de escritura antes de leer, así dos registros
+        simultáneos nunca obtienen el mismo id.
+
+        Returns:
+            int, o None sin particionado (autoincremento normal)
+        """
+        if not self.sharded:
+            return None
+        connection = db_session.connection()
+        table = UserIdSequence.__table__
+        result = connection.execute(
+            update(table).values(last_user_id=table.c.last_user_id + self.count)
+        )
+        if result.rowcount == 0:
+            # Primer registro del shard: continúa tras el mayor id existente
+            current = connection.execute(
+                select(func.max(User.__table__.c.user_id))
+            ).scalar() or 0
+            first = current + 1 + (shard.index - current - 1) % self.count
+            connection.execute(insert(table).values(sequence_id=1, last_user_id=first))
+            return first
+        return connection.execute(select(table.c.last_user_id)).scalar()
+
+    def scatter_gather(self, func_, readonly=True, with_shard=False):
+        """
+        Ejecuta func_(sesión) en cada shard, en paralelo.
+
+        Args:
+            with_shard: Llama a func_(sesión, shard)
+
+        Returns:
+            list: Resultado de cada shard, en orden de shard
+        """
+        def run(shard):
+            session = self.session_factory(shard, readonly)()
+            try:
+                if with_shard:
+                    return func_(session, shard)
+                return func_(session)
+            finally:
+                session.close()
+
+        if self.count == 1:
+            return [run(self.shards[0])]
+        with ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="shard") as executor:
+            return list(executor.map(run, self.shards))
+
+    def create_tables(self, drop=False):
+        """Crea (o recrea) en los shards las tablas de usuario y la copia del catálogo."""
+        if not self.sharded:
+            return
+        tables = [
+            table for table in Base.metadata.sorted_tables
+            if table.name not in PRIMARY_ONLY_TABLES
+        ]
+        for shard in self.shards:
+            if drop:
+                Base.metadata.drop_all(bind=shard.engine, tables=tables)
+            Base.metadata.create_all(bind=shard.engine, tables=tables)
+            logger.info(f"Tablas creadas en el shard {shard.index}")
+
+    def replicate_catalog(self):
+        """Copia las tablas del catálogo de la primaria a todos los shards."""
+        if not self.sharded:
+            return
+        tables = [Base.metadata.tables[name] for name in CATALOG_TABLES]
+        with engine.connect() as source:
+            rows = {
+                table.name: [dict(row._mapping) for row in source.execute(select(table))]
+                for table in tables
+            }
+        for shard in self.shards:
+            with shard.engine.begin() as connection:
+                for table in reversed(tables):
+                    connection.execute(delete(table))
+                for table in tables:
+                    if rows[table.name]:
+                        connection.execute(insert(table), rows[table.name])
+        logger.info(
+            f"Catálogo replicado en {self.count} shards "
+            f"({sum(len(table_rows) for table_rows in rows.values())} filas)"
+        )
+
+    def replicate_catalog_on_change(self):
+        """
+        Callback de la invalidación de 'catalog': copia el catálogo a los shards.
+
+        Todos los workers reciben la invalidación. Con backend compartido solo
+        replica el primero que reserva la versión de sincronización actual;
+        sin él replica cada proceso (la copia es idempotente).
+
+        Returns:
+            bool: True si este proceso hizo la copia
+        """
+        if not self.sharded:
+            return False
+        with engine.connect() as connection:
+            version = connection.execute(
+                select(func.max(SyncCounter.__table__.c.version))
+            ).scalar() or 0
+        backend = get_shared_backend()
+        if backend is not None:
+            try:
+                if not backend.set(CATALOG_REPLICATION_KEY.format(version), b"1",
+                                   ex=CATALOG_REPLICATION_KEY_SECONDS, nx=True):
+                    return False
+            except Exception as e:
+                logger.warning(f"Backend compartido no disponible al replicar el catálogo: {e}")
+        self.replicate_catalog()
+        return True
+
+    def import_users(self):
+        """
+        Copia los usuarios de la primaria a sus shards (user_id % N).
+
+        Conserva los user_id, que los clientes ya tienen guardados. Los
+        usuarios que ya existen en su shard se omiten, así que se puede
+        relanzar tras un fallo.
+
+        Returns:
+            int: Usuarios copiados
+        """
+        if not self.sharded:
+            return 0
+        tables = [
+            Base.metadata.tables[name] for name in USER_TABLES
+            if name != "user_id_sequence"
+        ]
+        users = Base.metadata.tables["users"]
+        with engine.connect() as source:
+            user_ids = [row[0] for row in source.execute(select(users.c.user_id))]
+            copied = 0
+            for shard in self.shards:
+                shard_user_ids = [
+                    user_id for user_id in user_ids if user_id % self.count == shard.index
+                ]
+                with shard.engine.begin() as connection:
+                    existing = {row[0] for row in connection.execute(select(users.c.user_id))}
+                    pending = [user_id for user_id in shard_user_ids if user_id not in existing]
+                    for start in range(0, len(pending), 500):
+                        batch = pending[start:start + 500]
+                        for table in tables:
+                            rows = [
+                                dict(row._mapping) for row in source.execute(
+                                    select(table).where(table.c.user_id.in_(batch))
+                                )
+                            ]
+                            if rows:
+                                connection.execute(insert(table), rows)
+                copied += len(pending)
+                logger.info(f"Shard {shard.index}: {len(pending)} usuarios importados")
+        return copied
+
+    def dispose(self):
+        """Cierra las conexiones de todos los shards (antes del fork)."""
+        for shard in self.shards:
+            shard.read_engine.dispose()
+            shard.engine.dispose()
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_shard_router():
+    """Devuelve el enrutador de shards del proceso (según SHARD_DATABASE_URLS)."""
+    global _router
+    if _router is not None:
+        return _router
+    with _router_lock:
+        if _router is None:
+            _router = ShardRouter(SHARD_DATABASE_URLS, SHARD_READ_DATABASE_URLS)
+            if _router.sharded:
+                logger.info(f"Tablas de usuario repartidas en {_router.count} shards")
+        return _router
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Shards de las tablas de usuario")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("create-tables", help="Crea las tablas en los shards")
+    subparsers.add_parser("replicate-catalog", help="Copia el catálogo a los shards")
+    subparsers.add_parser("import-users", help="Copia los usuarios de la primaria a los shards")
+    args = parser.parse_args()
+
+    router = get_shard_router()
+    if not router.sharded:
+        logger.info("SHARD_DATABASE_URLS no está definida: no hay shards")
+    elif args.command == "create-tables":
+        router.create_tables()
+    elif args.command == "replicate-catalog":
+        router.replicate_catalog()
+    elif args.command == "import-users":
+        router.import_users()
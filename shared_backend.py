@@ -0,0 +1,219 @@
+# shared_backend.py
+"""
+Backend compartido entre workers (Redis) para los subsistemas que lo admiten.
+
+SHARED_BACKEND_URL selecciona el backend:
+    - sin definir: cada subsistema funciona solo en memoria del proceso
+    - redis://...: cliente redis-py (dependencia opcional)
+    - local://: LocalSharedBackend, sustituto en proceso con el mismo
+      subconjunto de la API de redis-py, para desarrollo y pruebas
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SHARED_BACKEND_URL = os.getenv('SHARED_BACKEND_URL')
+
+
+def _to_bytes(value):
+    """Convierte un valor a bytes como lo almacena Redis."""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return str(value).encode('utf-8')
+
+
+class LocalPubSub:
+    """Sustituto en memoria del objeto PubSub de redis-py."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._messages = queue.Queue()
+        self.channels = set()
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            channel = _to_bytes(channel)
+            self._backend._add_subscriber(channel, self)
+            self.channels.add(channel)
+            self._messages.put({
+                "type": "subscribe", "pattern": None, "channel": channel,
+                "data": len(self.channels),
+            })
+
+    def unsubscribe(self, *channels):
+        for channel in channels or tuple(self.channels):
+            channel = _to_bytes(channel)
+            self._backend._remove_subscriber(channel, self)
+            self.channels.discard(channel)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        deadline = time.monotonic() + (timeout or 0.0)
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    message = self._messages.get(timeout=remaining)
+                else:
+                    message = self._messages.get_nowait()
+            except queue.Empty:
+                return None
+            if ignore_subscribe_messages and message["type"] != "message":
+                continue
+            return message
+
+    def close(self):
+        self.unsubscribe()
+
+
+class LocalSharedBackend:
+    """
+    Sustituto en memoria de un cliente redis-py.
+
+    Implementa únicamente las operaciones que usa la aplicación, con la misma
+    firma y los mismos tipos de retorno (bytes) que redis-py.
+    """
+
+    # Cada cuántas escrituras se purgan las claves expiradas no leídas
+    SWEEP_EVERY = 1024
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def _count_write(self, now):
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            for name in [n for n, d in self._expires.items() if d <= now]:
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+
+    def _expire_if_needed(self, name, now):
+        deadline = self._expires.get(name)
+        if deadline is not None and deadline <= now:
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+
+    def get(self, name):
+        with self._lock:
+            self._expire_if_needed(name, time.monotonic())
+            return self._data.get(name)
+
+    def set(self, name, value, ex=None, px=None, nx=False):
+        with self._lock:
+            now = time.monotonic()
+            self._expire_if_needed(name, now)
+            if nx and name in self._data:
+                return None
+            self._count_write(now)
+            self._data[name] = _to_bytes(value)
+            self._expires.pop(name, None)
+            if ex is not None:
+                self._expires[name] = now + ex
+            elif px is not None:
+                self._expires[name] = now + px / 1000
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                self._expires.pop(name, None)
+                if self._data.pop(name, None) is not None:
+                    removed += 1
+            return removed
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            self._expire_if_needed(name, now)
+            self._count_write(now)
+            value = int(self._data.get(name, b"0")) + amount
+            self._data[name] = _to_bytes(value)
+            return value
+
+    def pexpire(self, name, time_ms):
+        with self._lock:
+            if name not in self._data:
+                return False
+            self._expires[name] = time.monotonic() + time_ms / 1000
+            return True
+
+    # Publicación/suscripción
+
+    def _add_subscriber(self, channel, pubsub):
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(pubsub)
+
+    def _remove_subscriber(self, channel, pubsub):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(pubsub)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def pubsub(self):
+        return LocalPubSub(self)
+
+    def publish(self, channel, message):
+        channel = _to_bytes(channel)
+        message = {
+            "type": "message", "pattern": None, "channel": channel,
+            "data": _to_bytes(message),
+        }
+        with self._lock:
+            subscribers = tuple(self._subscribers.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub._messages.put(message)
+        return len(subscribers)
+
+
+_backend = None
+_backend_initialized = False
+_backend_lock = threading.Lock()
+
+
+def _create_backend():
+    """Crea el cliente a partir de SHARED_BACKEND_URL."""
+    if not SHARED_BACKEND_URL:
+        return None
+    if SHARED_BACKEND_URL.startswith('local://'):
+        return LocalSharedBackend()
+    try:
+        import redis
+    except ImportError:
+        logger.error(
+            "SHARED_BACKEND_URL requiere el paquete 'redis'. "
+            "Se usará solo memoria local."
+        )
+        return None
+    return redis.Redis.from_url(SHARED_BACKEND_URL)
+
+
+def get_shared_backend():
+    """
+    Devuelve el cliente compartido configurado en SHARED_BACKEND_URL.
+
+    Returns:
+        Cliente con API de redis-py, o None si no hay backend compartido.
+    """
+    global _backend, _backend_initialized
+    if _backend_initialized:
+        return _backend
+    with _backend_lock:
+        if not _backend_initialized:
+            _backend = _create_backend()
+            _backend_initialized = True
+            if _backend is not None:
+                logger.info(f"Backend compartido configurado: {SHARED_BACKEND_URL}")
+        return _backend
@@ -0,0 +1,137 @@
+# sync.py
+"""
+Sincronización incremental del catálogo para el cliente móvil (GET /sync).
+
+Las tablas del catálogo llevan una columna version que se asigna desde un
+contador global al crear o modificar cada fila (ver ChangeTracked en
+models.py); los borrados dejan una lápida en sync_tombstones. El cliente
+guarda la última versión recibida y pide solo lo posterior, de modo que el
+tráfico crece con el tamaño del cambio y no con el del catálogo.
+
+El formato es columnar para no repetir nombres de campo en cada fila:
+
+    {"version": 42, "since": 40, "reset": false,
+     "changes": {"locations": {"columns": [...], "rows": [[...], ...]}},
+     "deleted": {"locations": [7]}}
+
+El repoblamiento (poblacion_db/main_populate.py) borra las tablas sin dejar
+lápidas y guarda en sync_counter.reset_version la versión que reservó. Si el
+cliente tiene una versión anterior a esa, o posterior a la del servidor (base
+de datos restaurada), se responde con reset=true y el catálogo completo, y el
+cliente descarta lo que tenía.
+"""
+
+import gzip
+import logging
+
+from sqlalchemy import func
+
+from models import Achievement, Level, Location, Municipality, SyncCounter, SyncTombstone
+from serializers import dumps
+
+try:
+    import zstandard
+except ImportError:  # zstandard es opcional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Tablas sincronizadas y columnas enviadas (sin contenido desbloqueable)
+SYNC_TABLES = {
+    "locations": (Location, (
+        "location_id", "name", "description", "latitude", "longitude",
+        "main_image_url", "difficulty", "is_natural", "best_season",
+        "best_time_of_day", "municipality_id", "checkin_radius_meters",
+        "geofence_polygon", "version",
+    )),
+    "municipalities": (Municipality, (
+        "municipality_id", "name", "island_id", "province_id", "version",
+    )),
+    "achievements": (Achievement, (
+        "achievement_id", "name", "description", "type", "target_entity_type",
+        "target_entity_id", "target_value", "unlocked_image_url", "version",
+    )),
+    "levels": (Level, (
+        "level_id", "name", "visits_required", "image_url", "version",
+    )),
+}
+
+# Por debajo de este tamaño no compensa comprimir
+MIN_COMPRESS_BYTES = 512
+
+
+def current_sync_version(db_session):
+    """Última versión asignada (0 si aún no hay ninguna)."""
+    return db_session.query(func.max(SyncCounter.version)).scalar() or 0
+
+
+def sync_reset_version(db_session):
+    """Versión del último repoblamiento (0 si no lo hubo)."""
+    return db_session.query(func.max(SyncCounter.reset_version)).scalar() or 0
+
+
+def build_sync_payload(db_session, since):
+    """
+    Cambios del catálogo posteriores a la versión since.
+
+    Args:
+        db_session: Sesión de SQLAlchemy activa
+        since: Última versión que tiene el cliente (0 para todo)
+
+    Returns:
+        dict: Payload de GET /sync
+    """
+    version = current_sync_version(db_session)
+    reset = since > version or 0 < since < sync_reset_version(db_session)
+    if reset:
+        since = 0
+
+    changes = {}
+    for table_name, (model, columns) in SYNC_TABLES.items():
+        rows = db_session.query(
+            *(getattr(model, column) for column in columns)
+        ).filter(model.version > since).order_by(model.version).all()
+        if rows:
+            changes[table_name] = {
+                "columns": list(columns),
+                "rows": [list(row) for row in rows],
+            }
+
+    deleted = {}
+    if not reset:
+        for table_name, entity_id in db_session.query(
+            SyncTombstone.table_name, SyncTombstone.entity_id
+        ).filter(SyncTombstone.version > since).order_by(SyncTombstone.version):
+            deleted.setdefault(table_name, []).append(entity_id)
+
+    return {
+        "version": version,
+        "since": since,
+        "reset": reset,
+        "changes": changes,
+        "deleted": deleted,
+    }
+
+
+def negotiate_encoding(accept_encoding):
+    """Elige zstd o gzip según la cabecera Accept-Encoding (None si ninguna)."""
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in (accept_encoding or "").split(",")
+        if not part.strip().endswith("q=0")
+    }
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def encode_body(payload, encoding):
+    """Serializa el payload y lo comprime con la codificación indicada."""
+    body = dumps(payload)
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(body), "zstd"
+    return gzip.compress(body, compresslevel=6), "gzip"
@@ -0,0 +1,65 @@
+# tests/conftest.py
+"""
+Configuración común de las pruebas.
+
+models.py abre la base de datos "./tnfbase.db" relativa al directorio de
+trabajo, así que antes de importar ningún módulo de la aplicación se cambia
+a un directorio temporal: las pruebas nunca tocan la base de desarrollo.
+"""
+
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+os.chdir(tempfile.mkdtemp(prefix="tnf-tests-"))
+for _variable in ("SHARED_BACKEND_URL", "READ_DATABASE_URL", "SHARD_DATABASE_URLS",
+                  "SHARD_READ_DATABASE_URLS"):
+    os.environ.pop(_variable, None)
+os.environ["SECRET_KEY"] = "tests"
+os.environ["ADMIN_TOKEN"] = "admin-tests"
+
+ADMIN_HEADERS = {"X-Admin-Token": "admin-tests"}
+
+# Coordenadas del Auditorio de Tenerife (ubicación 1 del poblamiento)
+AUDITORIO = {"location_id": 1, "latitude": 28.471, "longitude": -16.2527}
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def database():
+    """Base de datos poblada con el catálogo inicial (una por sesión)."""
+    from poblacion_db.main_populate import run_population
+    run_population(force=True)
+    return os.path.abspath("tnfbase.db")
+
+
+@pytest.fixture(scope="session")
+def app(database):
+    from app import app as flask_app
+    flask_app.config["TESTING"] = True
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def register(client):
+    """Registra un usuario nuevo y devuelve (user_id, cabeceras con su token)."""
+    def _register():
+        response = client.post("/register", json={
+            "username": f"tester{next(_usernames)}", "password": "secret123"
+        })
+        assert response.status_code == 201, response.get_json()
+        payload = response.get_json()
+        return payload["user_id"], {"Authorization": f"Bearer {payload['token']}"}
+    return _register
@@ -0,0 +1,107 @@
+# tests/test_achievement_backfill.py
+import os
+from collections import namedtuple
+
+import pytest
+from sqlalchemy import insert
+
+from achievement_backfill import load_checkpoint, run_backfill, save_checkpoint
+from achievement_rules import AchievementRules
+from models import User, UserAchievement, UserLocationVisit
+from sharding import ShardRouter
+
+Location = namedtuple("Location", ("location_id", "municipality_id"))
+Achievement = namedtuple(
+    "Achievement", ("achievement_id", "type", "target_value", "target_entity_id")
+)
+Catalog = namedtuple("Catalog", ("version", "locations", "achievements"))
+
+
+class Geography:
+    def location_ids(self, level, entity_id):
+        return []
+
+
+@pytest.fixture
+def shard(tmp_path):
+    router = ShardRouter([f"sqlite:///{tmp_path / 'backfill.db'}"])
+    router.create_tables(drop=True)
+    yield router.shards[0]
+    router.dispose()
+
+
+def _rules():
+    locations = [Location(location_id, 1) for location_id in range(1, 6)]
+    return AchievementRules(
+        Catalog("v1", locations, [Achievement(1, "total_count", 2, None)]), Geography()
+    )
+
+
+def _seed(shard, user_ids, visits):
+    session = shard.SessionLocal()
+    session.execute(insert(User), [
+        {"user_id": user_id, "username": f"u{user_id}", "password_hash": "x"}
+        for user_id in user_ids
+    ])
+    session.execute(insert(UserLocationVisit), [
+        {"user_id": user_id, "location_id": location_id}
+        for user_id, location_id in visits
+    ])
+    session.commit()
+    session.close()
+
+
+def _awarded(shard):
+    session = shard.SessionLocal()
+    try:
+        return set(session.query(UserAchievement.user_id, UserAchievement.achievement_id))
+    finally:
+        session.close()
+
+
+def test_backfill_awards_and_is_idempotent(shard):
+    _seed(shard, [1, 2, 3], [(1, 1), (1, 2), (2, 1), (3, 3), (3, 4), (3, 5)])
+    stats = run_backfill(_rules(), shard.ReadSessionLocal, shard.SessionLocal,
+                         workers=1, chunk_size=2, checkpoint_path=None)
+    assert stats["users"] == 3
+    assert _awarded(shard) == {(1, 1), (3, 1)}
+    again = run_backfill(_rules(), shard.ReadSessionLocal, shard.SessionLocal,
+                         workers=1, chunk_size=2, checkpoint_path=None)
+    assert again["awarded"] == 0
+
+
+def test_visits_of_users_outside_the_chunk_are_not_credited(shard):
+    # El usuario 2 no existe: sus visitas caen en el rango del bloque [1, 3]
+    _seed(shard, [1, 3], [(1, 1), (2, 2), (2, 3), (3, 4)])
+    session = shard.SessionLocal()
+    session.execute(insert(UserLocationVisit), [{"user_id": 1, "location_id": None}])
+    session.commit()
+    session.close()
+    run_backfill(_rules(), shard.ReadSessionLocal, shard.SessionLocal,
+                 workers=1, checkpoint_path=None)
+    assert _awarded(shard) == set()
+
+
+def test_dry_run_inserts_nothing(shard):
+    _seed(shard, [1], [(1, 1), (1, 2)])
+    stats = run_backfill(_rules(), shard.ReadSessionLocal, shard.SessionLocal,
+                         workers=1, checkpoint_path=None, dry_run=True)
+    assert stats["awarded"] == 1
+    assert _awarded(shard) == set()
+
+
+def test_resumes_from_checkpoint(shard, tmp_path):
+    _seed(shard, [1, 2], [(1, 1), (1, 2), (2, 1), (2, 2)])
+    checkpoint = str(tmp_path / "checkpoint.json")
+    save_checkpoint(checkpoint, [1], 1, {"users": 1, "awarded": 0})
+    run_backfill(_rules(), shard.ReadSessionLocal, shard.SessionLocal,
+                 workers=1, checkpoint_path=checkpoint)
+    assert _awarded(shard) == {(2, 1)}
+    assert not os.path.exists(checkpoint)
+
+
+def test_checkpoint_of_other_achievements_is_ignored(tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    save_checkpoint(checkpoint, [1, 2], 50, {})
+    assert load_checkpoint(checkpoint, [1, 2]) == 50
+    assert load_checkpoint(checkpoint, [1]) == 0
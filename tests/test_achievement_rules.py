@@ -0,0 +1,89 @@
+# tests/test_achievement_rules.py
+from collections import namedtuple
+
+import pytest
+
+from achievement_rules import AchievementRules
+
+Location = namedtuple("Location", ("location_id", "municipality_id"))
+Achievement = namedtuple(
+    "Achievement", ("achievement_id", "type", "target_value", "target_entity_id")
+)
+Catalog = namedtuple("Catalog", ("version", "locations", "achievements"))
+
+# Municipio 1: ubicaciones 1-3; municipio 2: 4-5; municipio 3: 6
+LOCATIONS = [Location(1, 1), Location(2, 1), Location(3, 1),
+             Location(4, 2), Location(5, 2), Location(6, 3)]
+
+
+class Geography:
+    """Isla 1 con los municipios 1 y 2; el municipio 3 está en otra isla."""
+
+    def location_ids(self, level, entity_id):
+        if level == "municipality":
+            return [loc.location_id for loc in LOCATIONS if loc.municipality_id == entity_id]
+        if level == "island" and entity_id == 1:
+            return [1, 2, 3, 4, 5]
+        return []
+
+
+def _rules(*achievements):
+    return AchievementRules(Catalog("v1", LOCATIONS, achievements), Geography())
+
+
+def _unlocked(rules, visits):
+    user_ids = sorted({user_id for user_id, _ in visits})
+    return set(rules.evaluate(
+        user_ids, [user_id for user_id, _ in visits],
+        [location_id for _, location_id in visits]
+    ))
+
+
+def test_rules_come_from_row_type_not_id():
+    # Los id 1-4 tenían antes criterios fijos en el código
+    rules = _rules(
+        Achievement(1, "total_count", 5, None),
+        Achievement(3, "island_complete", None, 1),
+        Achievement(4, "municipality_complete", None, 2),
+    )
+    assert _unlocked(rules, [(7, 1)]) == set()
+    assert _unlocked(rules, [(7, 4), (7, 5)]) == {(7, 4)}
+    assert _unlocked(rules, [(7, loc) for loc in (1, 2, 3, 4, 5)]) == {
+        (7, 1), (7, 3), (7, 4)
+    }
+
+
+def test_total_count_counts_distinct_locations():
+    rules = _rules(Achievement(10, "total_count", 2, None))
+    assert _unlocked(rules, [(1, 1), (1, 1)]) == set()
+    assert _unlocked(rules, [(1, 1), (1, 6)]) == {(1, 10)}
+
+
+def test_municipality_count():
+    rules = _rules(Achievement(10, "municipality_count", 2, None))
+    assert _unlocked(rules, [(1, 1), (1, 2), (1, 3)]) == set()
+    assert _unlocked(rules, [(1, 1), (1, 6)]) == {(1, 10)}
+
+
+def test_block_of_users_is_evaluated_per_user():
+    rules = _rules(Achievement(10, "municipality_complete", None, 2))
+    assert _unlocked(rules, [(1, 4), (2, 5), (3, 4), (3, 5)]) == {(3, 10)}
+
+
+@pytest.mark.parametrize("achievement", [
+    Achievement(10, "total_count", None, None),
+    Achievement(11, "unknown_type", 3, None),
+    Achievement(12, "galaxy_complete", None, 1),
+    Achievement(13, "island_complete", None, 99),
+])
+def test_unusable_rows_are_skipped(achievement):
+    assert _rules(achievement).achievement_ids == []
+
+
+def test_achievement_ids_filter():
+    rules = AchievementRules(
+        Catalog("v1", LOCATIONS, [Achievement(1, "total_count", 1, None),
+                                  Achievement(2, "total_count", 2, None)]),
+        Geography(), achievement_ids={2},
+    )
+    assert rules.achievement_ids == [2]
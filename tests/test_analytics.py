@@ -0,0 +1,130 @@
+# tests/test_analytics.py
+import datetime
+import threading
+import time
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, insert, text
+
+import analytics
+from analytics import AnalyticsSnapshot, load_visit_columns
+from models import UserLocationVisit
+from sharding import ShardRouter
+from visit_history import archive_partition, record_checkin_events
+
+
+@pytest.fixture
+def shard(tmp_path):
+    router = ShardRouter([f"sqlite:///{tmp_path / 'analytics.db'}"])
+    router.create_tables(drop=True)
+    yield router.shards[0]
+    router.dispose()
+
+
+def _event(user_id, location_id, moment, new_visit=False):
+    return {"user_id": user_id, "location_id": location_id, "event_timestamp": moment,
+            "latitude": 28.4, "longitude": -16.3, "distance_meters": 5.0,
+            "new_visit": new_visit}
+
+
+def _seed(shard):
+    session = shard.SessionLocal()
+    session.execute(insert(UserLocationVisit), [
+        # Anterior al log: solo cuenta como primera visita
+        {"user_id": 1, "location_id": 1, "visit_timestamp": datetime.datetime(2024, 1, 5)},
+        # Su check-in está en el log (marzo): no se cuenta dos veces
+        {"user_id": 1, "location_id": 2, "visit_timestamp": datetime.datetime(2024, 3, 2)},
+    ])
+    record_checkin_events(session, [
+        _event(1, 2, datetime.datetime(2024, 3, 2, 10), new_visit=True),
+        _event(1, 2, datetime.datetime(2024, 3, 9, 10)),
+        _event(1, 2, datetime.datetime(2024, 4, 1, 10)),
+        _event(1, 2, datetime.datetime(2024, 4, 2, 10)),
+    ])
+    session.commit()
+    session.close()
+
+
+def test_counts_repeat_checkins_and_first_visits_before_the_log(shard):
+    _seed(shard)
+    session = shard.ReadSessionLocal()
+    location_ids, timestamps = load_visit_columns(session)
+    session.close()
+    assert sorted(location_ids) == [1, 2, 2, 2, 2]
+    assert min(timestamps) == int(datetime.datetime(
+        2024, 1, 5, tzinfo=datetime.timezone.utc).timestamp())
+
+
+def test_archived_months_keep_their_repeat_checkins(shard, tmp_path):
+    _seed(shard)
+    archive_partition(shard.engine, "checkin_events_202403", str(tmp_path / "archive"))
+    session = shard.ReadSessionLocal()
+    location_ids, _ = load_visit_columns(session, str(tmp_path / "archive"))
+    session.close()
+    assert sorted(location_ids) == [1, 2, 2, 2, 2]
+
+
+def test_paged_reads_let_writers_commit_between_pages(shard, monkeypatch):
+    _seed(shard)
+    monkeypatch.setattr(analytics, "ANALYTICS_PAGE_SIZE", 1)
+    session = shard.ReadSessionLocal()
+    rows = analytics._paged_rows(
+        session, UserLocationVisit.visit_id, (UserLocationVisit.location_id,)
+    )
+    assert next(rows) == (1,)
+    writer = create_engine(shard.engine.url, connect_args={"timeout": 0.2})
+    with writer.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO user_location_visits (user_id, location_id) VALUES (2, 3)"
+        ))
+    writer.dispose()
+    assert list(rows) == [(2,), (3,)]
+    session.close()
+
+
+def test_snapshot_series_and_hours():
+    day = 86400
+    snapshot = AnalyticsSnapshot(
+        np.array([1, 1, 2], dtype=np.int64),
+        np.array([day * 3 + 3600 * 9, day * 3 + 3600 * 10, day * 4], dtype=np.int64),
+        {1: ("A", 1, 28.0, -16.0), 2: ("B", 1, 28.2, -16.2)}, {1: "M"},
+    )
+    assert snapshot.visits_series("day", 1) == [{"period": "1970-01-04", "visits": 2}]
+    assert snapshot.visits_series("week") == [
+        {"period": "1969-12-29", "visits": 2}, {"period": "1970-01-05", "visits": 1},
+    ]
+    hours = snapshot.popular_hours(1)
+    assert hours[9]["visits"] == 1 and hours[10]["visits"] == 1
+    assert snapshot.heatmap()["municipalities"][0]["visits"] == 3
+
+
+def test_first_snapshot_is_built_once(monkeypatch):
+    builds = []
+
+    def slow_refresh():
+        builds.append(1)
+        time.sleep(0.1)
+        analytics._snapshot = object()
+        analytics._refreshing = False
+        return analytics._snapshot
+
+    monkeypatch.setattr(analytics, "_snapshot", None)
+    monkeypatch.setattr(analytics, "refresh_analytics_snapshot", slow_refresh)
+    monkeypatch.setattr(analytics, "_start_refresh_timer", lambda: None)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        analytics.get_analytics_snapshot())) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert len(set(map(id, results))) == 1
+
+
+def test_analytics_routes(client):
+    assert client.get("/analytics/visits?granularity=month").status_code == 400
+    response = client.get("/analytics/heatmap")
+    assert response.status_code == 200
+    assert "municipalities" in response.get_json()
@@ -0,0 +1,59 @@
+# tests/test_asgi.py
+import asyncio
+import threading
+
+import pytest
+
+from conftest import AUDITORIO
+
+
+@pytest.fixture(scope="module")
+def asgi(database):
+    import asgi_app
+    return asgi_app
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def _get_json(asgi, path):
+    response = await asgi.app.test_client().get(path)
+    return response.status_code, await response.get_json()
+
+
+def test_locations_filters_match_the_flask_app(asgi, client):
+    for query in ("island_id=1", "province_id=1", "island_id=2", "island_id=1&q=playa"):
+        status, locations = _run(_get_json(asgi, f"/locations?{query}"))
+        expected = client.get(f"/locations?{query}").get_json()
+        assert status == 200
+        assert sorted(loc["location_id"] for loc in locations) == sorted(
+            loc["location_id"] for loc in expected
+        )
+    _, all_locations = _run(_get_json(asgi, "/locations"))
+    _, island_locations = _run(_get_json(asgi, "/locations?island_id=2"))
+    assert len(island_locations) < len(all_locations)
+
+
+def test_checkin_runs_off_the_event_loop(asgi, register, monkeypatch):
+    user_id, headers = register()
+    threads = {}
+    process_checkin = asgi.process_checkin
+
+    def recording_process_checkin(*args):
+        threads["checkin"] = threading.current_thread()
+        return process_checkin(*args)
+
+    monkeypatch.setattr(asgi, "process_checkin", recording_process_checkin)
+
+    async def checkin():
+        threads["loop"] = threading.current_thread()
+        response = await asgi.app.test_client().post(
+            "/checkin", json={"user_id": user_id, **AUDITORIO}, headers=headers
+        )
+        return response.status_code, await response.get_json(), response.headers
+
+    status, payload, response_headers = _run(checkin())
+    assert status == 200 and payload["new_visit_created"]
+    assert threads["checkin"] is not threads["loop"]
+    assert "tnf_recent_write" in response_headers.get("Set-Cookie", "")
@@ -0,0 +1,122 @@
+# tests/test_cache.py
+import threading
+import time
+
+from cache import Cache
+from shared_backend import LocalSharedBackend
+
+
+def _counting(value):
+    """compute() que cuenta sus llamadas."""
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return value
+    return compute, calls
+
+
+def test_get_or_set_computes_once():
+    cache = Cache()
+    compute, calls = _counting(b"uno")
+    assert cache.get_or_set("ns:a", compute) == b"uno"
+    assert cache.get_or_set("ns:a", compute) == b"uno"
+    assert len(calls) == 1
+    stats = cache.stats()["namespaces"]["ns"]
+    assert stats["misses"] == 1 and stats["hits_l1"] == 1
+
+
+def test_none_is_not_stored():
+    cache = Cache()
+    compute, calls = _counting(None)
+    assert cache.get_or_set("ns:a", compute) is None
+    assert cache.get_or_set("ns:a", compute) is None
+    assert len(calls) == 2
+
+
+def test_ttl_expires_entries():
+    cache = Cache()
+    compute, calls = _counting(b"x")
+    cache.get_or_set("ns:a", compute, ttl=0.05)
+    time.sleep(0.1)
+    cache.get_or_set("ns:a", compute, ttl=0.05)
+    assert len(calls) == 2
+
+
+def test_lru_eviction_by_size():
+    cache = Cache(max_bytes=10)
+    cache.get_or_set("ns:a", lambda: b"aaaa")
+    cache.get_or_set("ns:b", lambda: b"bbbb")
+    cache.get_or_set("ns:a", lambda: b"????")   # a pasa a ser la más reciente
+    cache.get_or_set("ns:c", lambda: b"cccc")   # expulsa b
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["size_bytes"] == 8
+    assert cache.get_or_set("ns:a", lambda: b"????") == b"aaaa"
+    assert cache.get_or_set("ns:b", lambda: b"BBBB") == b"BBBB"
+
+
+def test_invalidate_by_tag_and_callbacks():
+    cache = Cache()
+    fired = []
+    cache.on_invalidate("user:1", lambda: fired.append("user:1"))
+    cache.get_or_set("ns:a", lambda: b"a", tags=("user:1",))
+    cache.get_or_set("ns:b", lambda: b"b", tags=("user:2",))
+    cache.invalidate("user:1")
+    assert fired == ["user:1"]
+    assert cache.get_or_set("ns:a", lambda: b"A", tags=("user:1",)) == b"A"
+    assert cache.get_or_set("ns:b", lambda: b"B", tags=("user:2",)) == b"b"
+
+
+def test_concurrent_requests_are_coalesced():
+    cache = Cache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b"lento"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_set("ns:a", slow)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(cache.get_or_set("ns:a", slow)))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == [b"lento", b"lento"]
+    assert len(calls) == 1
+    assert cache.stats()["namespaces"]["ns"]["coalesced"] == 1
+
+
+def test_shared_tier_and_invalidation_across_processes():
+    backend = LocalSharedBackend()
+    first = Cache(shared_backend=backend)
+    second = Cache(shared_backend=backend)
+
+    first.get_or_set("ns:a", lambda: b"v1", tags=("catalog",))
+    assert second.get_or_set("ns:a", lambda: b"otro", tags=("catalog",)) == b"v1"
+    assert second.stats()["namespaces"]["ns"]["hits_l2"] == 1
+
+    # El hilo de escucha se suscribe en segundo plano
+    deadline = time.monotonic() + 5
+    while len(backend._subscribers.get(b"tnf:cache:invalidate", ())) < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    fired = threading.Event()
+    second.on_invalidate("catalog", fired.set)
+    first.invalidate("catalog")
+    assert fired.wait(5)
+    assert second.get_or_set("ns:a", lambda: b"v2", tags=("catalog",)) == b"v2"
+
+
+def test_cache_stats_route(client):
+    response = client.get("/cache/stats")
+    assert response.status_code == 200
+    assert {"entries", "size_bytes", "namespaces"} <= set(response.get_json())
@@ -0,0 +1,67 @@
+# tests/test_catalog.py
+import json
+
+import catalog
+from catalog import get_catalog, load_catalog_snapshot, location_list_payload
+from models import Level
+from poblacion_db.session_setup import ReadSessionLocal, SessionLocal
+
+
+def test_snapshot_indexes_and_serialized_payloads(app):
+    snapshot = get_catalog()
+    entry = snapshot.locations_by_id[1]
+    assert entry in snapshot.locations_by_municipality[entry.municipality_id]
+    assert [loc.name for loc in snapshot.locations] == sorted(
+        loc.name for loc in snapshot.locations
+    )
+    assert json.loads(entry.list_json) == location_list_payload(entry)
+    assert json.loads(entry.detail_locked_json)["unlocked_content_url"] is None
+    assert json.loads(entry.detail_json)["unlocked_content_url"] == entry.unlocked_content_url
+
+
+def test_version_depends_only_on_content(app):
+    db = ReadSessionLocal()
+    try:
+        first = load_catalog_snapshot(db)
+        second = load_catalog_snapshot(db)
+    finally:
+        db.close()
+    assert first.version == second.version
+
+
+def _rename_level(name):
+    db = SessionLocal()
+    try:
+        level = db.query(Level).order_by(Level.level_id).first()
+        previous, level.name = level.name, name
+        db.commit()
+        return previous
+    finally:
+        db.close()
+
+
+def test_reloads_when_sync_counter_advances(app, monkeypatch):
+    before = get_catalog()
+    previous = _rename_level("Nivel renombrado")
+    try:
+        monkeypatch.setattr(catalog, "_next_version_check", 0.0)
+        after = get_catalog()
+        assert after is not before
+        assert after.sync_version > before.sync_version
+        assert after.version != before.version
+        assert "Nivel renombrado" in [level.name for level in after.levels]
+    finally:
+        _rename_level(previous)
+        monkeypatch.setattr(catalog, "_next_version_check", 0.0)
+        get_catalog()
+
+
+def test_location_routes_serve_the_snapshot(client):
+    response = client.get("/locations")
+    assert response.status_code == 200
+    assert [loc["location_id"] for loc in response.get_json()] == [
+        loc.location_id for loc in get_catalog().locations
+    ]
+    detail = client.get("/locations/1").get_json()
+    assert detail["location_id"] == 1 and detail["unlocked_content_url"] is None
+    assert client.get("/locations/999999").status_code == 404
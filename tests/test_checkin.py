@@ -0,0 +1,63 @@
+# tests/test_checkin.py
+import sqlite3
+import time
+
+from conftest import AUDITORIO
+
+
+def test_first_checkin_unlocks_only_matching_achievements(client, register):
+    user_id, headers = register()
+    response = client.post("/checkin", json={"user_id": user_id, **AUDITORIO},
+                           headers=headers)
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload["visit_recorded"] and payload["new_visit_created"]
+    # "Primeros Pasos" pide 5 ubicaciones y "Tinerfeño de Corazón" todas
+    assert payload["unlocked_achievements"] == []
+
+
+def test_repeat_checkin_is_not_a_new_visit(client, register):
+    user_id, headers = register()
+    client.post("/checkin", json={"user_id": user_id, **AUDITORIO}, headers=headers)
+    payload = client.post("/checkin", json={"user_id": user_id, **AUDITORIO},
+                          headers=headers).get_json()
+    assert payload["visit_recorded"] and not payload["new_visit_created"]
+
+
+def test_checkin_outside_geofence(client, register):
+    user_id, headers = register()
+    payload = client.post("/checkin", json={
+        "user_id": user_id, "location_id": 1, "latitude": 28.0, "longitude": -16.7
+    }, headers=headers).get_json()
+    assert payload["visit_recorded"] is False
+    assert payload["distancia_metros"] > 4000
+
+
+def test_checkin_validates_coordinates(client, register):
+    user_id, headers = register()
+    response = client.post("/checkin", json={
+        "user_id": user_id, "location_id": 1, "latitude": 95, "longitude": 0
+    }, headers=headers)
+    assert response.status_code == 400
+
+
+def test_resubmitted_trace_records_each_event_once(client, register, database):
+    user_id, headers = register()
+    now = time.time()
+    trace = {"user_id": user_id, "points": [
+        {"latitude": AUDITORIO["latitude"], "longitude": AUDITORIO["longitude"],
+         "timestamp": now - offset}
+        for offset in (600, 400, 200)
+    ]}
+    first = client.post("/checkin/trace", json=trace, headers=headers).get_json()
+    second = client.post("/checkin/trace", json=trace, headers=headers).get_json()
+    assert [visit["location_id"] for visit in first["visits"]] == [1]
+    assert second["new_visits_count"] == 0
+
+    entered_at = first["visits"][0]["entered_at"]
+    partition = f"checkin_events_{entered_at[:4]}{entered_at[5:7]}"
+    with sqlite3.connect(database) as connection:
+        (count,) = connection.execute(
+            f"SELECT count(*) FROM {partition} WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    assert count == 1
@@ -0,0 +1,82 @@
+# tests/test_covisitation.py
+import threading
+
+import pytest
+
+import covisitation
+import shared_backend
+from covisitation import CovisitationIndex
+
+
+def _index():
+    # Usuarios: {1, 2}, {1, 2, 3}, {2, 3}
+    return CovisitationIndex.from_visits(
+        [(1, 1), (1, 2), (2, 1), (2, 2), (2, 3), (3, 2), (3, 3)], location_ids=[1, 2, 3, 4]
+    )
+
+
+def test_similar_and_recommend():
+    index = _index()
+    assert index.similar(1)[0][0] == 2
+    assert [location_id for location_id, _ in index.recommend([1])] == [2, 3]
+    # Sin historial: las más visitadas
+    assert index.recommend([])[0][0] == 2
+
+
+def test_incremental_visit_updates_neighbours():
+    index = _index()
+    index.record_visit(4, [1])
+    assert 4 in [location_id for location_id, _, _ in index.similar(1)]
+    index.record_visit(5, [4])
+    assert index.similar(5)[0][0] == 4
+
+
+def test_recommend_waits_for_record_visit():
+    index = _index()
+    results = []
+    with index._lock:
+        thread = threading.Thread(target=lambda: results.append(index.recommend([], 10)))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+    thread.join(1)
+    assert results and results[0][0][0] == 2
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "index.npz")
+    _index().save(path)
+    loaded = CovisitationIndex.load(path)
+    assert loaded.similar(1) == _index().similar(1)
+    assert [entry.name for entry in tmp_path.iterdir()] == ["index.npz"]
+
+
+@pytest.fixture
+def isolated_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(covisitation, "COVISITATION_INDEX_PATH", str(tmp_path / "index.npz"))
+    monkeypatch.setattr(covisitation, "_index", None)
+    monkeypatch.setattr(covisitation, "_index_file_mtime", None)
+    monkeypatch.setattr(covisitation, "_build_from_database", _index)
+
+
+def test_refresh_rebuilds_and_saves(isolated_index):
+    stale = CovisitationIndex.from_visits([], location_ids=[1, 2, 3, 4])
+    stale.record_visit(1, [])
+    covisitation._index = stale
+    assert covisitation.refresh_covisitation_index()
+    assert covisitation._index is not stale
+    assert covisitation._index.similar(1)[0][0] == 2
+    assert CovisitationIndex.load(covisitation.COVISITATION_INDEX_PATH).similar(1)
+
+
+def test_refresh_loads_the_index_saved_by_another_worker(isolated_index, monkeypatch):
+    backend = shared_backend.LocalSharedBackend()
+    monkeypatch.setattr(shared_backend, "get_shared_backend", lambda: backend)
+    # Otro worker reservó la reconstrucción de este intervalo
+    backend.set(covisitation.COVISITATION_REBUILD_KEY, b"1")
+    assert not covisitation.refresh_covisitation_index()
+
+    _index().save(covisitation.COVISITATION_INDEX_PATH)
+    assert covisitation.refresh_covisitation_index()
+    assert covisitation._index.similar(1)[0][0] == 2
+    assert not covisitation.refresh_covisitation_index()
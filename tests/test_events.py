@@ -0,0 +1,99 @@
+# tests/test_events.py
+import asyncio
+import json
+
+import pytest
+
+from auth_tokens import event_stream_user_ids, issue_token
+from conftest import ADMIN_HEADERS, AUDITORIO
+from event_bus import EventBus
+
+
+def _first_chunk(response):
+    return next(iter(response.response))
+
+
+def test_events_require_a_token(client):
+    assert client.get("/events").status_code == 401
+    assert client.get("/events", headers={"Authorization": "Bearer nope"}).status_code == 401
+
+
+def test_events_of_other_users_are_forbidden(client, register):
+    user_id, headers = register()
+    response = client.get(f"/events?user_id={user_id + 1}", headers=headers)
+    assert response.status_code == 403
+
+
+def test_events_stream_only_the_authenticated_user(client, register):
+    user_id, headers = register()
+    response = client.get("/events", headers=headers, buffered=False)
+    try:
+        assert response.status_code == 200
+        ready = _first_chunk(response).decode()
+        assert json.loads(ready.split("data: ", 1)[1]) == {"user_ids": [user_id]}
+    finally:
+        response.close()
+
+
+def test_admin_can_stream_all_users(client):
+    response = client.get("/events", headers=ADMIN_HEADERS, buffered=False)
+    try:
+        assert response.status_code == 200
+        assert b'"user_ids": null' in _first_chunk(response)
+    finally:
+        response.close()
+
+
+def test_event_stream_user_ids():
+    token = issue_token(7)
+    assert event_stream_user_ids([], f"Bearer {token}", None) == ([7], None)
+    assert event_stream_user_ids([7], f"Bearer {token}", None) == ([7], None)
+    assert event_stream_user_ids([8], f"Bearer {token}", None)[1][1] == 403
+    assert event_stream_user_ids([], None, "wrong")[1][1] == 401
+    assert event_stream_user_ids([], None, "admin-tests") == (None, None)
+    assert event_stream_user_ids([3], None, "admin-tests") == ([3], None)
+
+
+def test_subscription_filters_users_and_drops_oldest():
+    bus = EventBus()
+    subscription = bus.subscribe([1], max_buffer=2)
+    for index in range(4):
+        bus.publish("checkin", 1, index)
+    bus.publish("checkin", 2, "otro")
+    first, dropped = subscription.get(0)
+    assert dropped == 2 and first["data"] == 2
+    assert subscription.get(0)[0]["data"] == 3
+    assert subscription.get(0.01) == (None, 0)
+    subscription.close()
+    assert bus.subscriber_count == 0
+
+
+def test_subscriber_cap():
+    bus = EventBus()
+    first = bus.subscribe(None, max_subscribers=1)
+    assert bus.subscribe(None, max_subscribers=1) is None
+    first.close()
+    assert bus.subscribe(None, max_subscribers=1) is not None
+
+
+def test_async_subscription_wakes_on_publish():
+    bus = EventBus()
+    subscription = bus.subscribe([1])
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, bus.publish, "checkin", 1, "hola")
+        return await subscription.get_async(timeout=2)
+
+    event, dropped = asyncio.run(scenario())
+    assert event["data"] == "hola" and dropped == 0
+
+
+@pytest.mark.parametrize("path", ["/events", "/events?user_id=1"])
+def test_asgi_events_require_a_token(database, path):
+    from asgi_app import app as asgi_app
+
+    async def request():
+        return (await asgi_app.test_client().get(path)).status_code
+
+    assert asyncio.run(request()) == 401
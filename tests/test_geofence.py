@@ -0,0 +1,80 @@
+# tests/test_geofence.py
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from geofence import METERS_PER_DEGREE, Geofence, PolygonFence
+
+_Entry = namedtuple("_Entry", (
+    "location_id", "latitude", "longitude", "checkin_radius_meters",
+    "geofence_polygon", "geofence_bbox",
+))
+
+LAT, LNG = 28.3, -16.5
+# Desplazamientos en grados de ~100 m
+D_LAT = 100 / METERS_PER_DEGREE
+D_LNG = 100 / (METERS_PER_DEGREE * np.cos(np.radians(LAT)))
+
+
+def _square(size=1.0, points_per_side=1):
+    """Cuadrado de lado 2·size·100 m centrado en (LAT, LNG)."""
+    corners = [(-1, -1), (-1, 1), (1, 1), (1, -1)]
+    vertices = []
+    for (a_lat, a_lng), (b_lat, b_lng) in zip(corners, corners[1:] + corners[:1]):
+        for step in range(points_per_side):
+            t = step / points_per_side
+            vertices.append([LAT + size * D_LAT * (a_lat + t * (b_lat - a_lat)),
+                             LNG + size * D_LNG * (a_lng + t * (b_lng - a_lng))])
+    return vertices
+
+
+def test_polygon_contains_is_concavity_aware():
+    # "L": cuadrado de 200 m sin el cuadrante noreste
+    l_shape = [
+        [LAT - D_LAT, LNG - D_LNG], [LAT + D_LAT, LNG - D_LNG], [LAT + D_LAT, LNG],
+        [LAT, LNG], [LAT, LNG + D_LNG], [LAT - D_LAT, LNG + D_LNG],
+    ]
+    fence = PolygonFence(l_shape)
+    inside = fence.contains(
+        np.array([LAT - 0.5 * D_LAT, LAT + 0.5 * D_LAT, LAT + 0.5 * D_LAT]),
+        np.array([LNG - 0.5 * D_LNG, LNG - 0.5 * D_LNG, LNG + 0.5 * D_LNG]),
+    )
+    assert inside.tolist() == [True, True, False]
+
+
+def test_collinear_vertices_are_simplified():
+    fence = PolygonFence(_square(points_per_side=20))
+    assert fence.original_vertex_count == 80
+    assert fence.vertex_count == 4
+
+
+def test_circle_geofence_uses_the_location_radius():
+    fence = Geofence(_Entry(1, LAT, LNG, 150, None, None), default_radius_meters=4000)
+    inside, distances = fence.evaluate([LAT + D_LAT, LAT + 2 * D_LAT], [LNG, LNG])
+    assert inside.tolist() == [True, False]
+    assert 95 < distances[0] < 105
+    assert fence.describe() == "a menos de 150m"
+
+
+def test_polygon_geofence_with_gps_margin():
+    fence = Geofence(
+        _Entry(1, LAT, LNG, None, json.dumps(_square()), None), default_radius_meters=4000
+    )
+    # Centro, 10 m fuera del borde (margen GPS) y 300 m fuera
+    inside, distances = fence.evaluate(
+        [LAT, LAT + 1.1 * D_LAT, LAT + 4 * D_LAT], [LNG, LNG, LNG]
+    )
+    assert inside.tolist() == [True, True, False]
+    assert distances[0] == 0
+    assert 5 < distances[1] < 15
+    assert 290 < distances[2] < 310
+    assert fence.search_radius_meters > 140
+    assert fence.describe() == "dentro del recinto"
+
+
+def test_invalid_polygon_falls_back_to_the_radius():
+    fence = Geofence(_Entry(1, LAT, LNG, None, "[[28.3, -16.5]]", None),
+                     default_radius_meters=500)
+    assert fence.polygon is None
+    assert fence.evaluate([LAT + 2 * D_LAT], [LNG])[0].tolist() == [True]
@@ -0,0 +1,81 @@
+# tests/test_geography.py
+from geography import GeographyTree
+
+# Un país con dos provincias: una con isla y otra con un municipio sin isla
+ENTITIES = [
+    ("continent", 1, "Europa", None, None),
+    ("country", 1, "España", "continent", 1),
+    ("autonomous_community", 1, "Canarias", "country", 1),
+    ("province", 1, "Santa Cruz de Tenerife", "autonomous_community", 1),
+    ("province", 2, "Las Palmas", "autonomous_community", 1),
+    ("island", 1, "Tenerife", "province", 1),
+    ("municipality", 1, "Santa Cruz", "island", 1),
+    ("municipality", 2, "La Laguna", "island", 1),
+    ("municipality", 3, "Sin isla", "province", 2),
+]
+LOCATIONS = {10: 1, 11: 1, 12: 2, 13: 3}
+
+
+def _tree():
+    return GeographyTree(ENTITIES, LOCATIONS)
+
+
+def test_descendants_are_a_contiguous_range():
+    tree = _tree()
+    province = tree.node("province", 1)
+    names = {tree.names[n] for n in tree.descendants(province)}
+    assert names == {"Tenerife", "Santa Cruz", "La Laguna"}
+    assert [tree.names[n] for n in tree.children(province)] == ["Tenerife"]
+
+
+def test_ancestors_follow_parent_pointers():
+    tree = _tree()
+    node = tree.node("municipality", 2)
+    assert [tree.describe(n)["level"] for n in tree.ancestors(node)] == [
+        "island", "province", "autonomous_community", "country", "continent",
+    ]
+
+
+def test_municipality_without_island_hangs_from_province():
+    tree = _tree()
+    node = tree.node("municipality", 3)
+    assert tree.describe(tree.parent[node])["name"] == "Las Palmas"
+    assert dict(tree.island_by_municipality) == {1: 1, 2: 1}
+
+
+def test_locations_and_counts_per_level():
+    tree = _tree()
+    assert tree.municipality_ids("island", 1) == {1, 2}
+    assert tree.municipality_ids("municipality", 3) == {3}
+    assert tree.municipality_ids("island", 99) == set()
+    assert sorted(tree.location_ids("province", 1)) == [10, 11, 12]
+    assert tree.location_ids("country", 1) == [10, 11, 12, 13]
+    assert tree.describe(tree.node("continent", 1))["location_count"] == 4
+    assert tree.describe(tree.node("province", 2))["location_count"] == 1
+
+
+def test_as_nested_keeps_counts():
+    (root,) = _tree().as_nested()
+    assert root["name"] == "Europa" and root["location_count"] == 4
+    province = root["children"][0]["children"][0]["children"][0]
+    assert province["name"] == "Santa Cruz de Tenerife"
+    assert province["location_count"] == 3
+
+
+def test_geography_routes(client):
+    response = client.get("/geography")
+    assert response.status_code == 200
+    assert response.get_json()[0]["location_count"] >= 1
+
+    response = client.get("/geography/island/1/locations")
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload["level"] == "island"
+    assert payload["ancestors"][0]["level"] == "province"
+    assert payload["location_count"] == len(payload["locations"])
+    assert 1 in [loc["location_id"] for loc in payload["locations"]]
+
+
+def test_geography_route_errors(client):
+    assert client.get("/geography/planet/1/locations").status_code == 400
+    assert client.get("/geography/island/999/locations").status_code == 404
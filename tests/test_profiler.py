@@ -0,0 +1,95 @@
+# tests/test_profiler.py
+import threading
+import time
+
+import pytest
+
+import profiler
+from profiler import SamplingProfiler
+from shared_backend import LocalSharedBackend
+
+
+class CountingBackend(LocalSharedBackend):
+    """Backend local que cuenta las lecturas por clave."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = []
+
+    def get(self, name):
+        self.reads.append(name)
+        return super().get(name)
+
+
+def _busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(100))
+
+
+def test_local_session_samples_profiled_requests():
+    sampler = SamplingProfiler(interval_ms=1)
+    sampler.start(5, route="/checkin")
+    sampler.begin_request("/locations", "locations")  # fuera de la sesión
+    sampler.begin_request("/checkin", "checkin")
+    _busy(0.1)
+    sampler.end_request()
+    sampler.stop()
+    status = sampler.status()
+    assert status["scope"] == "worker" and not status["active"]
+    assert status["routes"]["/checkin"]["requests"] == 1
+    assert status["routes"]["/checkin"]["samples"] > 0
+    assert "/locations" not in status["routes"]
+    assert "_busy" in sampler.collapsed()
+    speedscope = sampler.speedscope()
+    assert speedscope["profiles"][0]["name"] == "/checkin"
+
+
+def test_invalid_sessions_are_rejected():
+    sampler = SamplingProfiler()
+    with pytest.raises(ValueError):
+        sampler.start(0)
+    with pytest.raises(ValueError):
+        sampler.start(5, sample_rate=0)
+
+
+def test_idle_workers_only_read_the_session_version(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILER_IDLE_SYNC_SECONDS", 0)
+    backend = CountingBackend()
+    worker = SamplingProfiler(shared_backend=backend)
+    for _ in range(5):
+        worker.sync()
+    assert backend.reads.count(profiler.SESSION_KEY) == 1
+    assert backend.reads.count(profiler.SESSION_VERSION_KEY) == 5
+
+    # Otro worker arranca una sesión: se lee una vez y este worker se une
+    SamplingProfiler(shared_backend=backend).start(5)
+    backend.reads.clear()
+    worker.sync()
+    assert worker.active
+    assert backend.reads.count(profiler.SESSION_KEY) == 1
+    worker.stop()
+    assert not worker.active
+
+
+def test_request_bookkeeping_is_safe_while_sampling():
+    sampler = SamplingProfiler(interval_ms=1)
+    sampler.start(5)
+    errors = []
+
+    def requests():
+        try:
+            for _ in range(2000):
+                sampler.begin_request("/checkin", "checkin")
+                sampler.end_request()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=requests) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sampler.stop()
+    assert not errors
+    assert sampler.status()["routes"]["/checkin"]["requests"] == 8000
@@ -0,0 +1,55 @@
+# tests/test_rate_limit.py
+import pytest
+
+import checkin_service
+from auth_tokens import issue_token
+from checkin_service import checkin_rate_key
+from conftest import AUDITORIO
+from rate_limit import TokenBucketLimiter, retry_after_header
+
+
+def test_bucket_allows_a_burst_then_waits():
+    limiter = TokenBucketLimiter("test", rate=1, capacity=3)
+    assert [limiter.hit("a") for _ in range(3)] == [0, 0, 0]
+    retry_after = limiter.hit("a")
+    assert 0 < retry_after <= 1
+    assert limiter.hit("b") == 0
+    assert retry_after_header(retry_after) == "1"
+
+
+def test_bucket_keeps_at_most_max_keys():
+    limiter = TokenBucketLimiter("test", rate=1, capacity=1, max_keys=2)
+    for key in "abc":
+        limiter.hit(key)
+    assert list(limiter._buckets) == ["b", "c"]
+
+
+@pytest.mark.parametrize("rate, capacity", [(0, 5), (-1, 5), (1, 0.5)])
+def test_invalid_limits_are_rejected(rate, capacity):
+    with pytest.raises(ValueError):
+        TokenBucketLimiter("test", rate=rate, capacity=capacity)
+
+
+def test_rate_key_uses_the_token_identity():
+    header = f"Bearer {issue_token(7)}"
+    assert checkin_rate_key(7, "10.0.0.1", header) == (7, None)
+    assert checkin_rate_key(8, "10.0.0.1", header)[1][1] == 403
+    assert checkin_rate_key(7, "10.0.0.1", "Bearer nope")[1][1] == 401
+
+
+def test_tokenless_clients_are_keyed_per_ip_unless_a_token_is_required(monkeypatch):
+    assert checkin_rate_key(7, "10.0.0.1", None) == ("10.0.0.1:7", None)
+    monkeypatch.setattr(checkin_service, "CHECKIN_REQUIRE_TOKEN", True)
+    key, error = checkin_rate_key(7, "10.0.0.1", None)
+    assert key is None and error[1] == 401
+
+
+def test_checkin_is_limited_per_user(client, register, monkeypatch):
+    user_id, headers = register()
+    limiter = TokenBucketLimiter("checkin:user:test", rate=0.01, capacity=1)
+    monkeypatch.setattr("app.checkin_user_limiter", limiter)
+    body = {"user_id": user_id, **AUDITORIO}
+    assert client.post("/checkin", json=body, headers=headers).status_code == 200
+    response = client.post("/checkin", json=body, headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
@@ -0,0 +1,48 @@
+# tests/test_read_your_writes.py
+import read_your_writes
+from cache import get_cache
+from conftest import AUDITORIO
+from read_your_writes import RECENT_WRITE_COOKIE, has_recent_write, mark_recent_write
+from shared_backend import LocalSharedBackend
+
+
+def _forget_local_marks():
+    with read_your_writes._recent_writers_lock:
+        read_your_writes._recent_writers.clear()
+
+
+def test_cookie_is_honoured_by_other_processes():
+    cookie = mark_recent_write(41)
+    _forget_local_marks()  # otro worker no tiene la marca en memoria
+    assert has_recent_write(41, cookie)
+    assert not has_recent_write(42, cookie)
+    assert not has_recent_write(41, "cookie-falsificada")
+    assert not has_recent_write(41)
+
+
+def test_shared_backend_mark_is_seen_by_other_processes(monkeypatch):
+    backend = LocalSharedBackend()
+    monkeypatch.setattr(read_your_writes, "get_shared_backend", lambda: backend)
+    mark_recent_write(43)
+    _forget_local_marks()
+    assert has_recent_write(43)
+    assert not has_recent_write(44)
+
+
+def test_write_window_bypasses_user_cache(client, register):
+    user_id, headers = register()
+    # Entrada obsoleta, como la que dejaría otro worker leyendo la réplica
+    get_cache().get_or_set(
+        f"user_visits:{user_id}", lambda: b'{"total_visits": -1}',
+        tags=(f"user:{user_id}",)
+    )
+    response = client.post("/checkin", json={"user_id": user_id, **AUDITORIO},
+                           headers=headers)
+    assert RECENT_WRITE_COOKIE in response.headers.get("Set-Cookie", "")
+    get_cache().get_or_set(
+        f"user_visits:{user_id}", lambda: b'{"total_visits": -1}',
+        tags=(f"user:{user_id}",)
+    )
+    _forget_local_marks()
+    payload = client.get(f"/users/{user_id}/visits").get_json()
+    assert payload["total_visits"] == 1
@@ -0,0 +1,71 @@
+# tests/test_route_planner.py
+import itertools
+from collections import namedtuple
+
+import numpy as np
+
+from conftest import AUDITORIO
+from route_planner import haversine_matrix, plan_route, select_candidates
+
+_Entry = namedtuple("_Entry", (
+    "location_id", "latitude", "longitude", "difficulty", "best_time_of_day", "best_season",
+))
+_Catalog = namedtuple("_Catalog", ("version", "locations"))
+
+
+def _catalog(points, version="test"):
+    return _Catalog(version, tuple(
+        _Entry(location_id, lat, lng, "fácil", "mañana", "todo el año")
+        for location_id, (lat, lng) in enumerate(points, start=1)
+    ))
+
+
+def _path_length(start, points):
+    path = [start] + list(points)
+    return sum(
+        haversine_matrix([a[0]], [a[1]], [b[0]], [b[1]])[0, 0]
+        for a, b in zip(path, path[1:])
+    )
+
+
+def test_stops_along_a_line_are_visited_in_order():
+    # Desordenadas a propósito; el usuario está al oeste
+    catalog = _catalog([(28.3, -16.40), (28.3, -16.48), (28.3, -16.44), (28.3, -16.46)])
+    plan = plan_route(catalog, 28.3, -16.50, list(catalog.locations), time_budget_ms=1000)
+    assert [loc.location_id for loc, _ in plan["stops"]] == [2, 4, 3, 1]
+    assert plan["converged"]
+    assert abs(plan["total_distance_meters"] - sum(leg for _, leg in plan["stops"])) < 1e-6
+
+
+def test_small_tours_are_optimal():
+    rng = np.random.default_rng(3)
+    points = [(28.0 + lat, -16.5 + lng) for lat, lng in rng.uniform(0, 0.3, (7, 2))]
+    catalog = _catalog(points, version="random")
+    start = (28.15, -16.35)
+    plan = plan_route(catalog, *start, list(catalog.locations), time_budget_ms=1000)
+    best = min(_path_length(start, order) for order in itertools.permutations(points))
+    assert plan["total_distance_meters"] <= best * 1.05
+
+
+def test_radius_max_stops_and_filters():
+    catalog = _catalog([(28.3, -16.49), (28.3, -16.48), (28.3, -15.0)], version="filters")
+    plan = plan_route(catalog, 28.3, -16.50, list(catalog.locations),
+                      radius_meters=10000, max_stops=1)
+    assert [loc.location_id for loc, _ in plan["stops"]] == [1]
+    assert select_candidates(catalog, {1}, difficulty="FÁCIL", best_season="verano") == [
+        catalog.locations[1], catalog.locations[2]
+    ]
+    assert select_candidates(catalog, set(), difficulty="difícil") == []
+
+
+def test_route_endpoint(client, register):
+    user_id, _ = register()
+    response = client.get(
+        f"/users/{user_id}/route?latitude={AUDITORIO['latitude']}"
+        f"&longitude={AUDITORIO['longitude']}&radius_km=500"
+    )
+    assert response.status_code == 200
+    stops = response.get_json()["stops"]
+    assert [stop["order"] for stop in stops] == list(range(1, len(stops) + 1))
+    assert client.get(f"/users/{user_id}/route?latitude=200&longitude=0").status_code == 400
+    assert client.get("/users/999999/route?latitude=28&longitude=-16").status_code == 404
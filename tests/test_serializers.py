@@ -0,0 +1,42 @@
+# tests/test_serializers.py
+import json
+
+from serializers import (
+    LOCATION_DETAIL_ENCODER, LOCATION_LIST_ENCODER, VISITED_LOCATION_ENCODER,
+    RowEncoder, dumps, json_array_response, json_response,
+)
+
+
+def test_dumps_sorts_keys_and_keeps_unicode():
+    body = dumps({"b": 1, "a": "Güímar"})
+    assert isinstance(body, bytes)
+    assert body.replace(b" ", b"") == '{"a":"Güímar","b":1}'.encode('utf-8')
+
+
+def test_row_encoder_keeps_field_order():
+    encoder = RowEncoder({"id": "col_id", "name": "col_name"})
+    assert encoder.columns == ("col_id", "col_name")
+    assert encoder.encode_one((1, "Teide")) == {"id": 1, "name": "Teide"}
+    assert encoder.encode([(1, "a"), (2, "b")]) == [
+        {"id": 1, "name": "a"}, {"id": 2, "name": "b"},
+    ]
+
+
+def test_location_encoders_fields():
+    assert LOCATION_DETAIL_ENCODER.fields[:len(LOCATION_LIST_ENCODER.fields)] == \
+        LOCATION_LIST_ENCODER.fields
+    assert LOCATION_DETAIL_ENCODER.fields[-1] == "unlocked_content_url"
+    assert "municipality_id" not in VISITED_LOCATION_ENCODER.fields
+    assert "municipality_name" in VISITED_LOCATION_ENCODER.fields
+
+
+def test_responses(app):
+    with app.app_context():
+        response = json_response({"ok": True}, status=201)
+        assert response.status_code == 201
+        assert response.mimetype == "application/json"
+        assert json.loads(response.get_data()) == {"ok": True}
+
+        response = json_array_response([dumps({"a": 1}), dumps({"a": 2})])
+        assert json.loads(response.get_data()) == [{"a": 1}, {"a": 2}]
+        assert json.loads(json_array_response([]).get_data()) == []
@@ -0,0 +1,71 @@
+# tests/test_sharding.py
+import pytest
+from sqlalchemy import func, select
+
+from conftest import AUDITORIO
+from checkin_service import get_checkin_location, process_checkin
+from models import Location, User
+from sharding import ShardRouter
+
+
+@pytest.fixture
+def router(tmp_path, database):
+    router = ShardRouter([f"sqlite:///{tmp_path / f'shard{index}.db'}" for index in range(2)])
+    router.create_tables(drop=True)
+    yield router
+    router.dispose()
+
+
+def _add_user(router, username):
+    shard = router.shard_for_username(username)
+    session = shard.SessionLocal()
+    user = User(user_id=router.allocate_user_id(session, shard), username=username,
+                password_hash="x")
+    session.add(user)
+    session.commit()
+    user_id = user.user_id
+    session.close()
+    return shard, user_id
+
+
+def test_user_ids_are_congruent_with_their_shard(router):
+    for index in range(6):
+        shard, user_id = _add_user(router, f"shard-user-{index}")
+        assert user_id % router.count == shard.index
+        assert router.shard_for(user_id) is shard
+        assert router.find_username_shard(f"shard-user-{index}") is shard
+    assert router.find_username_shard("nadie") is None
+
+
+def test_scatter_gather_runs_on_every_shard(router):
+    _add_user(router, "ana")
+    _add_user(router, "beatriz")
+    counts = router.scatter_gather(
+        lambda session, shard: (shard.index, session.query(func.count(User.user_id)).scalar()),
+        with_shard=True,
+    )
+    assert [index for index, _ in counts] == [0, 1]
+    assert sum(count for _, count in counts) == 2
+
+
+def test_catalog_change_is_replicated_to_the_shards(router):
+    assert router.replicate_catalog_on_change()
+    for shard in router.shards:
+        with shard.engine.connect() as connection:
+            assert connection.execute(
+                select(func.count()).select_from(Location.__table__)
+            ).scalar() > 0
+
+
+def test_checkin_does_not_read_the_location_from_the_shard_copy(router):
+    # La copia del catálogo del shard está vacía (sin replicar)
+    shard, user_id = _add_user(router, "carla")
+    assert get_checkin_location(AUDITORIO["location_id"]).name
+    session = shard.SessionLocal()
+    payload, status = process_checkin(
+        session, user_id, AUDITORIO["location_id"],
+        AUDITORIO["latitude"], AUDITORIO["longitude"],
+    )
+    session.close()
+    assert status == 200 and payload["visit_recorded"]
+    assert get_checkin_location(10 ** 6) is None
@@ -0,0 +1,74 @@
+# tests/test_sync.py
+import pytest
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Level, SyncCounter, SyncTombstone
+from poblacion_db.migrations import migrate_sync_reset_version
+from sync import build_sync_payload, encode_body
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sync.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _level(level_id, version):
+    return {"level_id": level_id, "name": f"Nivel {level_id}",
+            "visits_required": level_id * 10, "version": version}
+
+
+def test_incremental_changes_and_tombstones(db):
+    db.execute(insert(SyncCounter), [{"counter_id": 1, "version": 5}])
+    db.execute(insert(Level), [_level(1, 2), _level(2, 4)])
+    db.execute(insert(SyncTombstone), [
+        {"table_name": "levels", "entity_id": 3, "version": 5},
+    ])
+    payload = build_sync_payload(db, 3)
+    assert not payload["reset"]
+    assert [row[0] for row in payload["changes"]["levels"]["rows"]] == [2]
+    assert payload["deleted"] == {"levels": [3]}
+
+
+def test_clients_from_before_a_repopulation_are_reset(db):
+    # Repoblamiento con el contador en 7: reserva la versión 8
+    db.execute(insert(SyncCounter), [{"counter_id": 1, "version": 9, "reset_version": 8}])
+    db.execute(insert(Level), [_level(1, 9)])
+
+    stale = build_sync_payload(db, 7)
+    assert stale["reset"] and stale["since"] == 0
+    assert stale["changes"]["levels"]["rows"][0][0] == 1
+
+    assert not build_sync_payload(db, 9)["reset"]
+    assert not build_sync_payload(db, 0)["reset"]
+    assert build_sync_payload(db, 12)["reset"]
+
+
+def test_reset_version_migration(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE sync_counter (counter_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        connection.exec_driver_sql("INSERT INTO sync_counter VALUES (1, 4)")
+        migrate_sync_reset_version(connection)
+        assert connection.exec_driver_sql(
+            "SELECT version, reset_version FROM sync_counter"
+        ).one() == (4, 0)
+    engine.dispose()
+
+
+def test_sync_route_compresses(client):
+    response = client.get("/sync", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers.get("Content-Encoding") == "gzip"
+    assert client.get("/sync?since=-1").status_code == 400
+
+
+def test_encode_body_skips_small_payloads():
+    assert encode_body({"version": 1}, "gzip")[1] is None
@@ -0,0 +1,71 @@
+# tests/test_trace_checkin.py
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from geofence import METERS_PER_DEGREE
+from trace_checkin import GeofenceIndex, detect_visits
+
+_Entry = namedtuple("_Entry", ("location_id", "latitude", "longitude"))
+_Catalog = namedtuple("_Catalog", ("version", "locations"))
+
+# Dos ubicaciones a ~1 km y otra en otra isla
+CATALOG = _Catalog("test", (
+    _Entry(1, 28.30, -16.50),
+    _Entry(2, 28.30 + 1000 / METERS_PER_DEGREE, -16.50),
+    _Entry(3, 28.10, -15.40),
+))
+INDEX = GeofenceIndex(CATALOG, 100)
+
+
+def _trace(*segments):
+    """Segmentos (latitud, longitud, segundos, puntos) seguidos desde t=0."""
+    latitudes, longitudes, timestamps = [], [], []
+    now = 0.0
+    for latitude, longitude, seconds, points in segments:
+        for step in range(points):
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+            timestamps.append(now + step * seconds / max(points - 1, 1))
+        now = timestamps[-1] + 30
+    return np.array(latitudes), np.array(longitudes), np.array(timestamps)
+
+
+def test_only_long_enough_stays_are_detected():
+    latitudes, longitudes, timestamps = _trace(
+        (28.30, -16.50, 200, 5),                          # 200 s en la 1
+        (28.305, -16.50, 60, 2),                          # entre las dos
+        (28.30 + 1000 / METERS_PER_DEGREE, -16.50, 60, 3),  # 60 s en la 2
+    )
+    visits = detect_visits(INDEX, latitudes, longitudes, timestamps, 120)
+    assert [visit["location_id"] for visit in visits] == [1]
+    assert visits[0]["entered_at"] == 0
+    assert visits[0]["dwell_seconds"] == 200
+    assert visits[0]["distance_meters"] < 1
+
+
+def test_leaving_the_geofence_splits_the_stay():
+    latitudes, longitudes, timestamps = _trace(
+        (28.30, -16.50, 90, 3),
+        (28.305, -16.50, 0, 1),
+        (28.30, -16.50, 90, 3),
+    )
+    assert detect_visits(INDEX, latitudes, longitudes, timestamps, 120) == []
+    visits = detect_visits(INDEX, latitudes, longitudes, timestamps, 60)
+    assert len(visits) == 1 and visits[0]["dwell_seconds"] == 90
+
+
+def test_trace_far_from_every_location():
+    latitudes, longitudes, timestamps = _trace((27.0, -18.0, 600, 10))
+    assert detect_visits(INDEX, latitudes, longitudes, timestamps, 60) == []
+
+
+def test_trace_route_rejects_timestamps_outside_the_window(client, register):
+    user_id, headers = register()
+    now = time.time()
+    for timestamp in (now - 8 * 86400, now + 3600, "nan"):
+        response = client.post("/checkin/trace", json={"user_id": user_id, "points": [
+            {"latitude": 28.3, "longitude": -16.5, "timestamp": timestamp},
+        ]}, headers=headers)
+        assert response.status_code == 400, timestamp
@@ -0,0 +1,105 @@
+# tests/test_visit_history.py
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, func, insert, select, text
+from sqlalchemy.schema import CreateTable
+
+import visit_history
+from sharding import ShardRouter
+from visit_history import (
+    archive_old_partitions, iter_archived_events, list_partitions,
+    partition_table, record_checkin_event
+)
+
+
+@pytest.fixture
+def shard(tmp_path):
+    router = ShardRouter([f"sqlite:///{tmp_path / 'history.db'}"])
+    router.create_tables(drop=True)
+    yield router.shards[0]
+    router.dispose()
+
+
+def _record(shard, moment, user_id=1, location_id=1):
+    session = shard.SessionLocal()
+    record_checkin_event(session, user_id, location_id, 28.4, -16.3, 5.0, False, moment)
+    session.commit()
+    session.close()
+
+
+def _count(shard, name):
+    with shard.engine.connect() as connection:
+        return connection.execute(
+            select(func.count()).select_from(partition_table(name))
+        ).scalar()
+
+
+def test_partition_dropped_by_another_process_is_recreated(shard):
+    moment = datetime.datetime(2024, 5, 3, 12)
+    _record(shard, moment)
+    assert (str(shard.engine.url), "checkin_events_202405") in visit_history._known_partitions
+
+    # Otro proceso (p. ej. el trabajo de archivado) elimina la tabla
+    other = create_engine(shard.engine.url)
+    with other.begin() as connection:
+        connection.execute(text("DROP TABLE checkin_events_202405"))
+    other.dispose()
+
+    _record(shard, moment + datetime.timedelta(minutes=5))
+    assert _count(shard, "checkin_events_202405") == 1
+
+
+def test_rolled_back_partition_is_created_again(shard):
+    session = shard.SessionLocal()
+    record_checkin_event(session, 1, 1, 28.4, -16.3, 5.0, False,
+                         datetime.datetime(2024, 6, 1, 8))
+    session.rollback()
+    session.close()
+    _record(shard, datetime.datetime(2024, 6, 1, 9))
+    assert _count(shard, "checkin_events_202406") == 1
+
+
+def test_archive_reads_back_archived_events(shard, tmp_path):
+    _record(shard, datetime.datetime(2024, 1, 10, 8), user_id=2, location_id=7)
+    archive_dir = str(tmp_path / "archive")
+    paths = archive_old_partitions(shard.engine, 2, archive_dir,
+                                   today=datetime.date(2024, 6, 15))
+    assert len(paths) == 1
+    assert list_partitions(shard.engine) == []
+    chunks = list(iter_archived_events(archive_dir, ("user_id", "location_id", "event_timestamp")))
+    assert chunks == [("202401", {
+        "user_id": [2], "location_id": [7],
+        "event_timestamp": [datetime.datetime(2024, 1, 10, 8)],
+    })]
+
+
+def test_duplicate_events_are_ignored(shard):
+    moment = datetime.datetime(2024, 5, 3, 12)
+    _record(shard, moment)
+    _record(shard, moment)
+    _record(shard, moment, location_id=2)
+    assert _count(shard, "checkin_events_202405") == 2
+
+
+def test_existing_duplicates_are_removed_before_the_unique_index(shard):
+    table = partition_table("checkin_events_202404")
+    row = {"user_id": 1, "location_id": 1, "event_timestamp": datetime.datetime(2024, 4, 1),
+           "latitude": 28.4, "longitude": -16.3, "distance_meters": 5.0, "new_visit": False}
+    # Partición creada antes del índice único, con una traza reenviada
+    with shard.engine.begin() as connection:
+        connection.execute(CreateTable(table))
+        connection.execute(insert(table), [row, row])
+    visit_history._known_partitions.clear()
+
+    _record(shard, datetime.datetime(2024, 4, 1))
+    assert _count(shard, "checkin_events_202404") == 1
+
+
+def test_previous_month_is_never_archived(shard, tmp_path):
+    _record(shard, datetime.datetime(2024, 5, 31, 23))
+    _record(shard, datetime.datetime(2024, 4, 30, 23))
+    with pytest.raises(ValueError):
+        archive_old_partitions(shard.engine, 1, str(tmp_path))
+    archive_old_partitions(shard.engine, 2, str(tmp_path), today=datetime.date(2024, 6, 1))
+    assert [month for month, _ in list_partitions(shard.engine)] == ["202405"]
@@ -0,0 +1,215 @@
+# trace_checkin.py
+"""
+Detección de check-ins automáticos sobre trazas GPS (POST /checkin/trace).
+
+Las ubicaciones del catálogo se indexan una vez por versión del catálogo en
+franjas de latitud del ancho del radio máximo y, dentro de cada franja,
+ordenadas por longitud, todo en un único array de claves (franja, longitud).
+Para cada punto de la traza se buscan con searchsorted (vectorizado para
+todos los puntos a la vez) las ubicaciones de su franja y de las dos
+vecinas dentro de la ventana de longitud, y solo para esos pares se calcula
+la distancia haversine con numpy. El coste es O(puntos × log ubicaciones)
+más los pares candidatos, en lugar de puntos × todas las ubicaciones.
+
+Con geovallas poligonales (geofence.py) el índice usa el círculo que contiene
+el polígono y después filtra esos pares con la prueba punto-en-polígono.
+
+Una ubicación cuenta como visitada si la traza permanece dentro de su radio
+al menos min_dwell_seconds de forma continua.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+from route_planner import EARTH_RADIUS_METERS
+
+# Metros por grado de latitud en la misma esfera que usa haversine, con un
+# pequeño margen para que la ventana nunca sea más estrecha que el radio
+METERS_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_METERS / 180 / 1.001
+
+
+def haversine_pairs(lat_a, lng_a, lat_b, lng_b):
+    """Distancia haversine en metros elemento a elemento entre arrays de grados."""
+    lat_a, lng_a, lat_b, lng_b = (
+        np.radians(np.asarray(values, dtype=np.float64))
+        for values in (lat_a, lng_a, lat_b, lng_b)
+    )
+    h = (np.sin((lat_b - lat_a) / 2) ** 2
+         + np.cos(lat_a) * np.cos(lat_b) * np.sin((lng_b - lng_a) / 2) ** 2)
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+# Separación entre franjas en la clave compuesta (mayor que el rango de longitud)
+_BAND_STRIDE = 1000.0
+
+
+class GeofenceIndex:
+    """Ubicaciones ordenadas por (franja de latitud, longitud) con su radio."""
+
+    __slots__ = ("version", "location_ids", "latitudes", "longitudes",
+                 "radii", "band_height", "keys", "polygon_fences")
+
+    def __init__(self, catalog, radius_meters, geofences=None):
+        """
+        Args:
+            catalog: CatalogSnapshot
+            radius_meters: Radio común, o función entrada -> radio en metros
+            geofences: GeofenceSet opcional; sus radios de búsqueda sustituyen
+                a radius_meters y sus polígonos filtran los candidatos
+        """
+        if geofences is not None:
+            radius_meters = geofences.search_radius
+        self.version = catalog.version
+        locations = catalog.locations
+        latitudes = np.array([loc.latitude for loc in locations], dtype=np.float64)
+        longitudes = np.array([loc.longitude for loc in locations], dtype=np.float64)
+        if callable(radius_meters):
+            radii = np.array([radius_meters(loc) for loc in locations], dtype=np.float64)
+        else:
+            radii = np.full(len(locations), float(radius_meters))
+        max_radius = float(radii.max()) if len(radii) else 1.0
+        self.band_height = max(max_radius, 1.0) / METERS_PER_DEGREE_LAT
+
+        keys = self._keys(self._bands(latitudes), longitudes)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.location_ids = np.array(
+            [loc.location_id for loc in locations], dtype=np.int64
+        )[order]
+        self.latitudes = latitudes[order]
+        self.longitudes = longitudes[order]
+        self.radii = radii[order]
+        self.polygon_fences = {}
+        if geofences is not None:
+            for position, location_id in enumerate(self.location_ids.tolist()):
+                fence = geofences.get(location_id)
+                if fence is not None and fence.polygon is not None:
+                    self.polygon_fences[position] = fence
+
+    def _bands(self, latitudes):
+        return np.floor((latitudes + 90.0) / self.band_height)
+
+    @staticmethod
+    def _keys(bands, longitudes):
+        return bands * _BAND_STRIDE + (longitudes + 180.0)
+
+    def candidate_pairs(self, latitudes, longitudes):
+        """
+        Pares (punto, ubicación) dentro del radio de la ubicación.
+
+        Returns:
+            tuple: (índices de punto, posiciones en el índice, distancias)
+        """
+        bands = self._bands(latitudes)
+        # Ventana de longitud equivalente al radio máximo en la latitud del punto
+        half_width = self.band_height / np.maximum(
+            np.cos(np.radians(np.abs(latitudes) + self.band_height)), 1e-6
+        )
+        point_parts, position_parts = [], []
+        for band_offset in (-1.0, 0.0, 1.0):
+            centre = self._keys(bands + band_offset, longitudes)
+            low = np.searchsorted(self.keys, centre - half_width, side="left")
+            high = np.searchsorted(self.keys, centre + half_width, side="right")
+            counts = high - low
+            total = int(counts.sum())
+            if total == 0:
+                continue
+            point_parts.append(np.repeat(np.arange(len(latitudes)), counts))
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            position_parts.append(np.repeat(low, counts) + offsets)
+
+        if not point_parts:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float64)
+        point_index = np.concatenate(point_parts)
+        position = np.concatenate(position_parts)
+
+        distances = haversine_pairs(
+            latitudes[point_index], longitudes[point_index],
+            self.latitudes[position], self.longitudes[position]
+        )
+        inside = distances <= self.radii[position]
+        point_index, position, distances = (
+            point_index[inside], position[inside], distances[inside]
+        )
+        if self.polygon_fences:
+            keep = np.ones(len(position), dtype=bool)
+            for fence_position in np.intersect1d(position, list(self.polygon_fences)):
+                selected = np.flatnonzero(position == fence_position)
+                fence_inside, fence_distances = self.polygon_fences[int(fence_position)].evaluate(
+                    latitudes[point_index[selected]], longitudes[point_index[selected]]
+                )
+                keep[selected] = fence_inside
+                distances[selected] = fence_distances
+            point_index, position, distances = (
+                point_index[keep], position[keep], distances[keep]
+            )
+        return point_index, position, distances
+
+
+def detect_visits(index, latitudes, longitudes, timestamps, min_dwell_seconds):
+    """
+    Ubicaciones en cuya geovalla la traza permaneció lo suficiente.
+
+    Args:
+        index: GeofenceIndex
+        latitudes, longitudes: Arrays de la traza, ordenada por tiempo
+        timestamps: Segundos epoch de cada punto
+        min_dwell_seconds: Permanencia continua mínima
+
+    Returns:
+        list: dicts con location_id, entered_at, dwell_seconds, distance_meters
+        y el punto más cercano (latitude, longitude), ordenados por entrada
+    """
+    points, positions, distances = index.candidate_pairs(latitudes, longitudes)
+    if not len(points):
+        return []
+
+    # Agrupar por ubicación y, dentro de cada una, por orden de punto
+    order = np.lexsort((points, positions))
+    points, positions, distances = points[order], positions[order], distances[order]
+
+    # Una estancia continua se corta al cambiar de ubicación o saltar puntos
+    breaks = np.ones(len(points), dtype=bool)
+    breaks[1:] = (positions[1:] != positions[:-1]) | (points[1:] != points[:-1] + 1)
+    run_starts = np.flatnonzero(breaks)
+    run_ends = np.append(run_starts[1:], len(points)) - 1
+    dwell = timestamps[points[run_ends]] - timestamps[points[run_starts]]
+
+    visits = {}
+    for start, end, run_dwell in zip(run_starts.tolist(), run_ends.tolist(), dwell.tolist()):
+        if run_dwell < min_dwell_seconds:
+            continue
+        position = int(positions[start])
+        closest = start + int(np.argmin(distances[start:end + 1]))
+        location_id = int(index.location_ids[position])
+        if location_id in visits and visits[location_id]["dwell_seconds"] >= run_dwell:
+            continue
+        closest_point = int(points[closest])
+        visits[location_id] = {
+            "location_id": location_id,
+            "entered_at": float(timestamps[points[start]]),
+            "dwell_seconds": float(run_dwell),
+            "distance_meters": float(distances[closest]),
+            "latitude": float(latitudes[closest_point]),
+            "longitude": float(longitudes[closest_point]),
+        }
+    return sorted(visits.values(), key=lambda visit: visit["entered_at"])
+
+
+_index_cache = None
+_index_lock = threading.Lock()
+
+
+def get_geofence_index(catalog, radius_meters, geofences=None):
+    """Índice de la versión actual del catálogo, reconstruido si cambió."""
+    global _index_cache
+    cached = _index_cache
+    if cached is not None and cached.version == catalog.version:
+        return cached
+    with _index_lock:
+        if _index_cache is None or _index_cache.version != catalog.version:
+            _index_cache = GeofenceIndex(catalog, radius_meters, geofences)
+        return _index_cache
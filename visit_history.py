@@ -0,0 +1,412 @@
+# visit_history.py
+"""
+Historial de check-ins particionado por mes.
+
+UserLocationVisit guarda solo la primera visita de cada usuario a cada
+ubicación (tabla pequeña y caliente que usan las consultas de estadísticas).
+Cada check-in aceptado se añade además a un log de eventos append-only
+repartido en una tabla por mes (checkin_events_AAAAMM), creada al vuelo.
+
+Un mismo check-in (usuario, ubicación, instante) se guarda una sola vez:
+cada partición tiene un índice único sobre esas columnas y los inserts
+ignoran los duplicados, así que reenviar una traza no duplica eventos.
+
+El trabajo de archivado compacta las particiones antiguas en ficheros
+columnares comprimidos (Parquet con pyarrow si está instalado; si no,
+columnas JSON con gzip) y elimina la tabla. Nunca archiva el mes en curso
+ni el anterior: las trazas GPS admiten instantes de hasta
+TRACE_MAX_AGE_SECONDS (7 días) y pueden caer en el mes pasado.
+
+Uso del trabajo de archivado:
+    python visit_history.py archive [--keep-months N] [--dir DIRECTORIO]
+"""
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+
+from sqlalchemy import (
+    Boolean, Column, DateTime, Float, Index, Integer, MetaData, Table,
+    event, func, inspect, select
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable, DropTable
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow es opcional
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = "checkin_events_"
+PARTITION_PATTERN = re.compile(rf"^{PARTITION_PREFIX}(\d{{6}})$")
+ARCHIVE_PATTERN = re.compile(
+    rf"^{PARTITION_PREFIX}(\d{{6}})(?:_\d{{14}})?\.(?:parquet|columns\.json\.gz)$"
+)
+VISIT_ARCHIVE_DIR = os.getenv('VISIT_ARCHIVE_DIR', 'visit_archive')
+ARCHIVE_KEEP_MONTHS = int(os.getenv('ARCHIVE_KEEP_MONTHS', 3))
+# Mes en curso y anterior: ventana de llegada de trazas atrasadas
+ARCHIVE_MIN_KEEP_MONTHS = 2
+ARCHIVE_CHUNK_SIZE = 50000
+
+EVENT_COLUMNS = (
+    "event_id", "user_id", "location_id", "event_timestamp",
+    "latitude", "longitude", "distance_meters", "new_visit",
+)
+
+# Las particiones no forman parte de Base.metadata: se crean bajo demanda.
+# Las ya creadas se recuerdan por base de datos (cada shard tiene las suyas),
+# pero solo cuando se confirma la transacción que las creó: si se deshace, la
+# siguiente petición vuelve a emitir el CREATE TABLE. Si otro proceso archiva
+# una partición recordada, el insert falla con "no such table" y se vuelve a
+# crear (ver _insert_events)
+partitions_metadata = MetaData()
+_known_partitions = set()
+_partitions_lock = threading.Lock()
+PENDING_PARTITIONS_KEY = "visit_history_pending_partitions"
+
+
+def partition_name(timestamp):
+    """Nombre de la partición mensual de un instante."""
+    return f"{PARTITION_PREFIX}{timestamp:%Y%m}"
+
+
+def partition_table(name):
+    """Objeto Table de una partición (misma estructura para todos los meses)."""
+    table = partitions_metadata.tables.get(name)
+    if table is not None:
+        return table
+    return Table(
+        name, partitions_metadata,
+        Column("event_id", Integer, primary_key=True),
+        Column("user_id", Integer, nullable=False),
+        Column("location_id", Integer, nullable=False),
+        Column("event_timestamp", DateTime, nullable=False),
+        Column("latitude", Float, nullable=False),
+        Column("longitude", Float, nullable=False),
+        Column("distance_meters", Float),
+        Column("new_visit", Boolean, nullable=False),
+        Index(f"ix_{name}_user_id", "user_id"),
+        Index(f"ux_{name}_user_location_timestamp",
+              "user_id", "location_id", "event_timestamp", unique=True),
+    )
+
+
+def _delete_duplicate_events(connection, table):
+    """Deja un solo evento por (usuario, ubicación, instante): el más antiguo."""
+    keep = select(func.min(table.c.event_id)).group_by(
+        table.c.user_id, table.c.location_id, table.c.event_timestamp
+    )
+    deleted = connection.execute(
+        table.delete().where(table.c.event_id.not_in(keep))
+    ).rowcount
+    logger.warning(f"Eliminados {deleted} eventos duplicados de {table.name}")
+
+
+def _create_index(connection, table, index):
+    """
+    Crea un índice de la partición si falta.
+
+    Las particiones anteriores al índice único pueden tener duplicados (trazas
+    reenviadas): se eliminan antes de crearlo.
+    """
+    try:
+        connection.execute(CreateIndex(index, if_not_exists=True))
+    except IntegrityError:
+        if not index.unique:
+            raise
+        _delete_duplicate_events(connection, table)
+        connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _ensure_partition(db_session, name):
+    """Crea la partición si no existe (idempotente entre workers)."""
+    connection = db_session.connection()
+    key = (str(connection.engine.url), name)
+    pending = db_session.info.setdefault(PENDING_PARTITIONS_KEY, set())
+    if key in _known_partitions or key in pending:
+        return partition_table(name)
+    with _partitions_lock:
+        table = partition_table(name)
+        connection.execute(CreateTable(table, if_not_exists=True))
+        for index in table.indexes:
+            _create_index(connection, table, index)
+    pending.add(key)
+    return table
+
+
+def _forget_partition(db_session, name):
+    """Olvida una partición recordada que ya no existe en la base de datos."""
+    key = (str(db_session.connection().engine.url), name)
+    db_session.info.get(PENDING_PARTITIONS_KEY, set()).discard(key)
+    with _partitions_lock:
+        _known_partitions.discard(key)
+
+
+def _insert_events(db_session, name, rows):
+    """
+    Inserta eventos en una partición, recreándola si otro proceso la eliminó.
+
+    Los eventos ya registrados (mismo usuario, ubicación e instante) se
+    ignoran. El conjunto _known_partitions es local al proceso: el trabajo de
+    archivado (u otro worker) puede haber eliminado la tabla después de
+    recordarla.
+    """
+    table = _ensure_partition(db_session, name)
+    try:
+        db_session.connection().execute(insert(table).on_conflict_do_nothing(), rows)
+    except OperationalError as e:
+        if "no such table" not in str(e.orig):
+            raise
+        logger.warning(f"Partición {name} eliminada por otro proceso; se vuelve a crear")
+        _forget_partition(db_session, name)
+        table = _ensure_partition(db_session, name)
+        db_session.connection().execute(insert(table).on_conflict_do_nothing(), rows)
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_committed_partitions(session):
+    pending = session.info.pop(PENDING_PARTITIONS_KEY, None)
+    if pending:
+        with _partitions_lock:
+            _known_partitions.update(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_partitions(session):
+    session.info.pop(PENDING_PARTITIONS_KEY, None)
+
+
+def record_checkin_event(db_session, user_id, location_id, latitude, longitude,
+                         distance_meters, new_visit, timestamp=None):
+    """
+    Añade un check-in al log de eventos dentro de la transacción de la sesión.
+
+    Args:
+        db_session: Sesión de SQLAlchemy activa
+        new_visit: True si el check-in creó la primera visita
+        timestamp: Instante del check-in (UTC); por defecto, ahora
+    """
+    timestamp = timestamp or datetime.datetime.utcnow()
+    _insert_events(db_session, partition_name(timestamp), [{
+        "user_id": user_id,
+        "location_id": location_id,
+        "event_timestamp": timestamp,
+        "latitude": latitude,
+        "longitude": longitude,
+        "distance_meters": distance_meters,
+        "new_visit": new_visit,
+    }])
+
+
+def record_checkin_events(db_session, events):
+    """
+    Añade varios check-ins al log con un insert por partición.
+
+    Args:
+        db_session: Sesión de SQLAlchemy activa
+        events: dicts con user_id, location_id, latitude, longitude,
+            distance_meters, new_visit y event_timestamp
+    """
+    by_partition = {}
+    for event in events:
+        by_partition.setdefault(partition_name(event["event_timestamp"]), []).append(event)
+    for name, partition_events in by_partition.items():
+        _insert_events(db_session, name, partition_events)
+
+
+def list_partitions(bind):
+    """Devuelve las particiones existentes ordenadas por mes (AAAAMM, nombre)."""
+    partitions = []
+    for name in inspect(bind).get_table_names():
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            partitions.append((match.group(1), name))
+    return sorted(partitions)
+
+
+def _iter_column_chunks(engine, table):
+    """Lee la partición por bloques, devolviendo cada bloque como dict de columnas."""
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, yield_per=ARCHIVE_CHUNK_SIZE
+        ).execute(select(*(table.c[column] for column in EVENT_COLUMNS))
+                  .order_by(table.c.event_id))
+        for partition in result.partitions():
+            yield dict(zip(EVENT_COLUMNS, map(list, zip(*partition))))
+
+
+def _write_parquet(chunks, path):
+    """Escribe los bloques en un Parquet comprimido con zstd, bloque a bloque."""
+    rows = 0
+    writer = None
+    try:
+        for columns in chunks:
+            chunk_table = pyarrow.table(columns)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(
+                    path, chunk_table.schema, compression="zstd"
+                )
+            writer.write_table(chunk_table)
+            rows += chunk_table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def _write_json_columns(chunks, path):
+    """Alternativa sin pyarrow: columnas JSON en un único fichero gzip."""
+    merged = {column: [] for column in EVENT_COLUMNS}
+    for columns in chunks:
+        for column, values in columns.items():
+            merged[column].extend(
+                value.isoformat() if isinstance(value, datetime.datetime) else value
+                for value in values
+            )
+    with gzip.open(path, "wt", encoding="utf-8") as archive_file:
+        json.dump(merged, archive_file)
+    return len(merged["event_id"])
+
+
+def archive_partition(engine, name, archive_dir=VISIT_ARCHIVE_DIR):
+    """
+    Compacta una partición en un fichero columnar y elimina la tabla.
+
+    Returns:
+        tuple: (ruta del fichero, filas archivadas)
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    table = partition_table(name)
+    chunks = _iter_column_chunks(engine, table)
+
+    # Nunca sobrescribir un archivo previo del mismo mes
+    base_name = name
+    if any(entry.startswith(f"{name}.") for entry in os.listdir(archive_dir)):
+        base_name = f"{name}_{datetime.datetime.utcnow():%Y%m%d%H%M%S}"
+
+    if pyarrow is not None:
+        path = os.path.join(archive_dir, f"{base_name}.parquet")
+        rows = _write_parquet(chunks, path)
+    else:
+        path = os.path.join(archive_dir, f"{base_name}.columns.json.gz")
+        rows = _write_json_columns(chunks, path)
+
+    with engine.begin() as connection:
+        connection.execute(DropTable(table, if_exists=True))
+    with _partitions_lock:
+        _known_partitions.discard((str(engine.url), name))
+    logger.info(f"Partición {name} archivada en {path} ({rows} eventos)")
+    return path, rows
+
+
+def archive_dir_for_shard(shard_index, sharded, archive_dir=VISIT_ARCHIVE_DIR):
+    """Directorio de archivo de un shard (con varios, un subdirectorio por shard)."""
+    return os.path.join(archive_dir, f"shard{shard_index}") if sharded else archive_dir
+
+
+def iter_archived_events(archive_dir=VISIT_ARCHIVE_DIR, columns=EVENT_COLUMNS):
+    """
+    Eventos de las particiones archivadas, por bloques de columnas.
+
+    Yields:
+        tuple: (mes AAAAMM, dict columna -> lista de valores), con
+        event_timestamp como datetime UTC sin zona
+    """
+    if not os.path.isdir(archive_dir):
+        return
+    for entry in sorted(os.listdir(archive_dir)):
+        match = ARCHIVE_PATTERN.match(entry)
+        if not match:
+            continue
+        path = os.path.join(archive_dir, entry)
+        if entry.endswith(".parquet"):
+            if pyarrow is None:
+                logger.warning(f"{path} requiere pyarrow para leerse; se omite")
+                continue
+            parquet_file = pyarrow.parquet.ParquetFile(path)
+            for batch in parquet_file.iter_batches(
+                batch_size=ARCHIVE_CHUNK_SIZE, columns=list(columns)
+            ):
+                yield match.group(1), {
+                    column: batch.column(column).to_pylist() for column in columns
+                }
+        else:
+            with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+                merged = json.load(archive_file)
+            chunk = {column: merged[column] for column in columns}
+            if "event_timestamp" in chunk:
+                chunk["event_timestamp"] = [
+                    datetime.datetime.fromisoformat(value)
+                    for value in chunk["event_timestamp"]
+                ]
+            yield match.group(1), chunk
+
+
+def archive_old_partitions(engine, keep_months=ARCHIVE_KEEP_MONTHS,
+                           archive_dir=VISIT_ARCHIVE_DIR, today=None):
+    """
+    Archiva las particiones anteriores a los últimos keep_months meses.
+
+    keep_months cuenta el mes en curso, que sigue recibiendo escrituras, y
+    debe ser al menos ARCHIVE_MIN_KEEP_MONTHS: una traza de hace 7 días
+    todavía puede escribir en el mes anterior.
+
+    Returns:
+        list: Rutas de los ficheros generados
+    """
+    if keep_months < ARCHIVE_MIN_KEEP_MONTHS:
+        raise ValueError(
+            f"keep_months debe ser al menos {ARCHIVE_MIN_KEEP_MONTHS} "
+            "(el mes en curso y el anterior no se archivan)"
+        )
+    today = today or datetime.date.today()
+    month_index = today.year * 12 + today.month - 1 - keep_months
+    cutoff = f"{month_index // 12:04d}{month_index % 12 + 1:02d}"
+
+    archived = []
+    for month, name in list_partitions(engine):
+        if month <= cutoff:
+            path, _ = archive_partition(engine, name, archive_dir)
+            archived.append(path)
+    return archived
+
+
+if __name__ == "__main__":
+    import argparse
+    from sharding import get_shard_router
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    parser = argparse.ArgumentParser(description="Historial de check-ins")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    archive_parser = subparsers.add_parser(
+        "archive", help="Archiva las particiones mensuales antiguas"
+    )
+    archive_parser.add_argument("--keep-months", type=int, default=ARCHIVE_KEEP_MONTHS)
+    archive_parser.add_argument("--dir", default=VISIT_ARCHIVE_DIR)
+    args = parser.parse_args()
+    if args.command == "archive" and args.keep_months < ARCHIVE_MIN_KEEP_MONTHS:
+        parser.error(
+            f"--keep-months debe ser al menos {ARCHIVE_MIN_KEEP_MONTHS} "
+            "(el mes en curso y el anterior no se archivan)"
+        )
+
+    if args.command == "archive":
+        router = get_shard_router()
+        paths = []
+        for shard in router.shards:
+            # Con varios shards, un subdirectorio por shard (mismos nombres de mes)
+            shard_dir = archive_dir_for_shard(shard.index, router.sharded, args.dir)
+            paths.extend(archive_old_partitions(shard.engine, args.keep_months, shard_dir))
+        logger.info(f"Archivado completado: {len(paths)} particiones")